@@ -1,30 +1,89 @@
 import sys, os
 import argparse
+import utils.daemon as daemon
+
+#forward the command to the serve daemon if one is running, it already
+#has the libraries below imported and the matrices loaded
+if __name__ == '__main__':
+    code = daemon.forward(sys.argv[1:])
+    if code != None:
+        sys.exit(code)
+
 import numpy as np
 import pandas as pd
+from collections import OrderedDict
 import pipeline.loadmatrix as lm 
 import pipeline.obtain_estimates as oe
+import pipeline.graph_store as gs
+import pipeline.rich_club as rcl
+import pipeline.dynamic as dyn
+import utils.resources as res
 import statistics.get_ttest as gtt
 import statistics.draw_graphs as dg
 import statistics.glm as glm
+import statistics.glmm as glmm
+import statistics.nbs as nbs
+import statistics.auc as auc
+import statistics.bootstrap as boot
 
 #initialize parser
 parser = argparse.ArgumentParser()
 
 #initialize the positional argument "mode"
-parser.add_argument("mode", help="Choose either full, estimate, ttest, plots or glm.")
+parser.add_argument("mode", help="Choose either full, estimate, dynamic, ttest, plots, glm, glmm, nbs, auc, bootstrap or serve.")
 
 #initialize the optional arguments
 parser.add_argument('-mat', nargs='?', help="The MATLAB Conn file containing the matrices.")
+parser.add_argument('-ts', nargs='?',
+         help="ROI time series files (.npy, .csv or .mat, TxN per subject) to use instead of the Conn file.")
+parser.add_argument('-partial', action='store_true',
+         help="Use partial correlations from a shrinkage estimate of the precision matrix for the time series.")
+parser.add_argument('-shrinkage', nargs='?', type=float,
+         help="Shrinkage intensity for the partial correlations, default is the Ledoit-Wolf estimate.")
+parser.add_argument('-float32', action='store_true', help="Compute the correlation matrices in single precision.")
 parser.add_argument('-id', nargs='?', help="The CSV file containing the ID for the subjects.")
 parser.add_argument('-thr', nargs='?', help="The threshold range or list of thresholds.")
 parser.add_argument('-cut', nargs='?', 
-         help="The part of the matrix that needs to extracted, default is the full matrix. ")
+         help="The part of the matrix that needs to extracted, default is the full matrix. A comma separated list of cuts, optionally named as name=ns:nexms:me, runs all of them on one load. ")
 parser.add_argument('-ws', nargs='?', help="'W' for winter, 'S' for summer.")
+parser.add_argument('-strata', nargs='?', default='Season',
+         help="Column to stratify the t-tests by, from the estimate files or the ID CSV file. Default is Season.")
 parser.add_argument('-dir', nargs='?', help="Path to the estimate files.")
 parser.add_argument('-out', nargs='?', help="Path to where the resulting CSV files should be written to. ")
-
-args = parser.parse_args()
+parser.add_argument('-perm', nargs='?', type=int, default=5000, help="Number of permutations for the NBS, default is 5000.")
+parser.add_argument('-tthr', nargs='?', type=float, default=3.0, help="Primary t-statistic threshold for the NBS, default is 3.0.")
+parser.add_argument('-summary', nargs='?', default='auc',
+         help="Summary of the threshold curves for auc mode: auc, mean, slope or max. Default is auc.")
+parser.add_argument('-boot', nargs='?', type=int, default=2000, help="Number of bootstrap resamples, default is 2000.")
+parser.add_argument('-ci', nargs='?', help="The bootstrap.csv file, to draw confidence intervals as error bars in the plots.")
+parser.add_argument('-subject', nargs='?',
+         help="Column in the ID CSV file identifying subjects across sessions, for a random subject intercept in glmm mode.")
+parser.add_argument('-force', action='store_true', help="Draw all plots again, even those that are up to date.")
+parser.add_argument('-keep', action='store_true',
+         help="Store the thresholded graphs of all thresholds in a compact graphs.npz file.")
+parser.add_argument('-backend', nargs='?', default='auto', choices=['auto', 'dense', 'sparse'],
+         help="Graph backend for the estimates: dense, sparse or auto (by density of the thresholded graph). Default is auto.")
+parser.add_argument('-nodal', action='store_true',
+         help="Also compute the nodal betweenness and local efficiency, and store the nodal measures in nodal.xx.npz files.")
+parser.add_argument('-sources', nargs='?', type=int,
+         help="Number of sampled source nodes for an approximate betweenness, default is all nodes (exact).")
+parser.add_argument('-restarts', nargs='?', type=int, default=0,
+         help="Number of Louvain restarts for consensus communities, default is 0 (a single modularity_und partition).")
+parser.add_argument('-richclub', action='store_true',
+         help="Also compute the rich-club curves of every subject and threshold, stored in richclub.npz.")
+parser.add_argument('-window', nargs='?', type=int,
+         help="Width of the sliding windows in time points, for dynamic mode.")
+parser.add_argument('-step', nargs='?', type=int, default=1,
+         help="Time points between the starts of two sliding windows, default is 1.")
+parser.add_argument('-jobs', nargs='?', type=int, default=1, help="Number of worker processes, default is 1.")
+parser.add_argument('-mem-budget', nargs='?',
+         help="Memory ceiling for the graph theory estimates, e.g. 8G. Default is the available memory.")
+parser.add_argument('-socket', nargs='?', help="The UNIX socket of the serve daemon, default is fmripipe.sock in $XDG_RUNTIME_DIR or in fmripipe-<uid> in the temporary directory.")
+parser.add_argument('-local', action='store_true', help="Run in this process, even if a serve daemon is running.")
+parser.add_argument('-stop', action='store_true', help="With serve, stop the running daemon.")
+
+#the arguments of the command being run, see run()
+args = None
 
 
 #blockPrint and enablePrint by courtesy of 
@@ -39,8 +98,8 @@ def blockPrint():
 def enablePrint():
     sys.stdout = sys.__stdout__
 
-#to estimate the graph theory measures from the given matrices
-def run_graph_estimates(pm,out=args.out):
+#the thresholds given as start:end:stride in percent
+def get_thresholds():
     thresh_tok = args.thr.split(':')
     start = int(thresh_tok[0])
     end = int(thresh_tok[1])
@@ -49,25 +108,69 @@ def run_graph_estimates(pm,out=args.out):
     for i in range(start,(end+stride),stride):
             thresh_list.append(float(i)/100)
 
+    return thresh_list
+
+#to estimate the graph theory measures from the given matrices
+def run_graph_estimates(pm,out=None):
+    if out == None:
+        out = args.out
+    thresh_list = get_thresholds()
+
+    #fewer workers and smaller batches when the run would not fit in memory
+    plan = res.plan_resources(len(pm[0]), len(pm), jobs=args.jobs, budget=args.mem_budget,
+                              nodal=args.nodal, restarts=args.restarts, richclub=args.richclub,
+                              keep=args.keep)
 
     #print('Converting MATLAB matrices to NumPy arrays..')
     print('Running the graph theory estimations..')
+    curves = []
+    #the thresholding of the lowest threshold is kept for -keep
+    encodings = [] if args.keep else None
     for thresh in thresh_list:
         print('Now processing threshold: ' +str(round(100 * thresh,2)) + '%')
-        oe.obtain_estimates(pm, args.id, thresh, out)
+        rc = oe.obtain_estimates(pm, args.id, thresh, out, backend=args.backend,
+                                 nodal=args.nodal, sources=args.sources,
+                                 restarts=args.restarts, jobs=plan['jobs'],
+                                 richclub=args.richclub, chunk=plan['chunk'], threads=plan['threads'],
+                                 encodings=encodings if thresh == min(thresh_list) else None)
+        curves.append(rc)
     print("Graph theory estimates completed on all thresholds")
 
+    #stack the rich-club curves to (subject, threshold, degree level)
+    if args.richclub:
+        rcl.save_rich_club(out, thresh_list, curves)
+
+    #store the thresholded graphs, a single encoding per subject
+    #is enough to rebuild all the thresholds of the sweep
+    if args.keep:
+        print('Storing the thresholded graphs..')
+        gs.save_graphs(pm, min(thresh_list), out, jobs=plan['jobs'], threads=plan['threads'], encs=encodings)
+
+
+#pull out the MATLAB matrices from the Conn MATLAB file, one list per cut,
+#or compute the correlation matrices from ROI time series
+#the daemon keeps them loaded between commands, as long as the files do not change
+def extract_cuts():
+    if args.ts:
+        tss = list(map(str, args.ts.strip('[]').split(',')))
+        dtype = 'float32' if args.float32 else 'float64'
+        load = lambda: OrderedDict([('full', lm.timeseries_interface(tss, partial=args.partial,
+                                                                     shrinkage=args.shrinkage, dtype=dtype))])
+        return daemon.cached(tss, ('ts', args.partial, args.shrinkage, dtype), load)
 
-#pull out the MATLAB matrices from the Conn MATLAB file
-def extract_matlab_mats():
-    if not args.cut:
-        size = 'full'
-    else:
-        size = args.cut
     cms = list(map(str, args.mat.strip('[]').split(',')))
-    pm = lm.conn_interface(cms, size)
 
-    return pm
+    return daemon.cached(cms, ('mat', args.cut), lambda: lm.conn_cuts(cms, lm.parse_cuts(args.cut)))
+
+#the matrices of the first cut, for the modes working on a single cut
+def extract_matlab_mats():
+    return list(extract_cuts().values())[0]
+
+#a single cut writes to the output path itself, several cuts to a subdirectory each
+def cut_path(name, cuts):
+    if len(cuts) == 1:
+        return args.out
+    return args.out + '/' + name
 
 
 #standard error message for when user forgets some parameter, or incorrectly entered
@@ -80,72 +183,134 @@ def error_msg():
 
 
 
-#running the full pipeline
-if args.mode == 'full':
-
-    try:
-        pm = extract_matlab_mats()
-        run_graph_estimates(pm, out=args.out)
-        #get_ttest is called through draw_graphs
-        direc = args.out + '/auto_results/'
-        print('Drawing graphs..')
-        dg.execute(path=direc, go=args.out, dest=args.out)
-
-        print('Full pipeline run completed.')
-    except:
-        error_msg()
-
-
-#running only the graph theory estimates on a MATLAB matrix
-elif args.mode == 'estimate':
-
-    try:
-        pm = extract_matlab_mats()
-        run_graph_estimates(pm)
+#runs a single command, either from the command line or sent to the daemon
+def run(a):
+    global args
+    args = a
+
+    #running the full pipeline
+    if args.mode == 'full':
+
+        try:
+            cuts = extract_cuts()
+            for name, pm in cuts.items():
+                out = cut_path(name, cuts)
+                if len(cuts) > 1:
+                    print('Cut: ' + name)
+                run_graph_estimates(pm, out=out)
+                #get_ttest is called through draw_graphs
+                direc = out + '/auto_results/'
+                print('Drawing graphs..')
+                dg.execute(path=direc, go=out, dest=out, jobs=args.jobs, force=args.force)
+
+            print('Full pipeline run completed.')
+        except:
+            error_msg()
+
+
+    #running only the graph theory estimates on a MATLAB matrix
+    elif args.mode == 'estimate':
+
+        try:
+            #every cut is a view on the same loaded matrices
+            cuts = extract_cuts()
+            for name, pm in cuts.items():
+                if len(cuts) > 1:
+                    print('Cut: ' + name)
+                run_graph_estimates(pm, out=cut_path(name, cuts))
+            print('Done.')
+        except:
+            error_msg()
+
+    #running the graph theory estimates on sliding windows of the ROI time series
+    elif args.mode == 'dynamic':
+
+        try:
+            ts_list = []
+            for f in args.ts.strip('[]').split(','):
+                ts_list.extend(lm.load_timeseries(f))
+            plan = res.plan_resources(ts_list[0].shape[1], len(ts_list), jobs=args.jobs, budget=args.mem_budget)
+            print('Running the graph theory estimations on sliding windows..')
+            dyn.dynamic_main(ts_list, args.id, get_thresholds(), args.window, args.step,
+                             path=args.out, backend=args.backend, jobs=plan['jobs'],
+                             threads=plan['threads'])
+            print('Done.')
+        except:
+            error_msg()
+
+    #running only the t-tests
+    elif args.mode == 'ttest':
+
+        print('Performing t-tests..')
+        strata = [args.ws] if args.ws else None
+        gtt.gtt_run(path=args.dir, strata=strata, dest=args.out, strata_col=args.strata, groupIDcsv=args.id)
         print('Done.')
-    except:
-        error_msg()
-
-#running only the t-tests
-elif args.mode == 'ttest':
-
-    print('Performing t-tests..')
-    if args.ws:
-        gtt.gtt_main(WS=args.ws,path=args.dir, dest=args.out)
-    else:
-        gtt.gtt_main(path=args.dir, dest=args.out)
-    print('Done.')
-
-#running only the drawing of graphs (requires t-test to be run also)
-elif args.mode == 'plots':
-
-    print('Drawing plots..')
-    dg.execute(path=args.dir, go=args.out)
-    print('Done.')
-
-elif args.mode == 'glm':
-
-    print('Performing GLM..')
-    glm.glm(args.dir, s=args.ws)
-    print('')
-    print('GLM comparisons carried out.')
 
+    #running only the drawing of graphs (requires t-test to be run also)
+    elif args.mode == 'plots':
 
-else:
-    error_msg()
-
+        print('Drawing plots..')
+        dg.execute(path=args.dir, go=args.out, ci=args.ci, jobs=args.jobs, force=args.force)
+        print('Done.')
 
+    elif args.mode == 'glm':
 
+        print('Performing GLM..')
+        #a directory of estimate files gets fitted for every threshold and season at once
+        if os.path.isdir(args.dir):
+            if args.ws:
+                glm.glm_batch(args.dir, seasons=[args.ws], jobs=args.jobs, dest=args.out)
+            else:
+                glm.glm_batch(args.dir, jobs=args.jobs, dest=args.out)
+        else:
+            glm.glm(args.dir, s=args.ws, dest=args.out)
+        print('')
+        print('GLM comparisons carried out.')
 
+    #running the mixed model with season as a random effect
+    elif args.mode == 'glmm':
 
+        print('Performing GLMM..')
+        glmm.glmm_main(args.dir, groupIDcsv=args.id, subject=args.subject, jobs=args.jobs, dest=args.out)
+        print('')
+        print('GLMM fitted on all thresholds.')
 
+    #running the network-based statistic on the edges of the matrices
+    elif args.mode == 'nbs':
 
+        pm = extract_matlab_mats()
+        nbs.nbs_main(pm, args.id, s=args.ws, t_thresh=args.tthr, n_perm=args.perm,
+                     jobs=args.jobs, dest=args.out)
+        print('Done.')
 
+    #running the tests on the metrics integrated over all the thresholds
+    elif args.mode == 'auc':
 
+        print('Performing tests on the ' + str(args.summary) + ' of the thresholds..')
+        if args.ws:
+            auc.auc_main(path=args.dir, WS=args.ws, summary=args.summary, dest=args.out)
+        else:
+            auc.auc_main(path=args.dir, summary=args.summary, dest=args.out)
+        print('Done.')
 
+    #running the bootstrap of the group means and effect sizes
+    elif args.mode == 'bootstrap':
 
+        print('Bootstrapping group means and effect sizes..')
+        boot.bootstrap_main(path=args.dir, n_boot=args.boot, jobs=args.jobs, dest=args.out)
+        print('Done.')
 
 
+    else:
+        error_msg()
 
 
+if __name__ == '__main__':
+    args = parser.parse_args()
 
+    #keep the libraries and the prepared matrices in memory, and run the
+    #commands of the clients as they come in
+    if args.mode == 'serve':
+        daemon.serve(run, parser, daemon.socket_path(sys.argv[1:]))
+    else:
+        run(args)
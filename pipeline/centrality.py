@@ -0,0 +1,241 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+from collections import OrderedDict
+import utils.parallel as par
+
+
+'''
+Parameters
+----------
+
+args : tuple
+       (L, sources), the connection-length matrix as a CSR matrix and the
+       source nodes of this chunk, packed in a tuple so the chunk can be
+       sent to a worker process
+
+
+Returns
+-------
+
+delta : (len(sources), N) np.ndarray
+        the dependency of every source on every node, i.e. the contribution
+        of every source to the betweenness of every node
+
+Notes
+-----
+
+Brandes' algorithm. The distances from all sources of the chunk come from
+a single call to scipy's Dijkstra. A link (v, w) lies on a shortest path
+from the source when d(v) + L(v, w) equals d(w); Dijkstra computes d(w)
+as exactly this sum for its chosen predecessor, so the test needs no
+tolerance. The numbers of shortest paths are then counted in order of
+increasing distance, and the dependencies accumulated in reverse order.
+
+'''
+
+def _brandes_chunk(args):
+
+    L, sources = args
+    n = L.shape[0]
+
+    coo = L.tocoo()
+    r, c, l = coo.row, coo.col, coo.data
+
+    D = dijkstra(L, directed=False, indices=sources)
+
+    delta_all = np.zeros((len(sources), n))
+    for k, s in enumerate(sources):
+        d = D[k]
+
+        #the links on a shortest path from s, r is a predecessor of c
+        on = np.isfinite(d[c]) & (d[r] + l == d[c])
+        pred = r[on]
+        succ = c[on]
+
+        #group the predecessors of every node
+        idx = np.argsort(succ, kind='stable')
+        pred = pred[idx].tolist()
+        ptr = np.searchsorted(succ[idx], np.arange(n + 1)).tolist()
+
+        #the reachable nodes by increasing distance, the source first
+        order = np.argsort(d, kind='stable')
+        order = order[np.isfinite(d[order])].tolist()
+
+        sigma = [0.0] * n
+        sigma[s] = 1.0
+        for w in order[1:]:
+            sigma[w] = sum(sigma[v] for v in pred[ptr[w]:ptr[w + 1]])
+
+        delta = [0.0] * n
+        for w in reversed(order[1:]):
+            coeff = (1.0 + delta[w]) / sigma[w]
+            for v in pred[ptr[w]:ptr[w + 1]]:
+                delta[v] += sigma[v] * coeff
+
+        delta[s] = 0.0
+        delta_all[k] = delta
+
+    return delta_all
+
+
+'''
+Parameters
+----------
+
+L : NxN np.ndarray or scipy.sparse matrix
+    undirected connection-length matrix, e.g. from bct.invert
+
+k : int
+    the number of randomly sampled source nodes. None for the exact
+    betweenness, which uses every node as a source.
+
+jobs : int
+       the number of worker processes the source nodes are spread over
+
+seed : int
+       seed for sampling the source nodes
+
+
+Returns
+-------
+
+BC : (N,) np.ndarray
+     node betweenness centrality, the same as bct.betweenness_wei(L)
+
+err : (N,) np.ndarray
+      the standard error of the approximated betweenness of every node,
+      zero for the exact betweenness
+
+Notes
+-----
+
+With k sampled sources the betweenness is estimated as N/k times the sum
+of their dependencies, which is unbiased. The standard error follows from
+the spread of the dependencies across the sampled sources, with the finite
+population correction since the sources are drawn without replacement.
+BC +- 2 * err is roughly a 95% interval.
+
+'''
+
+def betweenness(L, k=None, jobs=1, seed=None):
+
+    L = sp.csr_matrix(L)
+    L.eliminate_zeros()
+    n = L.shape[0]
+
+    if k == None or k >= n:
+        sources = np.arange(n)
+    else:
+        rng = np.random.default_rng(seed)
+        sources = np.sort(rng.choice(n, size=k, replace=False))
+
+    chunks = [ch for ch in np.array_split(sources, max(1, jobs)) if len(ch)]
+    delta = np.concatenate(par.parallel_map(_brandes_chunk, [(L, ch) for ch in chunks], jobs=jobs))
+
+    m = len(sources)
+    if m == n:
+        return (delta.sum(axis=0), np.zeros(n))
+
+    BC = n / m * delta.sum(axis=0)
+    err = n * np.sqrt((1.0 - m / n) * delta.var(axis=0, ddof=1) / m)
+
+    return (BC, err)
+
+
+'''
+Parameters
+----------
+
+cis : (S, N) array like
+      the community affiliation vector of every subject
+
+
+Returns
+-------
+
+M : (S, N, C) np.ndarray
+    one-hot module membership, M[s, i, c] = 1 if node i of subject s is in
+    module c. The modules of every subject are relabelled 0..C_s-1, and C
+    is the largest number of modules of any subject.
+
+codes : (S, N) np.ndarray
+        the relabelled affiliation vectors
+
+'''
+
+def module_onehot(cis):
+
+    cis = np.asarray(cis)
+    codes = np.array([np.unique(ci, return_inverse=True)[1] for ci in cis])
+
+    S, n = codes.shape
+    M = np.zeros((S, n, codes.max() + 1))
+    M[np.arange(S)[:, None], np.arange(n)[None, :], codes] = 1.0
+
+    return (M, codes)
+
+
+'''
+Parameters
+----------
+
+Ws : (S, N, N) np.ndarray
+     the thresholded connectivity matrices of all subjects
+
+cis : (S, N) array like
+      the community affiliation vector of every subject
+
+
+Returns
+-------
+
+d : OrderedDict
+    'degrees_und-deg'             : (S, N) node degree, as bct.degrees_und
+    'strengths_und-str'           : (S, N) node strength, as bct.strengths_und
+    'participation_coef'          : (S, N) as bct.participation_coef
+    'module_degree_zscore-Z'      : (S, N) as bct.module_degree_zscore
+
+Notes
+-----
+
+bctpy loops over the modules of every subject. Here the strength of every
+node towards every module is a single batched matmul of the stack with the
+one-hot module memberships, from which both the participation coefficient
+and the within-module strength follow. The module means and standard
+deviations are again matmuls with the memberships.
+
+'''
+
+def nodal_measures(Ws, cis):
+
+    Ws = np.asarray(Ws, dtype=float)
+    M, codes = module_onehot(cis)
+
+    K = Ws.sum(axis=-1)
+
+    #the strength of every node towards every module
+    Kc = Ws @ M
+
+    d = OrderedDict()
+    d['degrees_und-deg'] = np.count_nonzero(Ws, axis=-1).astype(float)
+    d['strengths_und-str'] = K
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        P = 1.0 - np.sum(Kc * Kc, axis=-1) / (K * K)
+    #P=0 for nodes with no neighbors
+    P[K == 0] = 0
+    d['participation_coef'] = P
+
+    #the strength within the own module, and its mean and std within every module
+    Koi = np.take_along_axis(Kc, codes[..., None], axis=-1)[..., 0]
+    size = M.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.einsum('sn,snc->sc', Koi, M) / size
+        dev = Koi - np.take_along_axis(mean, codes, axis=-1)
+        std = np.sqrt(np.einsum('sn,snc->sc', dev * dev, M) / size)
+        Z = dev / np.take_along_axis(std, codes, axis=-1)
+    Z[~np.isfinite(Z)] = 0
+    d['module_degree_zscore-Z'] = Z
+
+    return d
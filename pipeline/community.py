@@ -0,0 +1,126 @@
+import bct
+import numpy as np
+from collections import OrderedDict
+import utils.parallel as par
+
+
+'''
+Parameters
+----------
+
+args : tuple
+       (W, seeds, gamma), the connectivity matrix, one seed per restart
+       and the resolution parameter, packed in a tuple so the chunk
+       can be sent to a worker process
+
+
+Returns
+-------
+
+agree : NxN np.ndarray
+        the number of restarts in which every pair of nodes were put
+        in the same community
+
+qs : list
+     the modularity Q of every restart
+
+best : (N,) np.ndarray
+       the partition with the highest Q of the chunk
+
+Notes
+-----
+
+The partitions are added to the agreement counts as they are found,
+so only one partition is kept in memory at a time.
+
+'''
+
+def _louvain_chunk(args):
+
+    W, seeds, gamma = args
+
+    n = len(W)
+    agree = np.zeros((n, n), dtype=np.int32)
+    qs = []
+    best = None
+
+    for s in seeds:
+        ci, q = bct.modularity_louvain_und(W, gamma=gamma, seed=int(s))
+        agree += ci[:, None] == ci[None, :]
+        if best is None or q > max(qs):
+            best = ci
+        qs.append(q)
+
+    return (agree, qs, best)
+
+
+'''
+Parameters
+----------
+
+W : NxN np.ndarray
+    undirected weighted connection matrix
+
+restarts : int
+           the number of Louvain restarts R, more restarts give a more
+           stable consensus at the cost of run time
+
+gamma : float
+        resolution parameter of the modularity
+
+tau : float
+      threshold of the agreement matrix, used by bct.consensus_und
+
+jobs : int
+       the number of worker processes the restarts are spread over
+
+seed : int
+       seed for the restarts, the same seed gives the same partitions
+       for any number of jobs
+
+
+Returns
+-------
+
+res : OrderedDict
+      'ci'        : the consensus community affiliation
+      'Q_max'     : the highest modularity of the restarts
+      'Q_mean'    : the mean modularity of the restarts
+      'stability' : mean |2P - 1| over all pairs of nodes, where P is the
+                    fraction of restarts putting the pair in the same
+                    community. 1 if every restart agrees, 0 if the pairs
+                    are split in half of them.
+      'best_ci'   : the partition of the restart with the highest Q
+      'agreement' : the NxN agreement matrix P
+
+Notes
+-----
+
+The consensus partition is found by reclustering the agreement matrix,
+as in Lancichinetti & Fortunato 2012, see bct.consensus_und.
+
+'''
+
+def consensus_modularity(W, restarts=100, gamma=1, tau=0.5, jobs=1, seed=None):
+
+    seeds = np.random.SeedSequence(seed).generate_state(restarts)
+    chunks = [ch for ch in np.array_split(seeds, max(1, jobs)) if len(ch)]
+
+    out = par.parallel_map(_louvain_chunk, [(W, ch, gamma) for ch in chunks], jobs=jobs)
+
+    agree = sum(o[0] for o in out)
+    qs = np.concatenate([o[1] for o in out])
+    best = out[int(np.argmax([max(o[1]) for o in out]))][2]
+
+    P = agree / float(restarts)
+    iu = np.triu_indices(len(W), 1)
+
+    res = OrderedDict()
+    res['ci'] = bct.consensus_und(P, tau, reps=restarts, seed=int(seeds[0]))
+    res['Q_max'] = np.max(qs)
+    res['Q_mean'] = np.mean(qs)
+    res['stability'] = np.mean(np.abs(2 * P[iu] - 1))
+    res['best_ci'] = best
+    res['agreement'] = P
+
+    return res
@@ -0,0 +1,220 @@
+import numpy as np
+import pandas as pd
+import pathlib #only Python 3.5+
+import pipeline.graph_estimates as ge
+import pipeline.obtain_estimates as oe
+import utils.parallel as par
+
+
+'''
+Parameters
+----------
+
+ts : TxN np.ndarray
+     the ROI time series of a subject
+
+width : int
+        the number of time points in every window
+
+step : int
+       the number of time points between the starts of two windows
+
+refresh : int
+          the sums are computed from scratch every refresh windows, such that
+          rounding errors from the updates cannot build up
+
+
+Returns
+-------
+
+windows : generator
+          yields (start, r) for every window, where r is the NxN Pearson
+          correlation matrix of the window with zeroes on the diagonal,
+          in the same format as loadmatrix.prepare_conn_matrix. Windows
+          with fewer than 3 time points left after scrubbing are skipped.
+
+Notes
+-----
+
+The sum and the cross products of the time points in the window are kept
+and updated as the window slides, by adding the time points entering the
+window and subtracting those leaving it. Every window then costs O(step N^2)
+rather than O(width N^2). Every column is centred on its mean over the whole
+series first, so the updates neither cancel on the offset of the signal nor
+build up drift in proportion to it. The windows are generated one at a time,
+so only a single correlation matrix is kept in memory.
+
+Time points with NaN, e.g. scrubbed volumes, are left out of the sums as
+in loadmatrix.correlation_matrices, and every window is divided by its own
+count of valid time points rather than by the width.
+
+'''
+
+def sliding_correlations(ts, width, step=1, refresh=100):
+
+    ts = np.asarray(ts, dtype=float)
+    T, n = ts.shape
+
+    #BOLD signals sit on offsets far larger than their fluctuations, which the
+    #raw sums would cancel in Q/width - m m'. The correlation is the same for
+    #the centred series, whose sums stay of the size of the fluctuations.
+    #the scrubbed time points are zeroes after centring, so they add nothing to the sums
+    valid = ~np.isnan(ts).any(axis=1)
+    if not valid.any():
+        print('The time series has no time points without NaN, closing..')
+        exit()
+    ts = ts - ts[valid].mean(axis=0)
+    ts[~valid] = 0
+    valid = valid.astype(float)
+
+    if width < 3 or width > T:
+        raise ValueError('The window width must be between 3 and the ' + str(T) + ' time points')
+    if step < 1:
+        raise ValueError('The window step must be at least 1')
+
+    for k, t in enumerate(range(0, T - width + 1, step)):
+        #the windows do not overlap, or it is time to start over
+        if k % refresh == 0 or step >= width:
+            X = ts[t:t + width]
+            c = valid[t:t + width].sum()
+            s = X.sum(axis=0)
+            Q = X.T @ X
+        else:
+            old = ts[t - step:t]
+            new = ts[t - step + width:t + width]
+            c += valid[t - step + width:t + width].sum() - valid[t - step:t].sum()
+            s += new.sum(axis=0) - old.sum(axis=0)
+            #add the entering and subtract the leaving time points in one product
+            D = np.concatenate([new, old])
+            sign = np.concatenate([np.ones(len(new)), -np.ones(len(old))])
+            Q += (D.T * sign) @ D
+
+        #too few time points left in the window to correlate
+        if c < 3:
+            continue
+
+        m = s / c
+        r = Q / c
+        r -= np.outer(m, m)
+
+        #ROIs which are constant within the window get zero correlations
+        d = np.sqrt(np.maximum(np.diagonal(r), 0))
+        dinv = np.zeros(n)
+        dinv[d > 0] = 1.0 / d[d > 0]
+        r *= dinv[:, None]
+        r *= dinv[None, :]
+        np.fill_diagonal(r, 0)
+
+        yield (t, r)
+
+
+'''
+Parameters
+----------
+
+args : tuple
+       (ts, thresholds, width, step, backend), packed in a tuple so the
+       subject can be sent to a worker process
+
+
+Returns
+-------
+
+rows : list of OrderedDict
+       the global measures of every window and threshold, with the
+       'Window', 'Start' and 'Threshold' of the row
+
+'''
+
+def _dynamic_task(args):
+
+    ts, thresholds, width, step, backend = args
+
+    rows = []
+    for t, r in sliding_correlations(ts, width, step):
+        #the number of the window, also for windows skipped after scrubbing
+        w = t // step
+        #every threshold is applied to the same window
+        for th in thresholds:
+            dic = oe.filter_singular_values(ge.graph_estimates(r, th, backend), str(w))
+            dic['Window'] = w
+            dic['Start'] = t
+            dic['Threshold'] = int(th * 100)
+            rows.append(dic)
+
+    return rows
+
+
+'''
+Parameters
+----------
+
+ts_list : list of TxN np.ndarray
+          the ROI time series of every subject, in the same order as groupIDcsv
+
+groupIDcsv : csv file
+             the ID file with the group and season of every subject
+
+thresholds : list
+             the proportional thresholds
+
+width : int
+        the number of time points in every window
+
+step : int
+       the number of time points between the starts of two windows
+
+path : string
+       the output path, the files are written to path/auto_results/dynamic
+
+backend : string
+          'dense', 'sparse' or 'auto', passed on to graph_estimates
+
+jobs : int
+       the number of worker processes the subjects are spread over
+
+threads : int
+          the number of BLAS threads of every worker process, None to split
+          the cores evenly between the workers
+
+
+Returns
+-------
+
+df : pandas DataFrame
+     the time courses of the global measures, one row per subject,
+     window and threshold
+
+Notes
+-----
+
+One file dynamic.xx.csv is written per threshold, in the same layout as the
+estimate files, with the subject index as the first column and the extra
+columns 'Window' and 'Start' (the first time point of the window).
+
+'''
+
+def dynamic_main(ts_list, groupIDcsv, thresholds, width, step=1, path=None, backend='auto', jobs=1, threads=None):
+
+    iddf = pd.read_csv(groupIDcsv)
+
+    tasks = [(ts, thresholds, width, step, backend) for ts in ts_list]
+    res = par.parallel_map(_dynamic_task, tasks, jobs=jobs, threads=threads)
+
+    frames = []
+    for i, rows in enumerate(res):
+        sub = pd.DataFrame(rows, index=[i] * len(rows))
+        sub['Group'] = iddf['group'][i]
+        sub['Season'] = iddf['season'][i]
+        frames.append(sub)
+    df = pd.concat(frames)
+
+    print('Estimated ' + str(len(df)) + ' windows over ' + str(len(ts_list)) + ' subjects')
+
+    if path != None:
+        dest = path + '/auto_results/dynamic'
+        pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+        for th, sub in df.groupby('Threshold'):
+            sub.to_csv(dest + '/dynamic.' + str(th) + '.csv')
+
+    return df
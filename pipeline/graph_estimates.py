@@ -1,6 +1,12 @@
 import bct #the meat of the project
 import numpy as np
+import scipy.sparse as sp
 from collections import OrderedDict
+import pipeline.packed as pk
+import pipeline.sparse_graph as sg
+import pipeline.centrality as ce
+import pipeline.community as com
+import pipeline.rich_club as rcl
 
 
 '''
@@ -21,6 +27,10 @@ from collections import OrderedDict
     copy : bool
         if True, returns a copy of the matrix. Otherwise, modifies the matrix
         in place. Default value=True.
+    trace : list
+        if given, every attempted link removal is appended to the list as
+        a tuple (i, j, kept), where kept is True if the link had to be
+        reinserted to keep the graph connected. Default value=None.
 
     Returns
     -------
@@ -34,64 +44,63 @@ from collections import OrderedDict
     be reinserted into the graph, despite having a low weight. 
     The algorithm will continue afterwards.
 
+    Since the weakest links are always attempted first, the graphs of
+    two thresholds are nested: the graph of the lower threshold is the
+    graph of the higher threshold with more attempted removals. The
+    trace of the lowest threshold is therefore enough to rebuild any
+    higher threshold, see graph_store.py.
+
+    The thresholding itself is done on the packed upper triangle,
+    see packed.py. Links of equal weight are attempted in the order
+    of the upper triangle. The trace lists every link as (i, j) with i < j.
+
 '''
 
-def threshold_connected(W, p, copy=True):
+def threshold_connected(W, p, copy=True, trace=None):
+
+    #the matrix is symmetric, so the thresholding works on the packed
+    #upper triangle and the dense matrix is only rebuilt at the end
+    P = pk.PackedSym.from_dense(W)
+    pk.threshold_connected(P, p, copy=False, trace=trace)
 
-    
-    #rounding function which is also used in threshold_proportional,
-    #probably fine to just use floor or ceiling instead
-    def teachers_round(x):
-         if ((x > 0) and (x % 1 >= 0.5)) or ((x < 0) and (x % 1 > 0.5)):
-             return int(np.ceil(x))
-         else:
-             return int(np.floor(x))
-
-
-    #p must be in the interval ]0;1[
-    if p > 1 or p < 0:
-        raise BCTParamError('Threshold must be in range [0,1]')
     if copy:
-        W = W.copy()
-    n = len(W)                      # number of nodes
+        return P.to_dense()
 
-    W = np.around(W, decimals=6)    # number of components tries to check if matrix is symmetric,
-                                    # but seems to be disrupted by possible rounding errors when 
-                                    # too many decimals. Hence we limit the floating point numbers
-    
-    ind = np.where(W)                   # find all links (entries which are not 0 (assuming all 
-                                        # negative links has been dsicarded already))
-    ind_len = len(ind[0])               # number of links found
+    W[...] = P.to_dense()
+    return W
 
-    # z = np.where(W==0)                # doesn't seem to be needed, remove after testing
-    # zlen = len(z[0])                  # we don't really need to know about how many zeroes our 
-                                        # connectivity matrix has. 
 
-    I = np.argsort(W[ind])#[::-1]        # sort indices by magnitude (should be ascending order)
+'''
+Parameters
+----------
 
-    
+cm : NxN np.ndarray
+     undirected weighted connection matrix
 
-    en = int(teachers_round(ind_len * (1.0-p)))   # number of links to be discarded
+th : float
+     proportional threshold
 
-    #iterate until we have discarded p% of weakest links
-    for i in range(0,en,2):
-        #store the entry which we attempt to remove, in case of disconnectedness
-        temp = W[ind[0][I][i]][ind[1][I][i]]
+trace : list
+        if given, every attempted link removal is appended to the list,
+        see threshold_connected
 
-        #remove the link, along with it's mirror element. 
-        #numpy syntax used for indexing into the connectivity matrix.
-        W[ind[0][I][i]][ind[1][I][i]] = 0
-        W[ind[1][I][i]][ind[0][I][i]] = 0
 
-        #take advantage of bct already having a function to check graph connectedness by
-        #checking number of components. BCT-py has this in clustering.py.
-        if bct.number_of_components(W) > 1:
-            #if the graph was disconnected, restore the elements we removed,
-            #then continue iterations. 
-            W[(ind[0][I][i], ind[1][I][i])] = temp
-            W[(ind[1][I][i], ind[0][I][i])] = temp
+Returns
+-------
 
-    return W
+P : packed.PackedSym
+    the thresholded graph, negative weights removed and the weakest
+    links removed as long as the graph stays connected
+
+'''
+
+def threshold_graph(cm, th, trace=None):
+
+    #thresholding moved here for other matrices than MatLab matrices
+    #removes negative weights
+    cm = bct.threshold_absolute(cm, 0.0)
+
+    return pk.threshold_connected(pk.PackedSym.from_dense(cm), th, copy=False, trace=trace)
 
 
 '''
@@ -101,6 +110,40 @@ Parameters:
 cm : NxN np.ndarray
      undirected weighted/binary connection matrix
 
+th : float
+     proportional threshold
+
+backend : string
+          'dense' for the bctpy functions, 'sparse' for the scipy.sparse
+          versions in sparse_graph.py, or 'auto' to choose by the
+          density of the thresholded graph, see sparse_graph.use_sparse
+
+nodal : bool
+        if True, also compute the nodal betweenness centrality
+        and local efficiency
+
+sources : int
+          the number of sampled source nodes for an approximate betweenness,
+          None for the exact betweenness, see centrality.betweenness
+
+restarts : int
+           the number of seeded Louvain restarts for the consensus communities,
+           0 to only use the single bct.modularity_und partition
+
+seed : int
+       seed for the Louvain restarts
+
+jobs : int
+       the number of worker processes for the nodal measures and the restarts
+
+richclub : bool
+           if True, also compute the rich-club curves, normalized by the
+           random network of the small-worldness, see rich_club.py
+
+P : packed.PackedSym
+    the graph already thresholded by threshold_graph(cm, th),
+    None to threshold cm here
+
 
 Returns:
 --------
@@ -117,44 +160,73 @@ Notes
 This is the function which utilizes bctpy to extract the graph theory measures we
 are interested in examining. 
 
+With the sparse backend, the distances, efficiency, clustering, transitivity
+and assortativity are computed on a CSR matrix holding only the links left
+after thresholding. Modularity and the random network for the small-worldness
+still need the dense matrix, as bctpy has no sparse versions of them.
+
 '''
 
-def graph_estimates(cm, th):
+def graph_estimates(cm, th, backend='auto', nodal=False, sources=None, restarts=0, seed=None, jobs=1,
+                    richclub=False, P=None):
 
     #dictionary for storing our results
     d = OrderedDict()
 
-    #thresholding moved here for other matrices than MatLab matrices
-    #removes negative weights
-    cm = bct.threshold_absolute(cm, 0.0)
+    #the graph might already be thresholded, e.g. for the batched spectral measures
+    if P is None:
+        P = threshold_graph(cm, th)
 
-    cm = threshold_connected(cm, th)
+    #the density decides the backend
+    sparse = sg.use_sparse(P.n, np.count_nonzero(P.data) / len(P.data), backend)
+    cm = P.to_dense()
 
     
     #for binarizing the connectivity matrices, 
     #we work with weighted so this is turned off
     #bin_cm = bct.binarize(cm)
     
-    #invert the connectivity for computing shortest paths
-    cm_inv = bct.invert(cm)
-
     #modularity_und is found in modularity.py
     modularity_und = bct.modularity_und(cm)
 
     #the community_affiliation vector that gets input to some of the functions
     community_affiliation = modularity_und[0]
-    
-    #distance_wei and charpath is found in distance.py
-    distance_wei = bct.distance_wei(cm_inv)
-    charpath = bct.charpath(distance_wei[0], False, False)
 
-    #clustering_coef_wu is found in clustering.py
-    clustering_coef_wu = bct.clustering_coef_wu(cm)
+    #Louvain is stochastic, so take the consensus of many restarts instead
+    if restarts > 0:
+        consensus = com.consensus_modularity(cm, restarts=restarts, jobs=jobs, seed=seed)
+        community_affiliation = consensus['ci']
+
+    if sparse:
+        G = P.to_csr()
+
+        #shortest paths on the inverted links, reused for the global efficiency
+        distance_wei = sg.distance_wei(sg.invert(G))
+        clustering_coef_wu = sg.clustering_coef_wu(G)
+        assortativity_wei = sg.assortativity_wei(G)
+        efficiency_wei = sg.efficiency_wei(distance_wei)
+        transitivity_wu = sg.transitivity_wu(G)
+    else:
+        #invert the connectivity for computing shortest paths
+        cm_inv = bct.invert(cm)
+
+        #distance_wei is found in distance.py
+        distance_wei = bct.distance_wei(cm_inv)[0]
+
+        #clustering_coef_wu and transitivity_wu are found in clustering.py
+        clustering_coef_wu = bct.clustering_coef_wu(cm)
+        #assortativity_wei is found in core.py
+        assortativity_wei = bct.assortativity_wei(cm, flag=0)
+        efficiency_wei = bct.efficiency_wei(cm)
+        transitivity_wu = bct.transitivity_wu(cm)
+
+    #charpath is found in distance.py
+    charpath = bct.charpath(distance_wei, False, False)
+
     avg_clustering_coef_wu = np.mean(clustering_coef_wu)
 
 
-    #assortativity_wei is found in core.py
-    d['assortativity_wei-r'] = bct.assortativity_wei(cm, flag=0)
+    d['assortativity_wei-r'] = assortativity_wei
 
     #just taking the average of clustering_coef_wu
     d['avg_clustering_coef_wu:C'] = avg_clustering_coef_wu
@@ -168,27 +240,47 @@ def graph_estimates(cm, th):
     d['clustering_coef_wu-C'] = clustering_coef_wu
 
 
-    d['efficiency_wei-Eglob'] = bct.efficiency_wei(cm)
-    #d['efficiency_wei-Eloc'] = bct.efficiency_wei(cm, True)
+    d['efficiency_wei-Eglob'] = efficiency_wei
+    if nodal:
+        #the same as bct.efficiency_wei(cm, True), on the neighbourhoods only
+        d['efficiency_wei-Eloc'] = sg.local_efficiency_wei(P.to_csr(), jobs=jobs)
 
-    #d['modularity_und-ci'] = modularity_und[0]
+    if nodal:
+        d['modularity_und-ci'] = modularity_und[0]
     d['modularity_und-Q'] = modularity_und[1]
 
+    if restarts > 0:
+        d['modularity_consensus-ci'] = consensus['ci']
+        d['modularity_consensus-Qmax'] = consensus['Q_max']
+        d['modularity_consensus-Qmean'] = consensus['Q_mean']
+        d['modularity_consensus-stability'] = consensus['stability']
+
+    rand_networks = []
     d['small_worldness:S'] = compute_small_worldness(cm,
                                                      avg_clustering_coef_wu,
-                                                     charpath[0])
+                                                     charpath[0],
+                                                     sparse=sparse,
+                                                     networks=rand_networks)
 
-   
-   #transitivity_wu can be found in clustering.py
-    d['transitivity_wu-T'] = bct.transitivity_wu(cm)
+    #the random network has the same degrees, so it can normalize the rich-club as well
+    if richclub:
+        d.update(rcl.rich_club_curves(cm, rand_networks[-1]))
+
+    d['transitivity_wu-T'] = transitivity_wu
 
 
     #EXAMPLES for local measures and binary measures. Comment in to use. 
 
     #VECTOR MEASURES
-    #d['betweenness_wei-BC'] = bct.betweenness_wei(cm_inv)
-    # d['module_degree_zscore-Z'] = bct.module_degree_zscore(cm, community_affiliation)
-    #d['degrees_und-deg'] = bct.degrees_und(cm)
+    if nodal:
+        #Brandes' algorithm, the same as bct.betweenness_wei(cm_inv) but much faster
+        BC, BC_err = ce.betweenness(sg.invert(P.to_csr()), k=sources, jobs=jobs)
+        d['betweenness_wei-BC'] = BC
+        if sources != None:
+            d['betweenness_wei-BCerr'] = BC_err
+    #degree, strength, participation coefficient and module degree z-score are
+    #computed for all subjects at once from the community affiliations, see
+    #centrality.nodal_measures() and obtain_estimates
     #d['charpath-ecc'] = charpath[2]
 
 
@@ -201,7 +293,6 @@ def graph_estimates(cm, th):
     # d['transitivity_bu-T'] = bct.transitivity_bu(bin_cm)
     #  d['betweenness_bin-BC'] = bct.betweenness_bin(bin_cm)
     #  modularity_und_bin = bct.modularity_und(bin_cm)
-    #d['participation_coef'] = bct.participation_coef(cm, community_affiliation)
 
 
     ######## charpath giving problems with ecc, radius and diameter
@@ -228,6 +319,14 @@ cpl : float
       Characteristic path length of the ocnnectivity matrix.
       Also takes this as input rather than computing it again.
 
+sparse : bool
+         if True, the measures of the random network are computed
+         with the sparse backend, see sparse_graph.py
+
+networks : list
+           if given, the random network used is appended to the list,
+           such that it can be reused for other normalizations
+
 
 Returns:
 --------
@@ -248,7 +347,7 @@ small-worldness property, which might be true actually.
 '''
 
 
-def compute_small_worldness(cm, cc, cpl):
+def compute_small_worldness(cm, cc, cpl, sparse=False, networks=None):
 
     #randmio_und_connected can be found in reference.py
     #second argument is number of iterations
@@ -260,17 +359,27 @@ def compute_small_worldness(cm, cc, cpl):
     #could probably be made more correct by taking the average of
     #some number of random networks. 
     #we did not do this to keep run time at a minimum
-    C_rand = np.mean(bct.clustering_coef_wu(rand_network))
+    if sparse:
+        clustering_coef_wu = lambda W: sg.clustering_coef_wu(sp.csr_matrix(W))
+    else:
+        clustering_coef_wu = bct.clustering_coef_wu
+
+    C_rand = np.mean(clustering_coef_wu(rand_network))
     while C_rand == 0.0:
         rand_network = bct.randmio_und_connected(cm,5)[0]
-        C_rand = np.mean(bct.clustering_coef_wu(rand_network))
+        C_rand = np.mean(clustering_coef_wu(rand_network))
 
-    #invert can be found in other.py
-    rand_inv = bct.invert(rand_network)
-    
-    #distance_wei and charpath can be found in distance.py
-    distance_rand = bct.distance_wei(rand_inv)
-    charpath_rand = bct.charpath(distance_rand[0])
+    if sparse:
+        distance_rand = sg.distance_wei(sg.invert(sp.csr_matrix(rand_network)))
+    else:
+        #invert can be found in other.py
+        rand_inv = bct.invert(rand_network)
+
+        #distance_wei can be found in distance.py
+        distance_rand = bct.distance_wei(rand_inv)[0]
+
+    #charpath can be found in distance.py
+    charpath_rand = bct.charpath(distance_rand)
  
     #compute the small worldness index according to Rubinov
     C = cc
@@ -282,6 +391,9 @@ def compute_small_worldness(cm, cc, cpl):
 
     S_W = Ctemp / Ltemp
 
+    if networks is not None:
+        networks.append(rand_network)
+
     return S_W
 
 
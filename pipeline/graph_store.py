@@ -0,0 +1,276 @@
+import bct
+import numpy as np
+import pathlib #only Python 3.5+
+from collections import OrderedDict
+import pipeline.packed as pk
+import utils.parallel as par
+
+
+'''
+Parameters
+----------
+
+cm : NxN np.ndarray
+     the connectivity matrix of a subject, as returned from
+     loadmatrix.prepare_conn_matrix
+
+p_min : float
+        the lowest proportional threshold that should be possible
+        to rebuild from the encoding
+
+
+Returns
+-------
+
+enc : OrderedDict
+      'weights' : the upper triangle of the matrix, as seen by threshold_connected
+      'order'   : the upper triangle index of every attempted link removal,
+                  in the order they were attempted (weakest first)
+      'kept'    : True for the attempts where the link was reinserted
+                  to keep the graph connected
+      'n_links' : the number of links before thresholding
+      'n'       : the number of nodes
+
+Notes
+-----
+
+threshold_connected always tries to remove the weakest links first, so the
+graph of a threshold p is the graph after the first attempts of the sweep
+down to p_min. Keeping the weights, the order of the attempts and which
+attempts were reinserted is therefore enough to rebuild the exact graph of
+every threshold above p_min, from a single thresholding run.
+
+'''
+
+def encode_graph(cm, p_min):
+
+    #the same preparation as in graph_estimates
+    W = bct.threshold_absolute(cm, 0.0)
+
+    trace = []
+    P = pk.PackedSym.from_dense(W)
+    P.data = np.around(P.data, decimals=6)
+    pk.threshold_connected(P, p_min, trace=trace)
+
+    return encode_trace(P.data, P.n, trace)
+
+
+'''
+Parameters
+----------
+
+weights : (N(N-1)/2,) np.ndarray
+          the upper triangle of the matrix before thresholding, as seen by
+          threshold_connected
+
+n : int
+    the number of nodes
+
+trace : list
+        the attempted link removals of threshold_connected down to the
+        lowest threshold, as tuples (i, j, kept)
+
+
+Returns
+-------
+
+enc : OrderedDict
+      the encoding of the subject, see encode_graph
+
+'''
+
+def encode_trace(weights, n, trace):
+
+    #the linear index into the upper triangle of every attempted link
+    P = pk.PackedSym(weights, n)
+    order = np.array([P.index(i, j) for i, j, k in trace], dtype=np.int32)
+    kept = np.array([k for i, j, k in trace], dtype=bool)
+
+    enc = OrderedDict()
+    enc['weights'] = weights
+    enc['order'] = order
+    enc['kept'] = kept
+    enc['n_links'] = 2 * int(np.count_nonzero(weights))
+    enc['n'] = n
+
+    return enc
+
+
+'''
+Parameters
+----------
+
+cm : NxN np.ndarray
+     the connectivity matrix of a subject
+
+P : packed.PackedSym
+    the graph of cm thresholded by graph_estimates.threshold_graph
+
+trace : list
+        the trace of that thresholding
+
+
+Returns
+-------
+
+enc : OrderedDict
+      the encoding of the subject, see encode_graph, without thresholding
+      cm again. The weights of the removed links are taken back from cm.
+
+'''
+
+def encode_thresholded(cm, P, trace):
+
+    weights = P.data.copy()
+    for i, j, k in trace:
+        if not k:
+            weights[P.index(i, j)] = np.around(cm[i, j], decimals=6)
+
+    return encode_trace(weights, P.n, trace)
+
+
+'''
+Parameters
+----------
+
+enc : OrderedDict
+      the encoding of a subject, as returned from encode_graph
+
+p : float
+    the proportional threshold of the graph to rebuild
+
+
+Returns
+-------
+
+W : NxN np.ndarray
+    the thresholded connectivity matrix, identical to
+    threshold_connected(threshold_absolute(cm, 0.0), p)
+
+'''
+
+def decode_graph(enc, p):
+
+    n = enc['n']
+
+    #same number of attempts as in threshold_connected
+    en = pk.teachers_round(enc['n_links'] * (1.0 - p))
+    steps = len(range(0, en, 2))
+    if steps > len(enc['order']):
+        raise ValueError('Threshold ' + str(p) + ' is below the lowest encoded threshold')
+
+    P = pk.PackedSym(np.array(enc['weights'], dtype=float), n)
+    removed = enc['order'][:steps][~enc['kept'][:steps]]
+    P.data[removed] = 0
+
+    return P.to_dense()
+
+
+#module level wrapper, such that the encoding can run in worker processes
+def _encode_task(args):
+    return encode_graph(*args)
+
+
+'''
+Parameters
+----------
+
+cm_list : list of NxN np.ndarray
+          the connectivity matrices of all subjects
+
+p_min : float
+        the lowest threshold of the sweep
+
+path : string
+       the output path, the file is written to path/auto_results/graphs.npz
+
+jobs : int
+       the number of worker processes the subjects are spread over
+
+threads : int
+          the number of BLAS threads of every worker process, None to split
+          the cores evenly between the workers
+
+encs : list of OrderedDict
+       the encodings already made from the thresholding at p_min, see
+       encode_thresholded. None to threshold every subject here.
+
+
+Returns
+-------
+
+encs : list of OrderedDict
+       the encoding of every subject
+
+Notes
+-----
+
+All subjects are stored in a single compressed .npz file. The weights
+are stacked into an (S, N(N-1)/2) array, while the attempted removals
+of all subjects are concatenated, with 'offsets' marking where every
+subject starts.
+
+'''
+
+def save_graphs(cm_list, p_min, path, jobs=1, threads=None, encs=None):
+
+    #the encodings might already be made while estimating, see obtain_estimates
+    if encs is None:
+        encs = par.parallel_map(_encode_task, [(cm, p_min) for cm in cm_list], jobs=jobs,
+                                 threads=threads)
+
+    offsets = np.cumsum([0] + [len(e['order']) for e in encs])
+
+    dest = path + '/auto_results'
+    pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+
+    np.savez_compressed(dest + '/graphs.npz',
+                        weights=np.array([e['weights'] for e in encs]),
+                        order=np.concatenate([e['order'] for e in encs]),
+                        kept=np.concatenate([e['kept'] for e in encs]),
+                        offsets=offsets,
+                        n_links=np.array([e['n_links'] for e in encs]),
+                        n=encs[0]['n'],
+                        p_min=p_min)
+
+    return encs
+
+
+'''
+Parameters
+----------
+
+filename : string
+           the graphs.npz file written by save_graphs
+
+
+Returns
+-------
+
+encs : list of OrderedDict
+       the encoding of every subject, to be passed to decode_graph
+
+'''
+
+def load_graphs(filename):
+
+    #every access to an .npz member reads it from disk again, so read them once
+    f = np.load(filename)
+    weights = f['weights']
+    order = f['order']
+    kept = f['kept']
+    offsets = f['offsets']
+    n_links = f['n_links']
+    n = int(f['n'])
+
+    encs = []
+    for s in range(len(weights)):
+        enc = OrderedDict()
+        enc['weights'] = weights[s]
+        enc['order'] = order[offsets[s]:offsets[s + 1]]
+        enc['kept'] = kept[offsets[s]:offsets[s + 1]]
+        enc['n_links'] = int(n_links[s])
+        enc['n'] = n
+        encs.append(enc)
+
+    return encs
@@ -1,6 +1,8 @@
 import scipy.io #scipy.io.loadmat
 import numpy as np 
+import pandas as pd #reading time series from .csv files
 import sys #commnad line arguments
+from collections import OrderedDict
 #import bct #thresholding negative weights (MOVED TO graph_estimates)
 
 
@@ -14,6 +16,9 @@ file_list : string list
             all of the files a user may want to process through the 
             pipeline.
 
+size : string
+       'full' or a single cut 'ns:nexms:me', see cut_view
+
 
 Returns:
 --------
@@ -21,6 +26,7 @@ Returns:
 prepared_matrices : list of NxN numpy array
                     A list of connectivity matrices will be returned,
                     each extracted from the given files as specified by the user.
+                    The matrices are read-only views, see conn_cuts.
 
 Notes:
 ------
@@ -37,65 +43,187 @@ obtained through other means than MATLAB Conn.
 
 def conn_interface(file_list, size='full'):
 
-    prepared_matrices = []
+    cuts = OrderedDict([(size, size)])
 
-    for f in file_list:
-        #check if the given file is a .mat file
-        token = f.split('.')[-1]
-        if token != 'mat':
-            print(str(f) + ' was not a .mat file, closing..')
-            exit()
+    return conn_cuts(file_list, cuts)[size]
 
-        try:
-            #load the matrix given by the .mat fle
-            fm = scipy.io.loadmat(f)
-            #transpose the matrix to give row order for 3D matrices,
-            #2D matrices will also be tranposed, but treated the
-            #same as 3D matrices
-            fmt = np.transpose(fm['Z'])
-            fm_len = len(fm['Z'].shape)
-
-
-            #check if user gave any other dimensions than just the full matrix,
-            #modify the matlab matrix appropriately
-            #WILL ASSUME 1-INDEXING IS USED
-            if size != 'full':
-
-                dim_tok = size.split('x')
-                ns = int(dim_tok[0].split(':')[0]) - 1
-                ne = int(dim_tok[0].split(':')[1])       #include the greymatter column, will be dropped later
-                                                         #for compatibility with full mode
-                ms = int(dim_tok[1].split(':')[0]) - 1
-                me = int(dim_tok[1].split(':')[1]) - 1
-
-                #extract the necessary part of the matrices
-                fmt = fmt[:][:,ns:ne,ms:me]
-
-            #check whether a single matrix or multiple matrices
-            #was given as user input
-            if fm_len == 3:
-                print('Found multiple matrices in given MATLAB file')
-                for i in range(fmt.shape[0]):
-                    #prepare the individual matrices
-                    temp = prepare_conn_matrix(fmt[i])
-                    prepared_matrices.append(temp)
-            
-            
-            elif fm_len == 2:
-                print('Found a single matrix in given MATLAB file')
-                prepared_matrices.append(prepare_conn_matrix(fmt))
-
-            #case for user input is a .mat file, 
-            #but it has either 1D or >3D. Just close program for now
-            else:
-                print('The file is some unknown collection of matrices')
-                exit()
-        except:
-            print("Unexpected error occured, closing.")
-            exit()
 
+'''
+Parameters
+----------
+
+cut : string
+      a comma separated list of cuts, each either 'ns:nexms:me', 'full', or
+      given a name as 'name=ns:nexms:me', e.g. 'dmn=1:12x1:12,sal=13:20x13:20,full'.
+      None for the full matrix only.
 
-    return prepared_matrices
+
+Returns
+-------
+
+cuts : OrderedDict
+       the size of every cut by its name. Cuts without a name are named
+       by their size, with ':' replaced by '-' to give valid directory names.
+
+'''
+
+def parse_cuts(cut):
+
+    cuts = OrderedDict()
+    if not cut:
+        cuts['full'] = 'full'
+        return cuts
+
+    for tok in cut.strip('[]').split(','):
+        if '=' in tok:
+            name, size = tok.split('=')
+        else:
+            name, size = tok.replace(':', '-'), tok
+        cuts[name.strip()] = size.strip()
+
+    return cuts
+
+
+'''
+Parameters
+----------
+
+f : string
+    a .mat file from Conn, holding one or more connectivity matrices in 'Z'
+
+
+Returns
+-------
+
+R : (S, N+1, N) np.ndarray
+    the Pearson coefficients of all the matrices of the file, in row order,
+    with NaN's replaced by zeroes and the grey matter row still in place
+
+Notes
+-----
+
+The whole stack is converted at once, the same as prepare_conn_matrix does for
+a single matrix. This is the only copy of the matrices, every cut is a view on it.
+
+'''
+
+def load_conn_stack(f):
+
+    #check if the given file is a .mat file
+    token = f.split('.')[-1]
+    if token != 'mat':
+        print(str(f) + ' was not a .mat file, closing..')
+        exit()
+
+    try:
+        #load the matrix given by the .mat fle
+        fm = scipy.io.loadmat(f)
+        fm_len = len(fm['Z'].shape)
+    except:
+        print("Unexpected error occured, closing.")
+        exit()
+
+    #check whether a single matrix or multiple matrices
+    #was given as user input
+    if fm_len == 3:
+        print('Found multiple matrices in given MATLAB file')
+    elif fm_len == 2:
+        print('Found a single matrix in given MATLAB file')
+    #case for user input is a .mat file,
+    #but it has either 1D or >3D. Just close program for now
+    else:
+        print('The file is some unknown collection of matrices')
+        exit()
+
+    #transpose the matrix to give row order for 3D matrices,
+    #a single 2D matrix is treated as a stack of one
+    R = np.array(np.transpose(fm['Z']), dtype=float, ndmin=3)
+
+    #in place, such that the stack is only copied once
+    np.nan_to_num(R, copy=False)
+    np.tanh(R, out=R)
+
+    return R
+
+
+'''
+Parameters
+----------
+
+R : (S, N+1, N) np.ndarray
+    the stack from load_conn_stack
+
+size : string
+       'full', or 'ns:nexms:me' for the rows ns to ne and columns ms to me,
+       assuming 1-indexing is used
+
+
+Returns
+-------
+
+V : (S, n, m) np.ndarray
+    a view on R holding the cut, without the grey matter row
+
+'''
+
+def cut_view(R, size):
+
+    if size == 'full':
+        #drop the grey matter row
+        return R[:, :-1, :]
+
+    #check if user gave any other dimensions than just the full matrix
+    #WILL ASSUME 1-INDEXING IS USED
+    dim_tok = size.split('x')
+    ns = int(dim_tok[0].split(':')[0]) - 1
+    ne = int(dim_tok[0].split(':')[1])       #include the greymatter column, will be dropped
+                                             #for compatibility with full mode
+    ms = int(dim_tok[1].split(':')[0]) - 1
+    me = int(dim_tok[1].split(':')[1]) - 1
+
+    #basic slicing, so only the view changes and no data is copied
+    return R[:, ns:ne - 1, ms:me]
+
+
+'''
+Parameters
+----------
+
+file_list : string list
+            the .mat files to process through the pipeline
+
+cuts : OrderedDict
+       the size of every cut by its name, see parse_cuts
+
+
+Returns
+-------
+
+prepared : OrderedDict
+           for every cut, the list of connectivity matrices of all files
+
+Notes
+-----
+
+Every file is loaded once, and every cut of it is a NumPy view on the same
+stack, such that several networks (e.g. the DMN, the salience network and the
+full matrix) can be analysed in a single run. The matrices are read-only
+views, the thresholding in graph_estimates always works on a copy.
+
+'''
+
+def conn_cuts(file_list, cuts):
+
+    prepared = OrderedDict((name, []) for name in cuts)
+
+    for f in file_list:
+        R = load_conn_stack(f)
+        R.flags.writeable = False
+
+        for name, size in cuts.items():
+            prepared[name].extend(cut_view(R, size))
+
+    return prepared
 
 
 '''
@@ -178,6 +306,225 @@ def prepare_conn_matrix(conn_cm):
 
 
 
+'''
+Parameters
+----------
+
+f : string
+    a file with ROI time series, either
+    .npy : a TxN array for a single subject, or an SxTxN array for S subjects
+    .csv : a TxN table for a single subject, with or without a header of ROI names
+    .mat : the variable given by key, a TxN array for a single subject, or a
+           TxNxS array with the subjects last, as MATLAB stores them
+
+key : string
+      the variable to read from .mat files
+
+
+Returns
+-------
+
+ts_list : list of TxN np.ndarray
+          the time series of every subject in the file
+
+'''
+
+def load_timeseries(f, key='ts'):
+
+    token = f.split('.')[-1]
+
+    if token == 'npy':
+        ts = np.load(f)
+        if ts.ndim == 3:
+            return list(ts)
+
+    elif token == 'csv':
+        df = pd.read_csv(f, header=None)
+        #drop the header of ROI names, if there is one
+        try:
+            df.iloc[0].astype(float)
+        except ValueError:
+            df = df.iloc[1:]
+        ts = df.values.astype(float)
+
+    elif token == 'mat':
+        ts = scipy.io.loadmat(f)[key]
+        if ts.ndim == 3:
+            return list(np.moveaxis(ts, -1, 0))
+
+    else:
+        print(str(f) + ' was not a .npy, .csv or .mat file, closing..')
+        exit()
+
+    if ts.ndim != 2:
+        print('The time series in ' + str(f) + ' should be TxN, closing..')
+        exit()
+
+    return [ts]
+
+
+'''
+Parameters
+----------
+
+X : (S, T, N) np.ndarray
+    standardized time series, every column with mean 0 and variance 1
+
+
+Returns
+-------
+
+shrinkage : (S,) np.ndarray
+            the Ledoit-Wolf shrinkage intensity of every subject, towards
+            a scaled identity matrix
+
+Notes
+-----
+
+Ledoit & Wolf 2004, the same estimate as sklearn.covariance.ledoit_wolf_shrinkage,
+with every sum over the subjects done by batched matrix products.
+
+'''
+
+def ledoit_wolf_shrinkage(X):
+
+    S, T, n = X.shape
+
+    X2 = X * X
+    emp_cov_trace = X2.sum(axis=1) / T
+    mu = emp_cov_trace.sum(axis=1) / n
+
+    beta_ = np.sum(np.matmul(np.swapaxes(X2, 1, 2), X2), axis=(1, 2))
+    delta_ = np.sum(np.matmul(np.swapaxes(X, 1, 2), X) ** 2, axis=(1, 2)) / T ** 2
+
+    beta = (beta_ / T - delta_) / (n * T)
+    delta = (delta_ - 2 * mu * emp_cov_trace.sum(axis=1) + n * mu ** 2) / n
+    beta = np.minimum(beta, delta)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shrinkage = np.where(beta == 0, 0.0, beta / delta)
+
+    return shrinkage
+
+
+'''
+Parameters
+----------
+
+ts_list : list of TxN np.ndarray
+          the ROI time series of every subject. Rows with NaN, e.g. scrubbed
+          volumes, are left out.
+
+partial : bool
+          if True, partial correlations from the shrinkage estimate of the
+          precision matrix, otherwise Pearson correlations
+
+shrinkage : float
+            the shrinkage intensity towards the identity, between 0 and 1,
+            for the partial correlations. None for the Ledoit-Wolf estimate
+            of every subject.
+
+dtype : string or np.dtype
+        the floating point type of the computations and the resulting matrices,
+        'float32' halves the memory
+
+
+Returns
+-------
+
+prepared_matrices : list of NxN np.ndarray
+                    the correlation matrix of every subject, in the same format
+                    as prepare_conn_matrix, i.e. with zeroes on the diagonal
+
+Notes
+-----
+
+Subjects with the same number of time points are stacked, so the
+correlations of all of them are one batched matrix product.
+
+'''
+
+def correlation_matrices(ts_list, partial=False, shrinkage=None, dtype='float64'):
+
+    #drop the scrubbed volumes
+    ts_list = [np.asarray(ts, dtype=dtype) for ts in ts_list]
+    ts_list = [ts[~np.isnan(ts).any(axis=1)] for ts in ts_list]
+
+    prepared_matrices = [None] * len(ts_list)
+
+    #one stack for every length of the time series
+    lengths = np.array([len(ts) for ts in ts_list])
+    for T in np.unique(lengths):
+        idx = np.flatnonzero(lengths == T)
+        X = np.stack([ts_list[i] for i in idx])
+
+        #standardize every ROI, then the correlations are plain inner products
+        X = X - X.mean(axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            X = X / np.sqrt(np.sum(X * X, axis=1, keepdims=True) / T)
+        X = np.nan_to_num(X)
+
+        C = np.matmul(np.swapaxes(X, 1, 2), X) / T
+
+        if partial:
+            n = C.shape[-1]
+            if shrinkage == None:
+                a = ledoit_wolf_shrinkage(X)
+            else:
+                a = np.full(len(idx), float(shrinkage))
+            mu = np.trace(C, axis1=1, axis2=2) / n
+
+            C = (1 - a)[:, None, None] * C + (a * mu)[:, None, None] * np.eye(n, dtype=C.dtype)
+
+            #partial correlations from the precision matrix
+            P = np.linalg.inv(C)
+            d = np.sqrt(np.diagonal(P, axis1=1, axis2=2))
+            C = -P / (d[:, :, None] * d[:, None, :])
+
+        C = C.astype(dtype)
+        for k, i in enumerate(idx):
+            cm = C[k]
+            np.fill_diagonal(cm, 0)
+            prepared_matrices[i] = cm
+
+    return prepared_matrices
+
+
+'''
+Parameters
+----------
+
+file_list : string list
+            the files with the ROI time series, see load_timeseries()
+
+partial, shrinkage, dtype :
+            see correlation_matrices()
+
+key : string
+      the variable to read from .mat files
+
+
+Returns
+-------
+
+prepared_matrices : list of NxN numpy array
+                    the correlation matrices of every subject in every file,
+                    in order, ready for the graph theory estimates in the
+                    same way as the matrices from conn_interface
+
+'''
+
+def timeseries_interface(file_list, partial=False, shrinkage=None, dtype='float64', key='ts'):
+
+    ts_list = []
+    for f in file_list:
+        ts_list.extend(load_timeseries(f, key=key))
+
+    print('Found ' + str(len(ts_list)) + ' subjects with ROI time series')
+
+    return correlation_matrices(ts_list, partial=partial, shrinkage=shrinkage, dtype=dtype)
+
+
 if __name__ == "__main__":
     head, *tail = sys.argv
     pm = conn_interface(tail)
@@ -4,10 +4,13 @@ import pprint  #pretty printer
 import nibabel as nib  #for saving .nii nifti images
 from collections import OrderedDict
 import pandas as pd #for csv file creation
-import utils.progressbar as pb #progressbar courtesy of stackoverflow
+import utils.scheduler as sch #longest-first scheduling with a cost weighted progressbar
 import sys #for getting commandline arguments
 import pipeline.loadmatrix as lm #getting the connectivity matrices from Conn
 import pipeline.graph_estimates as ge
+import pipeline.graph_store as gs
+import pipeline.spectral as spc
+import pipeline.centrality as ce
 
 
 ##########################################################################
@@ -196,6 +199,32 @@ def filter_singular_values(est_dic, sn):
 
 
 
+'''
+Parameters
+----------
+
+args : tuple
+       (th, backend, nodal, sources, restarts, seed, jobs, richclub, P), packed
+       in a tuple so the subject can be sent to a worker process
+
+
+Returns
+-------
+
+d : OrderedDict
+    the graph estimates of the subject, see graph_estimates.graph_estimates
+
+'''
+
+def _estimate_task(args):
+
+    th, backend, nodal, sources, restarts, seed, jobs, richclub, P = args
+
+    #the graph is already thresholded, so the matrix itself is not needed
+    return ge.graph_estimates(None, th, backend, nodal, sources, restarts=restarts, seed=seed,
+                              jobs=jobs, richclub=richclub, P=P)
+
+
 '''
 Parameters
 ----------
@@ -212,20 +241,54 @@ groupIDcsv : csv file
              subject in the scan file. 
 dest : string
        the path to the directory where the resulting estimate files will be put
+backend : string
+          'dense', 'sparse' or 'auto', passed on to graph_estimates
+nodal : bool
+        if True, the nodal betweenness, local efficiency, degree, strength,
+        participation coefficient and module degree z-score are computed as well,
+        and all the vector measures are stored in nodal.xx.npz next to the
+        estimate file, as one (subjects, N) array per measure
+sources : int
+          the number of sampled source nodes for an approximate betweenness,
+          None for the exact betweenness
+restarts : int
+           the number of Louvain restarts for the consensus communities, 0 for none.
+           The restarts of every subject are seeded by its index, so a rerun
+           gives the same communities.
+jobs : int
+       the number of worker processes the subjects are spread over, or for the
+       nodal measures and the restarts of a single subject
+richclub : bool
+           if True, the rich-club curves of every subject are computed as well
+chunk : int
+        the number of subjects per batched eigendecomposition of the spectral
+        measures, None for all at once, see resources.plan_resources
+threads : int
+          the number of BLAS threads of every worker process, None to split
+          the cores evenly between the workers, see resources.plan_resources
+encodings : list
+            if given, the encoding of every subject's thresholding is appended
+            to the list, such that graph_store.save_graphs does not need to
+            threshold the subjects again
 
 Returns
 -------
 
 (void) : No results are returned, as this is really the "main()"
-         function of the program, tying it all together
+         function of the program, tying it all together.
+         With richclub, the (subjects, N-1) rich-club curves are returned
+         in an OrderedDict, see rich_club.rich_club_curves
          #TODO: refine comments
 
 
 '''
 
-def obtain_estimates(cm_list, groupIDcsv, th, path):
+def obtain_estimates(cm_list, groupIDcsv, th, path, backend='auto', nodal=False, sources=None, restarts=0, jobs=1,
+                     richclub=False, chunk=None, threads=None, encodings=None):
 
     dic_list = []
+    nodal_dic = OrderedDict()
+    rc_dic = OrderedDict()
     
     #the CSV file used to identify and label the subjects in our matrix file
     iddf = pd.read_csv(groupIDcsv)
@@ -235,18 +298,63 @@ def obtain_estimates(cm_list, groupIDcsv, th, path):
     #For each connection matrix file, 
     #run the graph estimates and store them properly
     th_p = int(th * 100)
-    #counter used for the progressbar
-    i = 0 
-    l = len(cm_list)
-    #initialize progressbar so we have a feeling of the time consumed by the script
-    pb.printProgressBar(0, l, prefix = 'Progress:', suffix = 'Complete', length = 50)
-    for cm in cm_list:
 
-            #perform the actual graph theory estimations
-            dic = ge.graph_estimates(cm,th)
+    #threshold every subject first, such that the spectral measures
+    #of the whole stack can be found with one batched eigendecomposition
+    #the trace of a subject holds a tuple per attempted removal, many times the size
+    #of its matrix, so only the reinserted links and the encoding are kept from it
+    graphs = []
+    reinserted = []
+    for cm in cm_list:
+        trace = []
+        graphs.append(ge.threshold_graph(cm, th, trace=trace))
+        reinserted.append(sum(kept for _, _, kept in trace))
+        if encodings is not None:
+            encodings.append(gs.encode_thresholded(cm, graphs[-1], trace))
+
+    Ws = np.array([P.to_dense() for P in graphs])
+    spectral = spc.spectral_measures(Ws, chunk=chunk)
+    #not needed while the workers run, every worker makes its own from the packed graph
+    del Ws
+
+    #the predicted run time of every subject, from its size, its density and
+    #the links reinserted by the thresholding, fitted on the timings of
+    #earlier runs with the same settings
+    setting = ('backend=' + str(backend) + ',nodal=' + str(nodal) + ',sources=' + str(sources)
+               + ',restarts=' + str(restarts) + ',richclub=' + str(richclub))
+    features = np.array([sch.task_features(P.n, np.count_nonzero(P.data), r)
+                         for P, r in zip(graphs, reinserted)])
+    costs = features @ sch.fit_cost_model(sch.load_history(path).get(setting, []))
+
+    #the subjects are spread over the workers, a single subject
+    #spreads its nodal measures and restarts over them instead
+    inner = jobs if len(cm_list) == 1 else 1
+    tasks = [(th, backend, nodal, sources, restarts, i, inner, richclub, graphs[i])
+             for i in range(len(cm_list))]
+
+    #the most expensive subjects first, with the progress and ETA weighted by the costs.
+    #Every subject is seeded by the threshold and its index, so the random networks
+    #of the small-worldness are the same on a rerun, however many jobs are used
+    results, seconds = sch.schedule(_estimate_task, tasks, costs, jobs=jobs, threads=threads, seed=th_p)
+    sch.save_history(path, setting, features, seconds)
+
+    for i, dic in enumerate(results):
+
+            for key in spectral:
+                dic[key] = spectral[key][i]
 
             subject_name = str(i)
 
+            #the rich-club curves are over the degree levels rather than the nodes
+            for key in [key for key in dic if key.startswith('rich_club')]:
+                rc_dic.setdefault(key, []).append(dic.pop(key))
+
+            #keep the local measures, before they are filtered out
+            if nodal:
+                for key in dic:
+                    if isinstance(dic[key], np.ndarray):
+                        nodal_dic.setdefault(key, []).append(dic[key])
+
             #filter out the local measures that won't fit in a CSV file
             filt_dic = filter_singular_values(dic, subject_name)
             
@@ -257,9 +365,6 @@ def obtain_estimates(cm_list, groupIDcsv, th, path):
             filt_dic['Season'] = iddf['season'][i]
 
             dic_list.append(filt_dic)
-            pb.printProgressBar(i + 1, l, prefix = 'Progress:', suffix = 'Complete', length = 50)
-            #increment counter for progressbar
-            i = i + 1 
 
     #store the singular values in Pandas dataframe,
     #for convienient conversion to .csv file
@@ -276,6 +381,25 @@ def obtain_estimates(cm_list, groupIDcsv, th, path):
 
     #save the estimates to our CSV file
     df.to_csv(est_dir + csv_name)
+
+    #save the local measures, one row per subject in the same order as the CSV file
+    if nodal:
+        #the community based nodal measures of all subjects at once,
+        #from the consensus communities if there are any
+        if 'modularity_consensus-ci' in nodal_dic:
+            cis = nodal_dic['modularity_consensus-ci']
+        else:
+            cis = nodal_dic['modularity_und-ci']
+        #the dense stack again, freed while the workers were running
+        Ws = np.array([P.to_dense() for P in graphs])
+        nodal_dic.update(ce.nodal_measures(Ws, cis))
+
+        np.savez_compressed(est_dir + '/nodal.' + str(th_p) + '.npz',
+                            **OrderedDict((key, np.array(val)) for key, val in nodal_dic.items()))
+
+    #the rich-club curves are returned, to be stacked over the thresholds
+    if richclub:
+        return OrderedDict((key, np.array(val)) for key, val in rc_dic.items())
     
     return
 
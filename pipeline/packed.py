@@ -0,0 +1,308 @@
+import numpy as np
+from functools import lru_cache
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+'''
+Parameters
+----------
+
+n : int
+    the number of nodes
+
+
+Returns
+-------
+
+rows, cols : np.ndarray
+             the row and column of every entry in the packed upper triangle,
+             i.e. np.triu_indices(n, 1). Cached, since every matrix of the same
+             size shares them. The arrays are read only.
+
+'''
+
+@lru_cache(maxsize=8)
+def triu_index(n):
+
+    rows, cols = np.triu_indices(n, 1)
+    rows.flags.writeable = False
+    cols.flags.writeable = False
+
+    return (rows, cols)
+
+
+#rounding function which is also used in threshold_proportional,
+#probably fine to just use floor or ceiling instead
+def teachers_round(x):
+    if ((x > 0) and (x % 1 >= 0.5)) or ((x < 0) and (x % 1 > 0.5)):
+        return int(np.ceil(x))
+    else:
+        return int(np.floor(x))
+
+
+'''
+    Symmetric NxN matrix with an empty diagonal, stored as the
+    N(N-1)/2 entries of its upper triangle, in row major order.
+
+    Every connectivity matrix in the pipeline is undirected and has no
+    self-self connections, so this holds the same information as the
+    dense matrix in half the memory, and an update of an entry is
+    a single write instead of one for each mirror element.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        the packed upper triangle, of length N(N-1)/2
+    n : int
+        the number of nodes
+
+    Notes
+    -----
+    Use from_dense() and to_dense() to convert from and to the NxN arrays
+    bctpy works on. edges() gives views of the node pairs and weights
+    without any copying.
+'''
+
+class PackedSym(object):
+
+    def __init__(self, data, n):
+        self.data = np.asarray(data, dtype=float)
+        self.n = n
+
+        if len(self.data) != n * (n - 1) // 2:
+            raise ValueError('Packed data of length ' + str(len(self.data))
+                             + ' does not fit a ' + str(n) + 'x' + str(n) + ' matrix')
+
+    @classmethod
+    def from_dense(cls, W):
+        n = len(W)
+        return cls(np.asarray(W, dtype=float)[triu_index(n)], n)
+
+    def to_dense(self):
+        W = np.zeros((self.n, self.n))
+        rows, cols = triu_index(self.n)
+        W[rows, cols] = self.data
+        W[cols, rows] = self.data
+        return W
+
+    def index(self, i, j):
+        #position of (i, j) in the packed array, the order of i and j does not matter
+        if i > j:
+            i, j = j, i
+        if i == j:
+            raise IndexError('The diagonal is not stored in a packed matrix')
+        return i * self.n - i * (i + 1) // 2 + (j - i - 1)
+
+    def __getitem__(self, ij):
+        i, j = ij
+        if i == j:
+            return 0.0
+        return self.data[self.index(i, j)]
+
+    def __setitem__(self, ij, value):
+        self.data[self.index(*ij)] = value
+
+    def edges(self):
+        rows, cols = triu_index(self.n)
+        return (rows, cols, self.data)
+
+    def copy(self):
+        return PackedSym(self.data.copy(), self.n)
+
+    def to_csr(self):
+        #only the nonzero entries, mirrored to both triangles
+        rows, cols = triu_index(self.n)
+        nz = np.flatnonzero(self.data)
+        r = np.concatenate([rows[nz], cols[nz]])
+        c = np.concatenate([cols[nz], rows[nz]])
+        return csr_matrix((np.concatenate([self.data[nz], self.data[nz]]), (r, c)), shape=(self.n, self.n))
+
+    def number_of_components(self):
+        return connected_components(self.to_csr(), directed=False)[0]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+
+'''
+Parameters
+----------
+
+P : PackedSym
+    packed connectivity matrix
+
+thr : float
+      absolute weight threshold
+
+copy : bool
+       if True, returns a copy of the matrix. Otherwise, modifies the matrix
+       in place. Default value=True.
+
+
+Returns
+-------
+
+P : PackedSym
+    thresholded connectivity matrix, all weights below thr set to 0,
+    same as bct.threshold_absolute
+
+'''
+
+def threshold_absolute(P, thr, copy=True):
+
+    if copy:
+        P = P.copy()
+    P.data[P.data < thr] = 0
+
+    return P
+
+
+'''
+Parameters
+----------
+
+P : PackedSym
+    packed connectivity matrix
+
+
+Returns
+-------
+
+order : np.ndarray
+        the packed index of every link (nonzero entry), sorted by ascending
+        weight. Ties are broken by the position in the upper triangle.
+
+'''
+
+def argsort_links(P):
+
+    nz = np.flatnonzero(P.data)
+
+    return nz[np.argsort(P.data[nz], kind='stable')]
+
+
+'''
+Parameters
+----------
+
+P : PackedSym
+    packed connectivity matrix
+
+p : float
+    proportional weight threshold (0<p<1)
+
+copy : bool
+       if True, returns a copy of the matrix. Otherwise, modifies the matrix
+       in place. Default value=True.
+
+trace : list
+        if given, every attempted link removal is appended to the list as
+        a tuple (i, j, kept), see graph_estimates.threshold_connected
+
+
+Returns
+-------
+
+P : PackedSym
+    thresholded connectivity matrix
+
+Notes
+-----
+
+The packed version of graph_estimates.threshold_connected. Only the
+N(N-1)/2 links of the upper triangle are sorted, and the links that would
+disconnect the graph are found in one pass, see _spanning_links().
+
+'''
+
+def threshold_connected(P, p, copy=True, trace=None):
+
+    #p must be in the interval ]0;1[
+    if p > 1 or p < 0:
+        raise ValueError('Threshold must be in range [0,1]')
+    if copy:
+        P = P.copy()
+
+    #limit the floating point numbers, as in the dense version
+    P.data = np.around(P.data, decimals=6)
+
+    order = argsort_links(P)
+    rows, cols = triu_index(P.n)
+
+    #the dense version counts both mirror elements of every link,
+    #and removes one link for every second element
+    en = teachers_round(2 * len(order) * (1.0 - p))
+    steps = len(range(0, en, 2))
+
+    #the graph is disconnected from the start, no link can be removed
+    if P.number_of_components() > 1:
+        kept = np.ones(steps, dtype=bool)
+    else:
+        kept = _spanning_links(order, rows, cols, P.n)[:steps]
+
+    removed = order[:steps][~kept]
+    P.data[removed] = 0
+
+    if trace is not None:
+        for e, k in zip(order[:steps], kept):
+            trace.append((rows[e], cols[e], bool(k)))
+
+    return P
+
+
+'''
+Parameters
+----------
+
+order : np.ndarray
+        packed index of every link, by ascending weight, from argsort_links
+
+rows, cols : np.ndarray
+             the nodes of every packed index, from triu_index
+
+n : int
+    the number of nodes
+
+
+Returns
+-------
+
+span : np.ndarray
+       boolean, True for the links (in the given order) which are part of
+       the maximum spanning forest
+
+Notes
+-----
+
+Removing the weakest links one at a time, and reinserting those which
+disconnect the graph, is the reverse-delete algorithm. A link is reinserted
+exactly when its two nodes are not connected through stronger links, i.e.
+when it is in the maximum spanning forest. Kruskal's algorithm finds these
+links with a single union-find pass from the strongest link, instead of a
+connected components search for every attempted removal.
+
+'''
+
+def _spanning_links(order, rows, cols, n):
+
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    span = np.zeros(len(order), dtype=bool)
+    ri = rows[order].tolist()
+    ci = cols[order].tolist()
+    for k in range(len(order) - 1, -1, -1):
+        a = find(ri[k])
+        b = find(ci[k])
+        if a != b:
+            parent[a] = b
+            span[k] = True
+
+    return span
@@ -0,0 +1,145 @@
+import numpy as np
+import pathlib #only Python 3.5+
+from collections import OrderedDict
+
+
+'''
+Parameters
+----------
+
+W : NxN np.ndarray
+    undirected weighted connection matrix
+
+klevel : int
+         the highest degree level, default is the maximum degree
+
+
+Returns
+-------
+
+R : (klevel,) np.ndarray
+    the weighted rich-club coefficient at the levels k = 1..klevel, where the
+    club is the nodes of degree k or more. The same as bct.rich_club_wu,
+    which also gives NaN for the levels where every node is in the club,
+    or where the club has no links.
+
+Notes
+-----
+
+bctpy cuts the matrix down to the club for every level. A link is in the
+club of every level up to the smallest degree of its two nodes, so the
+number and weight of the club links of every level are cumulative sums
+over that smallest degree, and the strongest links of the whole network
+are a cumulative sum over the weights sorted once.
+
+'''
+
+def rich_club_wu(W, klevel=None):
+
+    W = np.asarray(W)
+    deg = np.count_nonzero(W, axis=0)
+
+    if klevel == None:
+        klevel = np.max(deg)
+
+    i, j = np.nonzero(np.triu(W, 1))
+    w = W[i, j]
+    m = np.minimum(deg[i], deg[j])
+
+    #links and weight of the links whose smallest degree is at least k
+    size = max(klevel, len(W)) + 1
+    En = np.cumsum(np.bincount(m, minlength=size)[::-1])[::-1]
+    Ws = np.cumsum(np.bincount(m, weights=w, minlength=size)[::-1])[::-1]
+    Er = En[1:klevel + 1]
+    Wr = Ws[1:klevel + 1]
+
+    #the total weight of the Er strongest links of the network
+    top = np.concatenate([[0.0], np.cumsum(np.sort(w)[::-1])])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R = Wr / top[Er]
+
+    #no nodes left out of the club
+    R[np.min(deg) >= np.arange(1, klevel + 1)] = np.nan
+
+    return R
+
+
+'''
+Parameters
+----------
+
+W : NxN np.ndarray
+    the thresholded connectivity matrix
+
+rand : NxN np.ndarray
+       a degree preserving randomization of W, e.g. the random network
+       of compute_small_worldness
+
+klevel : int
+         the highest degree level, N - 1 by default, such that the curves of
+         every subject and threshold have the same length
+
+
+Returns
+-------
+
+d : OrderedDict
+    'rich_club_wu-RC'     : the rich-club coefficient of W
+    'rich_club_wu-RCrand' : the rich-club coefficient of the random network
+    'rich_club_wu-RCnorm' : the normalized rich-club coefficient, RC / RCrand
+
+'''
+
+def rich_club_curves(W, rand, klevel=None):
+
+    if klevel == None:
+        klevel = len(W) - 1
+
+    d = OrderedDict()
+    d['rich_club_wu-RC'] = rich_club_wu(W, klevel)
+    d['rich_club_wu-RCrand'] = rich_club_wu(rand, klevel)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d['rich_club_wu-RCnorm'] = d['rich_club_wu-RC'] / d['rich_club_wu-RCrand']
+
+    return d
+
+
+'''
+Parameters
+----------
+
+path : string
+       the output path, the file is written to path/auto_results/richclub.npz
+
+thresholds : list
+             the thresholds of the sweep
+
+curves : list of OrderedDict
+         for every threshold, the (S, K) rich-club curves of every subject,
+         as returned from obtain_estimates
+
+
+Returns
+-------
+
+res : OrderedDict
+      the (S, T, K) arrays of every curve, for subject, threshold and degree level
+
+'''
+
+def save_rich_club(path, thresholds, curves):
+
+    res = OrderedDict()
+    for key in curves[0]:
+        res[key] = np.stack([c[key] for c in curves], axis=1)
+
+    dest = path + '/auto_results'
+    pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+
+    np.savez_compressed(dest + '/richclub.npz',
+                        thresholds=np.array([int(th * 100) for th in thresholds]),
+                        k=np.arange(1, res[key].shape[-1] + 1),
+                        **res)
+
+    return res
@@ -0,0 +1,401 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import shortest_path
+import utils.parallel as par
+
+
+#graphs at or below this density are estimated with the sparse backend
+SPARSE_DENSITY = 0.3
+
+#below this many nodes the dense bctpy functions are fast enough,
+#and the overhead of building the sparse matrices is not worth it
+SPARSE_MIN_NODES = 100
+
+#the most nodes in a batch of neighbourhoods for the local efficiency,
+#the inverse distances of a batch fit in a workspace of this size squared
+WORKSPACE_NODES = 256
+
+
+'''
+Parameters
+----------
+
+n : int
+    the number of nodes
+
+dens : float
+       the density of the thresholded graph, the fraction of possible links present
+
+backend : string
+          'dense', 'sparse' or 'auto'. With 'auto' the sparse backend is chosen
+          for graphs of at least SPARSE_MIN_NODES nodes with a density of at
+          most SPARSE_DENSITY.
+
+
+Returns
+-------
+
+sparse : bool
+         True if the graph should be estimated with the sparse backend
+
+'''
+
+def use_sparse(n, dens, backend='auto'):
+
+    if backend == 'sparse':
+        return True
+    if backend == 'dense':
+        return False
+    if backend != 'auto':
+        raise ValueError('Backend must be dense, sparse or auto, got ' + str(backend))
+
+    return n >= SPARSE_MIN_NODES and dens <= SPARSE_DENSITY
+
+
+#bct.cuberoot, keeps the sign of negative weights
+def cuberoot(x):
+    return np.sign(x) * np.abs(x) ** (1 / 3)
+
+
+'''
+Parameters
+----------
+
+G : NxN scipy.sparse matrix
+    undirected weighted connection matrix
+
+
+Returns
+-------
+
+L : NxN scipy.sparse.csr_matrix
+    connection-length matrix, every nonzero weight inverted, as bct.invert
+
+'''
+
+def invert(G):
+
+    L = sp.csr_matrix(G, copy=True)
+    L.data = 1.0 / L.data
+
+    return L
+
+
+'''
+Parameters
+----------
+
+G : NxN scipy.sparse matrix
+    undirected weighted connection matrix
+
+
+Returns
+-------
+
+s : (N,) np.ndarray
+    the strength of every node, as bct.strengths_und
+
+'''
+
+def strengths_und(G):
+
+    return np.asarray(G.sum(axis=0)).ravel()
+
+
+'''
+Parameters
+----------
+
+L : NxN scipy.sparse matrix
+    undirected connection-length matrix
+
+
+Returns
+-------
+
+D : NxN np.ndarray
+    the shortest weighted path lengths between all pairs of nodes, Inf
+    between disconnected nodes, as the first output of bct.distance_wei
+
+Notes
+-----
+
+Dijkstra's algorithm from scipy.sparse.csgraph, which visits only the
+links that are present, rather than scanning every row of the dense matrix.
+The distance matrix itself is dense, since the graphs are connected.
+
+'''
+
+def distance_wei(L):
+
+    return shortest_path(L, method='D', directed=False)
+
+
+'''
+Parameters
+----------
+
+D : NxN np.ndarray
+    distance matrix, as returned from distance_wei
+
+
+Returns
+-------
+
+Eglob : float
+        global efficiency, as bct.efficiency_wei
+
+Notes
+-----
+
+bct.efficiency_wei runs its own Dijkstra on the inverted weights, which
+gives the same distances as distance_wei, so the distance matrix used
+for the characteristic path length is reused here.
+
+'''
+
+def efficiency_wei(D):
+
+    n = len(D)
+    with np.errstate(divide='ignore'):
+        E = 1.0 / D
+    np.fill_diagonal(E, 0)
+
+    return np.sum(E) / (n * n - n)
+
+
+#the weighted 3-cycles through every node, the diagonal of ws^3
+def _cycles3(G):
+    ws = sp.csr_matrix(G, copy=True)
+    ws.data = cuberoot(ws.data)
+
+    return np.asarray((ws @ ws).multiply(ws).sum(axis=1)).ravel()
+
+
+'''
+Parameters
+----------
+
+G : NxN scipy.sparse matrix
+    undirected weighted connection matrix
+
+
+Returns
+-------
+
+C : (N,) np.ndarray
+    clustering coefficient vector, as bct.clustering_coef_wu
+
+'''
+
+def clustering_coef_wu(G):
+
+    G = sp.csr_matrix(G)
+    G.eliminate_zeros()
+
+    K = G.getnnz(axis=1).astype(float)
+    cyc3 = _cycles3(G)
+
+    #if no 3-cycles exist, set C=0
+    K[cyc3 == 0] = np.inf
+
+    return cyc3 / (K * (K - 1))
+
+
+'''
+Parameters
+----------
+
+G : NxN scipy.sparse matrix
+    undirected weighted connection matrix
+
+
+Returns
+-------
+
+T : float
+    transitivity, as bct.transitivity_wu
+
+'''
+
+def transitivity_wu(G):
+
+    G = sp.csr_matrix(G)
+    G.eliminate_zeros()
+
+    K = G.getnnz(axis=1).astype(float)
+
+    return np.sum(_cycles3(G)) / np.sum(K * (K - 1))
+
+
+'''
+Parameters
+----------
+
+G : NxN scipy.sparse matrix
+    undirected weighted connection matrix
+
+
+Returns
+-------
+
+r : float
+    assortativity coefficient, as bct.assortativity_wei with flag=0
+
+'''
+
+def assortativity_wei(G):
+
+    s = strengths_und(G)
+    U = sp.triu(G, 1).tocoo()
+    pos = U.data > 0
+    i = U.row[pos]
+    j = U.col[pos]
+    K = len(i)
+
+    stri = s[i]
+    strj = s[j]
+
+    term1 = np.sum(stri * strj) / K
+    term2 = np.square(np.sum(.5 * (stri + strj)) / K)
+    term3 = np.sum(.5 * (stri * stri + strj * strj)) / K
+
+    return (term1 - term2) / (term3 - term2)
+
+
+'''
+Parameters
+----------
+
+args : tuple
+       (G, Lc, batches), the weights and the cube rooted lengths as CSR
+       matrices, and the batches of nodes of this chunk, packed in a tuple
+       so the chunk can be sent to a worker process
+
+
+Returns
+-------
+
+nodes : np.ndarray
+        the nodes of the chunk
+
+E : (len(nodes),) np.ndarray
+    the local efficiency of those nodes
+
+Notes
+-----
+
+The induced subgraphs of the neighbourhoods of a batch are put on the
+diagonal of a single block matrix, so one call to Dijkstra finds the
+shortest paths of the whole batch. Paths never cross between the blocks,
+so the inverse distances outside the blocks are zero and the sums of every
+neighbourhood are split again with np.add.reduceat. The inverse distances
+are written into a workspace of WORKSPACE_NODES squared, allocated once
+per chunk and reused by every batch.
+
+'''
+
+def _local_efficiency_chunk(args):
+
+    G, Lc, batches = args
+
+    work = np.empty((WORKSPACE_NODES, WORKSPACE_NODES))
+
+    out = []
+    for nodes in batches:
+        Vs = [G.indices[G.indptr[u]:G.indptr[u + 1]] for u in nodes]
+        sizes = np.array([len(V) for V in Vs])
+        V = np.concatenate(Vs)
+        m = len(V)
+
+        #the induced subgraphs, with the links between different blocks left out
+        blk = np.repeat(np.arange(len(nodes)), sizes)
+        S = Lc[V][:, V].tocoo()
+        keep = blk[S.row] == blk[S.col]
+        S = sp.csr_matrix((S.data[keep], (S.row[keep], S.col[keep])), shape=(m, m))
+
+        #inverse distances within the neighbourhoods only, the nodes themselves left out
+        D = shortest_path(S, method='D', directed=False)
+        e = work[:m, :m] if m <= WORKSPACE_NODES else np.empty((m, m))
+        with np.errstate(divide='ignore'):
+            np.divide(1.0, D, out=e)
+        np.fill_diagonal(e, 0)
+
+        sw = 2 * cuberoot(np.concatenate([G.data[G.indptr[u]:G.indptr[u + 1]] for u in nodes]))
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        numer = np.add.reduceat(sw * (e @ sw), offsets)
+        out.append(numer / (4 * sizes * (sizes - 1)))
+
+    if len(out) == 0:
+        return (np.array([], dtype=int), np.zeros(0))
+
+    return (np.concatenate(batches), np.concatenate(out))
+
+
+'''
+Parameters
+----------
+
+G : NxN scipy.sparse matrix
+    undirected weighted connection matrix
+
+jobs : int
+       the number of worker processes the nodes are spread over
+
+
+Returns
+-------
+
+Eloc : (N,) np.ndarray
+       local efficiency vector, as bct.efficiency_wei(W, local=True)
+
+Notes
+-----
+
+The weighted local efficiency of Wang et al. 2016. bctpy runs its dense
+Dijkstra on the neighbourhood of every node with a Python loop over every
+row, here the shortest paths of every neighbourhood are found by scipy on
+the CSR matrix of its induced subgraph. The cube rooted lengths are
+computed once and shared by every neighbourhood.
+
+The nodes are sorted by degree and packed into batches of neighbourhoods
+of similar size, up to WORKSPACE_NODES nodes in total, see
+_local_efficiency_chunk. The batches are dealt out to the workers in turn,
+so every worker gets both small and large neighbourhoods.
+
+'''
+
+def local_efficiency_wei(G, jobs=1):
+
+    G = sp.csr_matrix(G)
+    G.eliminate_zeros()
+    n = G.shape[0]
+
+    Lc = invert(G)
+    Lc.data = cuberoot(Lc.data)
+
+    #nodes with fewer than two neighbours have no local efficiency
+    deg = np.diff(G.indptr)
+    nodes = np.flatnonzero(deg >= 2)
+    nodes = nodes[np.argsort(deg[nodes], kind='stable')]
+
+    batches = []
+    start = 0
+    total = 0
+    for k, u in enumerate(nodes):
+        if total + deg[u] > WORKSPACE_NODES and k > start:
+            batches.append(nodes[start:k])
+            start = k
+            total = 0
+        total += deg[u]
+    if start < len(nodes):
+        batches.append(nodes[start:])
+
+    jobs = max(1, jobs)
+    tasks = [(G, Lc, batches[j::jobs]) for j in range(min(jobs, len(batches)))]
+
+    E = np.zeros(n)
+    for idx, e in par.parallel_map(_local_efficiency_chunk, tasks, jobs=jobs):
+        E[idx] = e
+
+    return E
@@ -0,0 +1,153 @@
+import numpy as np
+import scipy.sparse as sp
+from collections import OrderedDict
+from scipy.sparse.linalg import eigsh
+
+
+#from this many nodes, only the needed eigenpairs are found with Lanczos,
+#instead of the full eigendecomposition of the whole stack
+LANCZOS_MIN_NODES = 500
+
+
+'''
+Parameters
+----------
+
+Ws : (S, N, N) np.ndarray
+     the thresholded connectivity matrices of all subjects
+
+
+Returns
+-------
+
+Ls : (S, N, N) np.ndarray
+     the weighted graph Laplacians, strength on the diagonal minus the weights
+
+'''
+
+def laplacians(Ws):
+
+    Ls = -Ws
+    n = Ws.shape[-1]
+    Ls[:, np.arange(n), np.arange(n)] += Ws.sum(axis=-1)
+
+    return Ls
+
+
+'''
+Parameters
+----------
+
+Ws : (S, N, N) np.ndarray
+     the thresholded connectivity matrices of all subjects
+
+
+Returns
+-------
+
+lam2, lamN : (S,) np.ndarray
+             the second smallest and the largest Laplacian eigenvalue
+
+rho : (S,) np.ndarray
+      the largest eigenvalue of the weights
+
+vec : (S, N) np.ndarray
+      the leading eigenvector of the weights
+
+'''
+
+def _eigh_stack(Ws):
+
+    #one batched call for every subject, eigenvalues in ascending order
+    lap = np.linalg.eigvalsh(laplacians(Ws))
+    vals, vecs = np.linalg.eigh(Ws)
+
+    return (lap[:, 1], lap[:, -1], vals[:, -1], vecs[:, :, -1])
+
+
+#the same as _eigh_stack, one subject at a time with the Lanczos solver
+def _lanczos_stack(Ws):
+
+    S, n = Ws.shape[:2]
+    lam2 = np.empty(S)
+    lamN = np.empty(S)
+    rho = np.empty(S)
+    vec = np.empty((S, n))
+
+    for s in range(S):
+        W = sp.csr_matrix(Ws[s])
+        L = sp.diags(np.asarray(W.sum(axis=1)).ravel()) - W
+
+        lamN[s] = eigsh(L, k=1, which='LA', return_eigenvectors=False)[0]
+        #shift-invert just below zero, as the Laplacian itself is singular
+        lam2[s] = np.sort(eigsh(L.tocsc(), k=2, sigma=-1e-6 * lamN[s], which='LM',
+                                return_eigenvectors=False))[1]
+
+        val, v = eigsh(W, k=1, which='LA')
+        rho[s] = val[0]
+        vec[s] = v[:, 0]
+
+    return (lam2, lamN, rho, vec)
+
+
+'''
+Parameters
+----------
+
+Ws : (S, N, N) np.ndarray
+     the thresholded connectivity matrices of all subjects, for a single threshold
+
+lanczos : bool
+          True to use the Lanczos solver, False for the full batched
+          eigendecomposition. None to choose by the number of nodes,
+          see LANCZOS_MIN_NODES.
+
+chunk : int
+        the number of subjects per batched eigendecomposition, None for the
+        whole stack at once, see resources.plan_resources
+
+
+Returns
+-------
+
+d : OrderedDict
+    'algebraic_connectivity' : (S,) the second smallest eigenvalue of the Laplacian
+    'synchronizability'      : (S,) the ratio of the second smallest and the largest
+                               Laplacian eigenvalue, larger is more synchronizable
+    'spectral_radius'        : (S,) the largest eigenvalue of the weights
+    'eigenvector_centrality' : (S, N) the leading eigenvector of the weights, as
+                               bct.eigenvector_centrality_und
+
+Notes
+-----
+
+All the measures only need the extreme eigenvalues, so with many nodes
+only those are found, with scipy's Lanczos solver on the sparse matrices.
+Otherwise the whole stack is decomposed with one batched np.linalg.eigh,
+or in batches of chunk subjects to bound the memory of the decomposition.
+
+'''
+
+def spectral_measures(Ws, lanczos=None, chunk=None):
+
+    Ws = np.asarray(Ws, dtype=float)
+
+    if lanczos == None:
+        lanczos = Ws.shape[-1] >= LANCZOS_MIN_NODES
+
+    if lanczos:
+        lam2, lamN, rho, vec = _lanczos_stack(Ws)
+    else:
+        if chunk == None:
+            chunk = len(Ws)
+        batches = [_eigh_stack(Ws[k:k + chunk]) for k in range(0, len(Ws), max(1, chunk))]
+        lam2, lamN, rho, vec = [np.concatenate(b) for b in zip(*batches)]
+
+    d = OrderedDict()
+    d['algebraic_connectivity'] = lam2
+    d['synchronizability'] = lam2 / lamN
+    d['spectral_radius'] = rho
+    #the sign of an eigenvector is arbitrary
+    d['eigenvector_centrality'] = np.abs(vec)
+
+    return d
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pathlib #only Python 3.5+
+from collections import OrderedDict
+import statistics.get_ttest as gtt
+
+
+'''
+Parameters
+----------
+
+df : pandas DataFrame,
+     the stacked estimate files, as returned from get_ttest.load_results
+
+summary : string,
+          which summary of the metric curves to compute:
+          'auc'   - trapezoidal area under the curve over the threshold range
+          'mean'  - the area divided by the width of the threshold range
+          'slope' - least-squares slope of the metric against the threshold
+          'max'   - the peak value over the thresholds
+
+
+Returns
+-------
+
+sdf : pandas DataFrame,
+      one row per subject, in the same layout as the estimate files,
+      with the 'Threshold' column set to the name of the summary
+
+Notes
+-----
+
+All subjects and metrics are integrated at once, by pivoting the table into
+a (subject, metric, threshold) array and reducing over the last axis.
+Thresholds are taken as proportions (e.g. 0.1 for 10%), such that the 'mean'
+summary is on the same scale as the metric itself.
+Subjects missing a threshold will get NaN for the summary.
+
+'''
+
+def summarize_thresholds(df, summary='auc'):
+
+    metrics = [c for c in df.columns if c not in gtt.ID_COLUMNS]
+
+    #wide table: rows are subjects, columns are (metric, threshold)
+    wide = df.set_index(['Unnamed: 0', 'Group', 'Season', 'Threshold'])[metrics].unstack('Threshold')
+    thr_list = sorted(df['Threshold'].unique())
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([metrics, thr_list]))
+
+    x = np.array(thr_list, dtype=float) / 100
+    y = wide.values.reshape(len(wide), len(metrics), len(thr_list))
+
+    if summary in ('auc', 'mean'):
+        #trapezoidal rule along the threshold axis
+        res = np.sum(np.diff(x) * (y[..., 1:] + y[..., :-1]) / 2, axis=-1)
+        if summary == 'mean':
+            res = res / (x[-1] - x[0])
+    elif summary == 'slope':
+        xc = x - x.mean()
+        res = np.sum(xc * (y - y.mean(axis=-1, keepdims=True)), axis=-1) / np.sum(xc * xc)
+    elif summary == 'max':
+        res = y.max(axis=-1)
+    else:
+        raise ValueError('Unknown summary: ' + str(summary))
+
+    sdf = pd.DataFrame(res, columns=metrics, index=wide.index).reset_index()
+    sdf['Threshold'] = summary
+
+    return sdf[['Unnamed: 0'] + metrics + ['Threshold', 'Group', 'Season']]
+
+
+'''
+Parameters
+----------
+
+path : string,
+       the path to the estimate.??.csv files
+
+WS : string,
+     the season to test, 'S' for summer and 'W' for winter
+
+summary : string,
+          the summary of the threshold curves, see summarize_thresholds()
+
+alpha_norm : float,
+             level of significance for the tests of normality
+
+alpha_ttest : float,
+              level of significance for the t-tests and u-tests
+
+nt : string,
+     'ks' or 'shapiro', the test for normality
+
+dest : string,
+       where the 'tests' folder with the resulting CSV files are written
+
+
+Returns
+-------
+
+res : pandas DataFrame,
+      the test (t-test or Mann-Whitney U), statistic and p-value
+      for every metric
+
+Notes
+-----
+
+The summaries are run through the same tests as a single threshold in
+get_ttest.gtt_main, so there is one test per metric instead of one per
+metric per threshold.
+
+'''
+
+def auc_main(path=None, WS='S', summary='auc', alpha_norm=0.05, alpha_ttest=0.05, nt='ks', dest=None):
+
+    if path == None:
+        print(' ')
+        print('**Please provide a path to the estimate files**')
+        exit()
+
+    df = gtt.load_results(path)
+    sdf = summarize_thresholds(df, summary)
+
+    #same structure as the per threshold dictionaries in gtt_main
+    d = OrderedDict()
+    d['thresh_percent'] = summary
+    d['groups'] = sdf.groupby(['Group', 'Season'])
+
+    hc_rad = gtt.get_norm_dist(d, alpha_norm, 'Healthy Control', WS, nor_t=nt)
+    sad_rad = gtt.get_norm_dist(d, alpha_norm, 'Case', WS, nor_t=nt)
+
+    ttest_result = gtt.compute_ttest(d, hc_rad, sad_rad, alpha_ttest, WS)[0]
+
+    rows = []
+    for item in ttest_result['accepted_ttest'] + ttest_result['rejected_ttest']:
+        rows.append([item[0], 'ttest', item[1], item[2]])
+
+    if len(hc_rad['rejected']) != 0 or len(sad_rad['rejected']) != 0:
+        for mw, item in gtt.compute_mannwhitney(d, hc_rad, sad_rad, alpha_ttest, WS):
+            rows.append([item, 'mannwhitneyu', mw[0], mw[1]])
+
+    res = pd.DataFrame(rows, columns=['Metric', 'Test', 'Statistic', 'pval'])
+    res = res.drop_duplicates(subset=['Metric']).sort_values('Metric').reset_index(drop=True)
+
+    if dest != None:
+        dest = dest + '/tests'
+        pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+
+        sdf.to_csv(dest + '/' + summary + '.csv', index=False)
+        res.to_csv(dest + '/' + WS + '_' + summary + '_tests.csv', index=False)
+
+    return res
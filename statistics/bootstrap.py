@@ -0,0 +1,314 @@
+import numpy as np
+import pandas as pd
+import pathlib #only Python 3.5+
+from scipy import stats
+import statistics.get_ttest as gtt
+import utils.parallel as par
+
+
+'''
+Parameters
+----------
+
+x : (..., n1, M) np.ndarray,
+    the samples of the first group, for M metrics
+
+y : (..., n2, M) np.ndarray,
+    the samples of the second group, for M metrics
+
+
+Returns
+-------
+
+g : (..., M) np.ndarray,
+    Hedges' g, i.e. Cohen's d with the pooled standard deviation,
+    corrected for small sample bias
+
+'''
+
+def hedges_g(x, y):
+
+    n1 = x.shape[-2]
+    n2 = y.shape[-2]
+
+    v1 = x.var(axis=-2, ddof=1)
+    v2 = y.var(axis=-2, ddof=1)
+    sp = np.sqrt(((n1 - 1) * v1 + (n2 - 1) * v2) / (n1 + n2 - 2))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d = (x.mean(axis=-2) - y.mean(axis=-2)) / sp
+
+    #small sample correction factor
+    J = 1 - 3 / (4 * (n1 + n2) - 9)
+
+    return J * d
+
+
+'''
+Parameters
+----------
+
+args : tuple,
+       (x, y, n_boot, seed), packed in a tuple so the chunk
+       can be sent to a worker process
+
+
+Returns
+-------
+
+boot : (3, n_boot, M) np.ndarray,
+       the bootstrapped Case mean, Healthy Control mean and Hedges' g
+
+Notes
+-----
+
+Every resample is a row in a (n_boot, n) index matrix, so all resamples
+and all metrics are computed with a single fancy indexing operation.
+
+'''
+
+def _bootstrap_chunk(args):
+
+    x, y, n_boot, seed = args
+
+    rng = np.random.default_rng(seed)
+    ix = rng.integers(0, len(x), size=(n_boot, len(x)))
+    iy = rng.integers(0, len(y), size=(n_boot, len(y)))
+
+    bx = x[ix]
+    by = y[iy]
+
+    return np.array([bx.mean(axis=1), by.mean(axis=1), hedges_g(bx, by)])
+
+
+'''
+Parameters
+----------
+
+x : (n1, M) np.ndarray,
+    the samples of the first group
+
+y : (n2, M) np.ndarray,
+    the samples of the second group
+
+
+Returns
+-------
+
+jack : (3, n1 + n2, M) np.ndarray,
+       the leave-one-out values of the two means and Hedges' g.
+       Leaving out a subject of one group leaves the mean of the
+       other group unchanged.
+
+'''
+
+def _jackknife(x, y):
+
+    n1 = len(x)
+    n2 = len(y)
+
+    #leave-one-out means and variances from the sums, so no loops are needed
+    def loo(z):
+        n = len(z)
+        s = z.sum(axis=0)
+        q = (z * z).sum(axis=0)
+        m = (s - z) / (n - 1)
+        v = ((q - z * z) - (n - 1) * m * m) / (n - 2)
+        return (m, v)
+
+    mx, vx = loo(x)
+    my, vy = loo(y)
+
+    Mx = np.concatenate([mx, np.repeat(x.mean(axis=0)[None], n2, axis=0)])
+    My = np.concatenate([np.repeat(y.mean(axis=0)[None], n1, axis=0), my])
+    Vx = np.concatenate([vx, np.repeat(x.var(axis=0, ddof=1)[None], n2, axis=0)])
+    Vy = np.concatenate([np.repeat(y.var(axis=0, ddof=1)[None], n1, axis=0), vy])
+
+    #the sample sizes also change with every left out subject
+    Nx = np.concatenate([np.full(n1, n1 - 1), np.full(n2, n1)])[:, None]
+    Ny = np.concatenate([np.full(n1, n2), np.full(n2, n2 - 1)])[:, None]
+
+    sp = np.sqrt(((Nx - 1) * Vx + (Ny - 1) * Vy) / (Nx + Ny - 2))
+    J = 1 - 3 / (4 * (Nx + Ny) - 9)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        G = J * (Mx - My) / sp
+
+    return np.array([Mx, My, G])
+
+
+'''
+Parameters
+----------
+
+theta : (K, M) np.ndarray,
+        the estimates from the original samples
+
+boot : (K, B, M) np.ndarray,
+       the bootstrap distributions of the estimates
+
+jack : (K, n, M) np.ndarray,
+       the jackknife values of the estimates
+
+alpha : float,
+        gives the (1 - alpha) confidence interval
+
+
+Returns
+-------
+
+ci : (2, K, M) np.ndarray,
+     the lower and upper bounds of the BCa confidence intervals
+
+Notes
+-----
+
+Bias-corrected and accelerated intervals (Efron 1987). The bias correction
+z0 comes from the fraction of bootstrap values below the estimate, and the
+acceleration from the skewness of the jackknife values.
+
+'''
+
+def bca_interval(theta, boot, jack, alpha=0.05):
+
+    B = boot.shape[1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z0 = stats.norm.ppf(np.mean(boot < theta[:, None, :], axis=1))
+
+        dev = jack.mean(axis=1, keepdims=True) - jack
+        a = np.sum(dev ** 3, axis=1) / (6 * np.sum(dev ** 2, axis=1) ** 1.5)
+
+    z0 = np.where(np.isfinite(z0), z0, 0.0)
+    a = np.where(np.isfinite(a), a, 0.0)
+
+    ci = []
+    sboot = np.sort(boot, axis=1)
+    for z in stats.norm.ppf([alpha / 2, 1 - alpha / 2]):
+        q = stats.norm.cdf(z0 + (z0 + z) / (1 - a * (z0 + z)))
+        idx = np.clip(np.floor(q * (B - 1)).astype(int), 0, B - 1)
+        ci.append(np.take_along_axis(sboot, idx[:, None, :], axis=1)[:, 0, :])
+
+    return np.array(ci)
+
+
+'''
+Parameters
+----------
+
+df : pandas DataFrame,
+     the stacked estimate files, as returned from get_ttest.load_results
+
+n_boot : int,
+         the number of bootstrap resamples B for every group
+
+alpha : float,
+        gives the (1 - alpha) confidence intervals
+
+jobs : int,
+       the number of worker processes, the B resamples of every stratum are
+       split into one chunk per job, and all chunks share the same workers
+
+seed : int,
+       seed for the random number generator
+
+
+Returns
+-------
+
+res : pandas DataFrame,
+      one row per threshold, season, statistic and metric, with the
+      estimate and the lower and upper bounds of the confidence interval.
+      The 'Group' column is 'Case' or 'Healthy Control' for the group means,
+      and 'Case vs Healthy Control' for Hedges' g.
+
+'''
+
+def bootstrap_groups(df, n_boot=2000, alpha=0.05, jobs=1, seed=None):
+
+    metrics = [c for c in df.columns if c not in gtt.ID_COLUMNS]
+    groups = df.groupby(['Threshold', 'Group', 'Season'])
+
+    strata = sorted(set((t, s) for t, g, s in groups.groups.keys()))
+    seeds = np.random.SeedSequence(seed).spawn(len(strata))
+
+    names = ['Case', 'Healthy Control', 'Case vs Healthy Control']
+    stat = ['mean', 'mean', 'hedges_g']
+
+    #the resamples of every stratum are split into chunks, and the chunks
+    #of all strata are run in a single pool of workers
+    n_jobs = max(1, jobs)
+    chunks = [len(c) for c in np.array_split(np.arange(n_boot), n_jobs) if len(c)]
+
+    found = []
+    tasks = []
+    for (t, s), ss in zip(strata, seeds):
+        try:
+            x = groups.get_group((t, 'Case', s))[metrics].values.astype(float)
+            y = groups.get_group((t, 'Healthy Control', s))[metrics].values.astype(float)
+        except KeyError:
+            continue
+
+        found.append((t, s, x, y))
+        tasks += [(x, y, c, cs) for c, cs in zip(chunks, ss.spawn(len(chunks)))]
+
+    out = par.parallel_map(_bootstrap_chunk, tasks, jobs=jobs)
+
+    rows = []
+    for i, (t, s, x, y) in enumerate(found):
+        theta = np.array([x.mean(axis=0), y.mean(axis=0), hedges_g(x, y)])
+
+        #the chunks of this stratum, in the order they were added
+        boot = np.concatenate(out[i * len(chunks):(i + 1) * len(chunks)], axis=1)
+
+        ci = bca_interval(theta, boot, _jackknife(x, y), alpha=alpha)
+
+        for k in range(3):
+            for m, metric in enumerate(metrics):
+                rows.append([t, s, names[k], stat[k], metric, theta[k, m], ci[0, k, m], ci[1, k, m]])
+
+    res = pd.DataFrame(rows, columns=['Threshold', 'Season', 'Group', 'Statistic', 'Metric',
+                                      'Estimate', 'CI_low', 'CI_high'])
+
+    return res
+
+
+'''
+Parameters
+----------
+
+path : string,
+       the path to the estimate.??.csv files
+
+dest : string,
+       where the 'tests' folder with the bootstrap.csv file is written
+
+Returns
+-------
+
+res : pandas DataFrame,
+      the results from bootstrap_groups()
+
+Notes
+-----
+
+The resulting bootstrap.csv can be given to the plots mode, which will then
+draw the confidence intervals as error bars instead of the standard deviation.
+
+'''
+
+def bootstrap_main(path=None, n_boot=2000, alpha=0.05, jobs=1, seed=None, dest=None):
+
+    if path == None:
+        print(' ')
+        print('**Please provide a path to the estimate files**')
+        exit()
+
+    df = gtt.load_results(path)
+    res = bootstrap_groups(df, n_boot=n_boot, alpha=alpha, jobs=jobs, seed=seed)
+
+    if dest != None:
+        dest = dest + '/tests'
+        pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+        res.to_csv(dest + '/bootstrap.csv', index=False)
+
+    return res
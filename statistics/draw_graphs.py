@@ -2,20 +2,47 @@ import numpy as np
 from scipy import stats
 import pandas as pd
 import pathlib 
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import glob
 from collections import OrderedDict
 import statistics.get_ttest as gtt
+import utils.parallel as par
 import os
 import sys
+import contextlib
+import hashlib
+import json
+
+
+#bump when the look of the plots changes, such that all plots are drawn again
+PLOT_VERSION = 1
+#font size of the graph labels
+FONT_SIZE = 20
+#name of the file in the plots folder keeping the fingerprints of the plots
+FINGERPRINTS = '.fingerprints.json'
+
+#dictionary for what to label on the plot title,
+#metrics not listed here are titled by their column name
+METRIC_NAMES = OrderedDict()
+
+METRIC_NAMES['assortativity_wei-r'] = 'Assortativity'
+METRIC_NAMES['avg_clustering_coef_wu:C'] = 'Clustering coefficient'
+METRIC_NAMES['charpath-lambda'] = 'Characteristic pathlength'
+METRIC_NAMES['efficiency_wei-Eglob'] = 'Global Efficiency'
+METRIC_NAMES['modularity_und-Q'] = 'Modularity'
+METRIC_NAMES['small_worldness:S'] = 'Small Worldness'
+METRIC_NAMES['transitivity_wu-T'] = 'Transitivity'
 
 
 '''
 Parameters
 ----------
 
-data : list,
-       a list of dataframes used in the ttesting
+summary : pandas DataFrame,
+          the group summary table from get_ttest.load_summary,
+          holding the mean, std, min and max of every group
 
 ttest : OrderedDict,
         the results of the ttesting, used to display those
@@ -35,6 +62,11 @@ thrs : list
 s : string,
     the season to plot, can be 'S' or 'W' (summer or winter)
 
+ci : pandas DataFrame,
+     the bootstrap results from bootstrap.bootstrap_groups, when given,
+     the error bars show the confidence intervals of the group means
+     rather than one standard deviation
+
 
 Returns
 -------
@@ -48,10 +80,14 @@ Code tries to figure out the best axis for y and x axis
 by taking the min and max of the metrics for the y-axis,
 and the min and max for the threshold percentages.
 
+Every call builds its own Figure on the Agg canvas, rather than drawing on
+the global pyplot figure, so plots can be rendered in separate processes
+and without a display.
+
 
 '''
 
-def draw_graphs(data, ttest, metric, rad, thrs, s='S', go=None):
+def draw_graphs(summary, ttest, metric, rad, thrs, s='S', go=None, ci=None):
 
     if go == None:
         print('Please specify a directory to write the plots to.')
@@ -63,31 +99,37 @@ def draw_graphs(data, ttest, metric, rad, thrs, s='S', go=None):
     xmax = -1
     xmin = 101
 
-    #clear the plot for good measure
-    plt.clf()
-    #make the font size on the graph labels a bit bigger
-    plt.rcParams.update({'font.size': 20})
+    #a fresh figure for every plot, not attached to pyplot
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
     
-    #loop over the data
-    for i in range(len(data)):
+    #the rows of the summary table for this metric and season
+    rows = summary[(summary['Metric'] == metric) & (summary['Season'] == s)]
+
+    #loop over the thresholds
+    for thresh, grp in rows.groupby('Threshold'):
         
-        thresh = data[i]['thresh_percent']
-        SADS = data[i]['groups'].get_group(('Case', s))
-        HCS = data[i]['groups'].get_group(('Healthy Control', s))
+        SADS = grp[grp['Group'] == 'Case'].iloc[0]
+        HCS = grp[grp['Group'] == 'Healthy Control'].iloc[0]
 
         jitter = 0.3
  
         #errorbars for our two sample groups
-        y1error = SADS[metric].std()
-        y2error = HCS[metric].std()
-        plt.errorbar(float(thresh)-jitter, SADS[metric].mean(), yerr=y1error, color='red', marker='D')
-        plt.errorbar(float(thresh)+jitter, HCS[metric].mean(), yerr=y2error, color='blue', marker='D')
+        if ci is None:
+            y1error = SADS['std']
+            y2error = HCS['std']
+        else:
+            y1error = ci_error(ci, thresh, s, 'Case', metric)
+            y2error = ci_error(ci, thresh, s, 'Healthy Control', metric)
+        ax.errorbar(float(thresh)-jitter, SADS['mean'], yerr=y1error, color='red', marker='D')
+        ax.errorbar(float(thresh)+jitter, HCS['mean'], yerr=y2error, color='blue', marker='D')
 
         #figure out the best axis values for both our x and y axis
-        hc_max = HCS[metric].max()
-        case_max = SADS[metric].max()
-        hc_min = HCS[metric].min()
-        case_min = SADS[metric].min()
+        hc_max = HCS['max']
+        case_max = SADS['max']
+        hc_min = HCS['min']
+        case_min = SADS['min']
 
         temp_max = max(hc_max,case_max)
         temp_min = min(hc_min,case_min)
@@ -116,11 +158,11 @@ def draw_graphs(data, ttest, metric, rad, thrs, s='S', go=None):
 
             temp = ttest[j]['rejected_ttest'][k][0]
             if temp == metric:
-                plt.plot(float(ttest[j]['thresh_percent']), ymax-(0.05*ymax), color='black', marker='*', markersize=12)
+                ax.plot(float(ttest[j]['thresh_percent']), ymax-(0.05*ymax), color='black', marker='*', markersize=12)
         
         temp2 = ttest[j]['rejected_norm']
         if metric in temp2:
-             plt.plot(ttest[j]['thresh_percent'], ymax-(0.05*ymax), color='green', marker='*', markersize=12)
+             ax.plot(float(ttest[j]['thresh_percent']), ymax-(0.05*ymax), color='green', marker='*', markersize=12)
 
         
   #COMMENT IN FOR SHOWING WHICH OF THE NORMAL DISTRIBUTION KS-TEST THAT FAILS     
@@ -128,16 +170,16 @@ def draw_graphs(data, ttest, metric, rad, thrs, s='S', go=None):
        
     #    try:
     #        temp3 = rad[thrs[k]]['HC']['rejected'][metric]
-    #        #plt.plot(float(thrs[k]), ymin+(0.95*ymin), marker='p', color='black', markersize=12)
-    #        plt.plot(float(thrs[k]), ymax-(0.05*ymax), marker='p', color='green', markersize=12)
+    #        #ax.plot(float(thrs[k]), ymin+(0.95*ymin), marker='p', color='black', markersize=12)
+    #        ax.plot(float(thrs[k]), ymax-(0.05*ymax), marker='p', color='green', markersize=12)
           
     #    except:
     #        pass
        
     #    try:
     #        temp4 = rad[thrs[k]]['SAD']['rejected'][metric]
-    #       # plt.plot(float(thrs[k]), ymin+(0.05*ymin), marker='p', color='black', markersize=12)
-    #        plt.plot(float(thrs[k]), ymax-(0.05*ymax), marker='p', color='green', markersize=12)
+    #       # ax.plot(float(thrs[k]), ymin+(0.05*ymin), marker='p', color='black', markersize=12)
+    #        ax.plot(float(thrs[k]), ymax-(0.05*ymax), marker='p', color='green', markersize=12)
     #    except:
     #        pass
 
@@ -146,105 +188,216 @@ def draw_graphs(data, ttest, metric, rad, thrs, s='S', go=None):
     else:
         season = 'Winter'
     
-    #dictionary for what to label on the plot title
-    d = OrderedDict()
-
-    d['assortativity_wei-r'] = 'Assortativity'
-    d['avg_clustering_coef_wu:C'] = 'Clustering coefficient'
-    d['charpath-lambda'] = 'Characteristic pathlength'
-    d['efficiency_wei-Eglob'] = 'Global Efficiency'
-    d['modularity_und-Q'] = 'Modularity'
-    d['small_worldness:S'] = 'Small Worldness'
-    d['transitivity_wu-T'] = 'Transitivity'
-
     #label our plot axis
-    plt.axis([xmin, xmax, ymin, ymax])
-    plt.xlabel('Sparsity threshold %')
-    plt.ylabel('Global mean ')
-    plt.title(d[metric])
-
-    met = metric.split(':')[0]
-
-    #where to put the graphs
-    dest = '/plots'
+    ax.axis([xmin, xmax, ymin, ymax])
+    ax.set_xlabel('Sparsity threshold %')
+    ax.set_ylabel('Global mean ')
+    ax.set_title(METRIC_NAMES.get(metric, metric))
 
     #makes a directory if it does not already exist
     #does nothing if the directory exists
     #Python3+ dependent
-    pathlib.Path(go + dest).mkdir(parents=True, exist_ok=True)
+    pathlib.Path(go + '/plots').mkdir(parents=True, exist_ok=True)
   
 
     #build the name which will be used as the stored file name
-    filename = str(go) + str(dest) + '/' + str(s) + '_' + str(met) + '.png'
+    filename = plot_filename(go, metric, s)
 
     #save the file to disk
-    plt.savefig(filename, format='png', bbox_inches='tight')
+    fig.savefig(filename, format='png', bbox_inches='tight')
 
 
-# Disable printing function
-def blockPrint():
-    sys.stdout = open(os.devnull, 'w')
+'''
+Parameters
+----------
 
-# Restore printing function
-def enablePrint():
-    sys.stdout = sys.__stdout__
+ci : pandas DataFrame,
+     the bootstrap results from bootstrap.bootstrap_groups
 
+thresh : string,
+         the threshold percentage
 
-def execute(path=None, dest=None, go=None):
-    #extract the summer season data,
-    #run the t-tests on the data before and use the return
-    #value of get_ttest.py to draw graphs upon
-    blockPrint()
-    kwdata = gtt.gtt_main(WS='W',nt='ks',path=path, dest=dest)
-    kwt = kwdata[0]
-    kwd = kwdata[1]
-    kwr = kwdata[2]
-    kwp = kwdata[3]
+s : string,
+    the season
 
+g : string,
+    the group, 'Case' or 'Healthy Control'
 
-    kdata = gtt.gtt_main(WS='S',nt='ks',path=path, dest=dest)
-    kt = kdata[0]
-    kd = kdata[1]
-    kr = kdata[2]
-    kp = kdata[3]
-    enablePrint()
+metric : string,
+         the name of the graph theory metric
 
-    
-    #draw the actual graphs
-    draw_graphs(kd,kt,'charpath-lambda', kr, kp, go=go)
 
-    draw_graphs(kwd,kwt,'charpath-lambda', kwr, kwp,s='W', go=go)
+Returns
+-------
 
-    draw_graphs(kd,kt,'efficiency_wei-Eglob', kr, kp, go=go)
+yerr : list,
+       the distances from the mean to the lower and upper bounds of the
+       confidence interval, in the shape that ax.errorbar expects
 
-    draw_graphs(kwd,kwt,'efficiency_wei-Eglob', kwr, kwp,s='W', go=go)
+'''
 
-    draw_graphs(kd,kt,'assortativity_wei-r',kr,kp, go=go)
+def ci_error(ci, thresh, s, g, metric):
 
-    draw_graphs(kwd,kwt,'assortativity_wei-r',kwr,kwp,s='W', go=go)
+    row = ci[(ci['Threshold'] == int(thresh)) & (ci['Season'] == s) & (ci['Group'] == g)
+             & (ci['Statistic'] == 'mean') & (ci['Metric'] == metric)]
 
-    draw_graphs(kd,kt,'avg_clustering_coef_wu:C',kr,kp, go=go)
+    est = row['Estimate'].values[0]
 
-    draw_graphs(kwd,kwt,'avg_clustering_coef_wu:C',kwr,kwp,s='W', go=go)
+    return [[est - row['CI_low'].values[0]], [row['CI_high'].values[0] - est]]
 
-    draw_graphs(kd,kt,'modularity_und-Q',kr,kp, go=go)
 
-    draw_graphs(kwd,kwt,'modularity_und-Q',kwr,kwp,s='W',go=go)
+'''
+Parameters
+----------
 
-    draw_graphs(kd,kt,'small_worldness:S',kr,kp, go=go)
+go : string,
+     the directory containing the plots folder
 
-    draw_graphs(kwd,kwt,'small_worldness:S',kwr,kwp,s='W', go=go)
+metric : string,
+         the name of the graph theory metric
 
-    draw_graphs(kd,kt,'transitivity_wu-T',kr,kp, go=go)
+s : string,
+    the season
 
-    draw_graphs(kwd,kwt,'transitivity_wu-T',kwr,kwp,s='W', go=go)
 
+Returns
+-------
 
+filename : string,
+           the path of the PNG file for this metric and season,
+           e.g. go/plots/W_assortativity_wei-r.png
 
-#for use independent of other files
-if __name__ == "__main__":
-    execute()
+'''
+
+def plot_filename(go, metric, s):
+
+    met = metric.split(':')[0]
+
+    return str(go) + '/plots/' + str(s) + '_' + str(met) + '.png'
+
+
+'''
+Parameters
+----------
+
+summary, ttest, metric, s, ci :
+     the same as for draw_graphs()
+
+
+Returns
+-------
+
+fp : string,
+     a SHA-256 hash of everything that ends up in the plot
+
+Notes
+-----
+
+The fingerprint covers the summary rows of the metric and season, the
+thresholds with significance markers, the confidence intervals (if any)
+and the rendering parameters. Values are rounded before hashing, such that
+reading the cached summary table back from CSV does not change the hash.
+
+'''
+
+def plot_fingerprint(summary, ttest, metric, s, ci=None):
+
+    h = hashlib.sha256()
+    h.update(repr((PLOT_VERSION, FONT_SIZE, metric, s, ci is None)).encode())
+
+    rows = summary[(summary['Metric'] == metric) & (summary['Season'] == s)]
+    h.update(rows.round(10).to_csv(index=False).encode())
 
+    markers = []
+    for t in ttest:
+        rejected = metric in [r[0] for r in t['rejected_ttest']]
+        markers.append((str(t['thresh_percent']), rejected, metric in t['rejected_norm']))
+    h.update(repr(markers).encode())
 
+    if ci is not None:
+        rows = ci[(ci['Metric'] == metric) & (ci['Season'] == s)]
+        h.update(rows.round(10).to_csv(index=False).encode())
 
+    return h.hexdigest()
+
+
+'''
+Parameters
+----------
+
+args : tuple,
+       the arguments of draw_graphs(), packed in a tuple so the plot
+       can be rendered by a worker process
+
+Returns
+-------
+
+(void) : does not return anything
 
+'''
+
+def _draw_task(args):
+
+    summary, ttest, metric, rad, thrs, s, go, ci = args
+
+    #make the font size on the graph labels a bit bigger,
+    #only for this plot rather than for the whole process
+    with matplotlib.rc_context({'font.size': FONT_SIZE}):
+        draw_graphs(summary, ttest, metric, rad, thrs, s=s, go=go, ci=ci)
+
+
+def execute(path=None, dest=None, go=None, ci=None, jobs=1, force=False):
+    #read the bootstrap confidence intervals if they were given
+    if ci != None:
+        ci = pd.read_csv(ci)
+
+    #run the t-tests of every season on a single load of the data,
+    #and use the return value of get_ttest.py to draw graphs upon.
+    #the printing of the tests is silenced while doing so
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            results = gtt.gtt_run(path=path, nt='ks', dest=dest)
+
+    #the group aggregates are computed once and cached next to the estimates,
+    #every plot only gets the rows of its own metric
+    summary = gtt.load_summary(path)
+
+    #fingerprints of the plots already on disk
+    fp_file = str(go) + '/plots/' + FINGERPRINTS
+    fingerprints = OrderedDict()
+    if os.path.exists(fp_file) and not force:
+        with open(fp_file) as f:
+            fingerprints.update(json.load(f))
+
+    #plot every metric found in the estimate files,
+    #skipping those whose inputs have not changed since they were drawn
+    tasks = []
+    skipped = 0
+    for metric, rows in summary.groupby('Metric', sort=False):
+        for s, (ct, dfl, rad, thl) in results.items():
+            fp = plot_fingerprint(rows, ct, metric, s, ci)
+            filename = plot_filename(go, metric, s)
+            key = os.path.basename(filename)
+
+            if fingerprints.get(key) == fp and os.path.exists(filename):
+                skipped += 1
+                continue
+
+            fingerprints[key] = fp
+            tasks.append((rows, ct, metric, rad, thl, s, go, ci))
+
+    #draw the actual graphs
+    par.parallel_map(_draw_task, tasks, jobs=jobs)
+
+    #only record the fingerprints once the plots are written
+    pathlib.Path(str(go) + '/plots').mkdir(parents=True, exist_ok=True)
+    with open(fp_file, 'w') as f:
+        json.dump(fingerprints, f, indent=1)
+
+    print('Drew ' + str(len(tasks)) + ' plots, ' + str(skipped) + ' were already up to date.')
+
+
+
+#for use independent of other files
+if __name__ == "__main__":
+    execute()
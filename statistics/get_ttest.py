@@ -5,12 +5,16 @@ import glob #for regex like functionality of finding files
 import pprint
 import sys
 import os
+import json
 from collections import OrderedDict
 from operator import itemgetter
 import pathlib #only Python 3.5+
 
 pp = pprint.PrettyPrinter(depth=6)
 
+#the columns of the estimate files that are not metrics
+ID_COLUMNS = ['Unnamed: 0', 'Threshold', 'Group', 'Season']
+
 
 '''
 Parameters
@@ -27,7 +31,7 @@ g : string
     the group to test, e.g. 'Case' for SAD or 'Healthy Control' for HC's
 
 s : string
-    the season to test, e.g. 'S' for summer and 'W' for winter
+    the stratum to test, e.g. the season 'S' for summer and 'W' for winter
 
 nor_t : string
         whether to use Kolmogorov-Smirnov test ('ks') or Shapiro-Wilks test ('shapiro')
@@ -57,7 +61,7 @@ def get_norm_dist(d, alpha, g, s,nor_t='ks'):
     guys = d['groups'].get_group((g, s))
     
     #drop the unused columns, so we can just iterate over the data structure
-    nd = guys.drop(columns=['Unnamed: 0', 'Threshold', 'Group', 'Season'])
+    nd = guys.drop(columns=d.get('id_columns', ID_COLUMNS))
     
     #dictionary of accepted and rejected hypothesises
     rad = OrderedDict()
@@ -112,7 +116,7 @@ alpha : float,
         the level of significance to test against
 
 s : string
-    the season to test ('S' for summer, 'W' for winter)
+    the stratum to test, e.g. the season ('S' for summer, 'W' for winter)
 
 
 Returns
@@ -122,9 +126,9 @@ dr : OrderedDict,
      the dictionary of rejections, mainly containing those samples which
      were not normally distributed under both the HC sampls AND the SAD samples.
 
-ttest_csv : list
-            data list for the results of the t-testing, will be saved to a csv files
-            with raw, unadjusted p-values.
+ttest_csv : OrderedDict
+            the threshold, season and raw, unadjusted p-value of every tested metric,
+            will be saved as a row of the ttests csv file.
 
 Notes
 -----
@@ -141,8 +145,8 @@ as a return value in the future, rather than just printing them out.
 def compute_ttest(d, hc_rad, sad_rad, alpha, s):
 
     #group our subjects according to HC, SAD and the season (summer/winter)
-    SAD_guys = d['groups'].get_group(('Case', s)).drop(columns=['Unnamed: 0', 'Threshold', 'Group', 'Season'])
-    HC_guys = d['groups'].get_group(('Healthy Control', s)).drop(columns=['Unnamed: 0', 'Threshold', 'Group', 'Season'])
+    SAD_guys = d['groups'].get_group(('Case', s)).drop(columns=d.get('id_columns', ID_COLUMNS))
+    HC_guys = d['groups'].get_group(('Healthy Control', s)).drop(columns=d.get('id_columns', ID_COLUMNS))
 
     #following code is to check that the attribute is normally distributed in BOTH groups
     both_norm = []
@@ -178,7 +182,6 @@ def compute_ttest(d, hc_rad, sad_rad, alpha, s):
     #when p < alpha, null hypothesis is rejected
 
     ttest_dict = OrderedDict()
-    ttest_res_temp = []
     pval_list = []
 
     #those samples which were both normally distributed, 
@@ -202,12 +205,13 @@ def compute_ttest(d, hc_rad, sad_rad, alpha, s):
         #make a list of the metric and the results
         pval_list.append((item, ttest_res[0],ttest_res[1]))
 
-    #data for our ttest csv file
-    ttest_lister = pval_list
-    ttest_lister.sort(key=itemgetter(0))
-    for i in range(len(ttest_lister)):
-        ttest_res_temp.append(ttest_lister[i][2])
-    ttest_csv = [d['thresh_percent'],s] + ttest_res_temp 
+    #data for our ttest csv file, keyed by the metric so that the columns
+    #line up even when some metrics were not tested
+    ttest_csv = OrderedDict()
+    ttest_csv['Threshold'] = d['thresh_percent']
+    ttest_csv[d.get('strata_col', 'Season')] = s
+    for item, tstat, pval in sorted(pval_list, key=itemgetter(0)):
+        ttest_csv[item] = pval
 
     #BENJAMIN-HOCHBERG ALGORITHM
     #used for FDR correction
@@ -268,7 +272,7 @@ alpha : float,
         the level of significance to test against
 
 s : string
-    the season to test ('S' for summer, 'W' for winter)
+    the stratum to test, e.g. the season ('S' for summer, 'W' for winter)
 
 
 Returns
@@ -283,8 +287,8 @@ res_list : list,
 def compute_mannwhitney(d, hc_rad, sad_rad, alpha, s):
 
     #group our subjects according to HC, SAD and the season (summer/winter)
-    SAD_guys = d['groups'].get_group(('Case', s)).drop(columns=['Unnamed: 0', 'Threshold', 'Group', 'Season'])
-    HC_guys = d['groups'].get_group(('Healthy Control', s)).drop(columns=['Unnamed: 0', 'Threshold', 'Group', 'Season'])
+    SAD_guys = d['groups'].get_group(('Case', s)).drop(columns=d.get('id_columns', ID_COLUMNS))
+    HC_guys = d['groups'].get_group(('Healthy Control', s)).drop(columns=d.get('id_columns', ID_COLUMNS))
     
     res_list = []
 
@@ -339,9 +343,187 @@ def compute_mannwhitney(d, hc_rad, sad_rad, alpha, s):
 Parameters
 ----------
 
-WS : string,
-     'Winter or Summer', 'S' for summer, 'W' for winter,
-     which season in question are to be statistically analyzed
+path : string,
+       the path to the directory containing the estimate.??.csv files
+
+
+Returns
+-------
+
+df : pandas DataFrame,
+     all the estimate files stacked into a single table, ordered by
+     threshold. The 'Threshold' column tells the files apart, and the
+     'Unnamed: 0' column is the subject index within each file.
+
+'''
+
+def load_results(path):
+
+    fl = sorted(glob.glob(str(path) + '/estimate.??.csv'))
+    if len(fl) == 0:
+        print(' ')
+        print('**No estimate files found in: ' + str(path) + '**')
+        exit()
+
+    df = pd.concat([pd.read_csv(f) for f in fl], ignore_index=True)
+
+    return df
+
+
+'''
+Parameters
+----------
+
+df : pandas DataFrame,
+     the stacked estimate files, as returned from load_results
+
+
+Returns
+-------
+
+summary : pandas DataFrame,
+          one row per threshold, group, season and metric, with the
+          mean, standard deviation, minimum, maximum and count of the subjects
+
+'''
+
+def group_summary(df):
+
+    metrics = [c for c in df.columns if c not in ID_COLUMNS]
+
+    #every aggregate of every metric in a single groupby
+    agg = df.groupby(['Threshold', 'Group', 'Season'])[metrics].agg(['mean', 'std', 'min', 'max', 'count'])
+
+    summary = agg.stack(level=0).rename_axis(['Threshold', 'Group', 'Season', 'Metric']).reset_index()
+    summary = summary[['Threshold', 'Group', 'Season', 'Metric', 'mean', 'std', 'min', 'max', 'count']]
+
+    return summary
+
+
+'''
+Parameters
+----------
+
+path : string,
+       the path to the directory containing the estimate.??.csv files
+
+
+Returns
+-------
+
+summary : pandas DataFrame,
+          the group summary table, see group_summary()
+
+Notes
+-----
+
+The table is cached as summary.csv next to the estimate files, together with
+the name, size and modification time of every estimate file in .summary_files.json.
+It is recomputed whenever that list changes, i.e. when an estimate file is
+added, deleted or rewritten.
+
+'''
+
+def load_summary(path):
+
+    cache = pathlib.Path(str(path) + '/summary.csv')
+    listing = pathlib.Path(str(path) + '/.summary_files.json')
+
+    #the name, size and modification time of every estimate file the summary is made from
+    files = []
+    for f in sorted(glob.glob(str(path) + '/estimate.??.csv')):
+        st = os.stat(f)
+        files.append([os.path.basename(f), st.st_size, st.st_mtime_ns])
+
+    if cache.exists() and listing.exists():
+        try:
+            with open(listing) as fp:
+                if json.load(fp) == files:
+                    return pd.read_csv(cache)
+        except ValueError:
+            pass
+
+    summary = group_summary(load_results(path))
+    summary.to_csv(cache, index=False)
+    with open(listing, 'w') as fp:
+        json.dump(files, fp)
+
+    return summary
+
+
+'''
+Parameters
+----------
+
+df : pandas DataFrame,
+     the stacked estimate files, as returned from load_results
+
+strata_col : string,
+             the column to stratify the subjects by
+
+groupIDcsv : string,
+             the CSV file containing the ID for the subjects
+
+
+Returns
+-------
+
+df : pandas DataFrame,
+     the estimates, with strata_col added from the ID file if it was not
+     already one of the columns of the estimate files
+
+Notes
+-----
+
+The estimate files only carry the group and the season of the subjects,
+any other column is looked up in the ID file. The subject index of the
+estimates ('Unnamed: 0') is the row in the ID file. The column is looked
+up both as given and in lower case, as in the ID file, e.g. 'Site' or 'site'.
+
+'''
+
+def add_strata(df, strata_col='Season', groupIDcsv=None):
+
+    if strata_col in df.columns:
+        return df
+
+    if groupIDcsv == None:
+        print(' ')
+        print('**The column ' + str(strata_col) + ' is not in the estimate files, '
+              'please provide the ID file with -id**')
+        exit()
+
+    iddf = pd.read_csv(groupIDcsv)
+    col = strata_col if strata_col in iddf.columns else strata_col.lower()
+    if col not in iddf.columns:
+        print(' ')
+        print('**No column ' + str(strata_col) + ' in the ID file: ' + str(groupIDcsv) + '**')
+        exit()
+
+    df[strata_col] = iddf[col].values[df['Unnamed: 0'].values]
+
+    return df
+
+
+'''
+Parameters
+----------
+
+path : string,
+       the path to the estimate.??.csv files
+
+strata : list,
+         the strata to test, e.g. ['S', 'W'] for the seasons. Default is
+         every stratum found in the estimate files.
+
+strata_col : string,
+             the column the subjects are stratified by, 'Season' by default.
+             A column that is not in the estimate files is taken from the
+             ID file, see add_strata.
+
+groupIDcsv : string,
+             the CSV file containing the ID for the subjects, only needed
+             when strata_col is not in the estimate files
 
 alpha_norm : float,
              which level of significance should be used for testing 
@@ -356,116 +538,163 @@ nt : string
      Currently 'ks' for Kolmogorov-Smirnov and 'shapiro' for 
      Shapiro-Wilks test is supported (same as the ones for get_norm()) 
 
-Returns
--------
-
-ct_list : OrderedDict,
-          contains the results from the computed t-testings
+dest : string,
+       where the 'tests' folder with the resulting CSV files are written
 
-dfl : list
-      a list of dataframes that were used in the testing
 
-rad_dict : OrderedDict,
-           the 'Rejected and Accepted Dict' which contains an overview
-           of which samples which failed tests for normality, and which 
-           that did not
-
-thl_list : list
-           a list of which threshold percentages were used for the analysis
+Returns
+-------
 
+results : OrderedDict,
+          keyed by the stratum, every entry holds the same 
+          (ct_list, dfl, rad_dict, thl) tuple as gtt_main returns
 
 Notes
------           
+-----
 
-Currently the file path has to be hardcoded in here, this should be 
-fixed soon. 
+The estimate files are read and grouped once, and the groups are shared
+by the tests of every stratum. A threshold where a stratum lacks the Case
+or the Healthy Control subjects is skipped, and a stratum without any
+threshold left is left out of the results. The CSV files are named after the stratum,
+e.g. S_ttests.csv.
 
 '''
 
-def gtt_main(WS='S',alpha_norm=0.05,alpha_ttest=0.05,nt='ks', path=None, dest=None):
+def gtt_run(path=None, strata=None, alpha_norm=0.05, alpha_ttest=0.05, nt='ks', dest=None,
+            strata_col='Season', groupIDcsv=None):
 
-    #     path = os.path.dirname(os.path.dirname( __file__ ))
     if path == None:
         print(' ')
         print('**Please provide a path to the estimate files**')
         exit()
 
-    # find the estimate files in the given directory
-    fl = glob.glob(str(path) + '/estimate.??.csv')
-    #'auto_results/estimates/AALestimate.??.csv'
-    
+    #load every estimate file once
+    data = add_strata(load_results(path), strata_col, groupIDcsv)
+
+    if strata == None:
+        strata = sorted(data[strata_col].unique())
+
+    #every column that is not a metric is left out of the tests
+    id_columns = ID_COLUMNS + [c for c in [strata_col] if c not in ID_COLUMNS]
+
     #create a list of dictionaries, 
     #then load the sorted groups along with the threshold into it
     dfl = []     #pandas dataframe list 
     thl = []     #threshold percentage list
 
-    for f in fl:
-        df = pd.read_csv(f)
-        thp = f.split('.')[::-1][1]               #get the threshold percentage
-        groups = df.groupby(['Group', 'Season'])  
+    for thr, df in data.groupby('Threshold'):
+        thp = str(thr)                            #the threshold percentage
+        groups = df.groupby(['Group', strata_col])  
 
         d = OrderedDict()
         d['thresh_percent'] = thp
         d['groups'] = groups
+        d['strata_col'] = strata_col
+        d['id_columns'] = id_columns
 
         thl.append(thp)
         dfl.append(d)
 
-    
-    #compute the t-test for the various thresholds
-    ct_list = []
-    rad_dict = OrderedDict()
-    t_csv = []
-    frames = []
-    
+    results = OrderedDict()
+
+    for WS in strata:
+        #compute the t-test for the various thresholds
+        ct_list = []
+        rad_dict = OrderedDict()
+        t_csv = []
+        frames = []
+
+        for item in dfl:
+            #a stratum without subjects of both groups at this threshold cannot be tested
+            missing = [g for g in ['Case', 'Healthy Control'] if (g, WS) not in item['groups'].groups]
+            if len(missing) != 0:
+                print('Skipping ' + str(WS) + ' in the threshold of : ' + str(item['thresh_percent'])
+                      + '%, no subjects of : ' + ', '.join(missing))
+                continue
+
+            #perform the tests for normality distribution
+            hc_rad = get_norm_dist(item, alpha_norm, 'Healthy Control', WS,nor_t=nt)
+            sad_rad = get_norm_dist(item, alpha_norm, 'Case', WS,nor_t=nt)
+
+            #perform the actual t-testing
+            ttest_result,ttest_csv = compute_ttest(item, hc_rad, sad_rad, alpha_ttest, WS)
+
+            #save the results in dictionaries for return value
+            ct_list.append(ttest_result)
+            rad_dict[item['thresh_percent']] = OrderedDict()
+            rad_dict[item['thresh_percent']]['HC'] = hc_rad
+            rad_dict[item['thresh_percent']]['SAD'] = sad_rad
+
+            #build up the dataframes to save as a CSV file
+            #CSV for normality tests
+            frames.append(pd.DataFrame(hc_rad))
+            frames.append(pd.DataFrame(sad_rad))
+            #CSV for ttests
+            t_csv.append(ttest_csv)
+
+            #perform Wilcoxon rank sum if there are any rejections of normal distributions
+            if len(hc_rad['rejected'])!= 0 or len(sad_rad['rejected'])!=0:
+                compute_mannwhitney(item, hc_rad, sad_rad, alpha_ttest, WS)
+
+        if len(t_csv) == 0:
+            print('No threshold could be tested for : ' + str(WS))
+            continue
+
+        if dest != None:    
+            #save the results to CSV files
+            #first make a directory to save the files to
+            tdest = dest + '/tests'
+            pathlib.Path(tdest).mkdir(parents=True, exist_ok=True)
+        
+            norms = pd.concat(frames)
 
-    for item in dfl:
-        #perform the tests for normality distribution
-        hc_rad = get_norm_dist(item, alpha_norm, 'Healthy Control', WS,nor_t=nt)
-        sad_rad = get_norm_dist(item, alpha_norm, 'Case', WS,nor_t=nt)
+            ttests = pd.DataFrame(t_csv)
 
-        #perform the actual t-testing
-        ttest_result,ttest_csv = compute_ttest(item, hc_rad, sad_rad, alpha_ttest, WS)
-        
+            #paths to the CSV files
+            #save the normality tests to a CSV file
+            norms.to_csv(tdest + '/' + str(WS) + '_normality.csv')
+            #save the ttests results to a CSV file
+            ttests.to_csv(tdest + '/'+ str(WS) + '_ttests.csv')
 
-        #save the results in dictionaries for return value
-        ct_list.append(ttest_result)
-        rad_dict[item['thresh_percent']] = OrderedDict()
-        rad_dict[item['thresh_percent']]['HC'] = hc_rad
-        rad_dict[item['thresh_percent']]['SAD'] = sad_rad
-
-        #build up the dataframes to save as a CSV file
-        #CSV for normality tests
-        frames.append(pd.DataFrame(hc_rad))
-        frames.append(pd.DataFrame(sad_rad))
-        #CSV for ttests
-        t_csv.append(ttest_csv)
-
-        #perform Wilcoxon rank sum if there are any rejections of normal distributions
-        if len(hc_rad['rejected'])!= 0 or len(sad_rad['rejected'])!=0:
-            compute_mannwhitney(item, hc_rad, sad_rad, alpha_ttest, WS)
-    
+        results[WS] = (ct_list, dfl, rad_dict, thl)
 
-    if dest != None:    
-        #save the results to CSV files
-        #first make a directory to save the files to
-        dest = dest + '/tests'
-        pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
-    
-        norms = pd.concat(frames)
+    return results
+
+
+'''
+Parameters
+----------
+
+WS : string,
+     'Winter or Summer', 'S' for summer, 'W' for winter,
+     which season in question are to be statistically analyzed
 
-        ttests = pd.DataFrame(t_csv, columns=['Threshold', 'Season', \
-            'Assortativity', 'ClusteringCoefficient', 'CharPath', 'GlobalEfficiency', \
-            'Modularity', 'SmallWorld', 'Transitivity'])
+alpha_norm, alpha_ttest, nt, path, dest : 
+     see gtt_run()
 
-        #paths to the CSV files
-        #save the normality tests to a CSV file
-        norms.to_csv(dest + '/' + WS + '_normality.csv')
-        #save the ttests results to a CSV file
-        ttests.to_csv(dest + '/'+ WS + '_ttests.csv')
+Returns
+-------
+
+ct_list : OrderedDict,
+          contains the results from the computed t-testings
 
+dfl : list
+      a list of dataframes that were used in the testing
+
+rad_dict : OrderedDict,
+           the 'Rejected and Accepted Dict' which contains an overview
+           of which samples which failed tests for normality, and which 
+           that did not
+
+thl_list : list
+           a list of which threshold percentages were used for the analysis
+
+'''
+
+def gtt_main(WS='S',alpha_norm=0.05,alpha_ttest=0.05,nt='ks', path=None, dest=None):
 
-    return (ct_list, dfl, rad_dict, thl)
+    return gtt_run(path=path, strata=[WS], alpha_norm=alpha_norm, alpha_ttest=alpha_ttest,
+                   nt=nt, dest=dest)[WS]
 
 #if used as an individual file
 if __name__ == "__main__":
@@ -1,33 +1,207 @@
-
 #https://stackoverflow.com/questions/43043519/is-it-possible-to-do-glmm-in-python
 #https://stats.idre.ucla.edu/other/mult-pkg/introduction-to-generalized-linear-mixed-models/
 
-#use these in terminal on Mac(maybe UNIX also) if getting alot of wierd warnings from rpy2
-# export LANG=en_US.UTF-8
-# export LC_ALL=en_US.UTF-8
-# locale
-
-#packages used: pandas, glob and rpy2
+#packages used: numpy, scipy, pandas
+#the models used to be fitted in R through rpy2, they are now fitted natively
+#with the same iteratively reweighted least squares as R's glm()
 
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
-import glob
-from rpy2 import robjects as ro
-from rpy2.robjects import pandas2ri
-from rpy2.robjects.packages import importr
-from rpy2.robjects import Formula
-from rpy2.robjects.vectors import FloatVector
-import sys
-
-
-def glm(path, s='S'):
-    #activate R functions in Python using rpy2
-    pandas2ri.activate()
-    base = importr('base')
-    stats = importr('stats')
-    lme4 = importr('lme4')
-    lmtest = importr('lmtest')
-    R = ro.r
+import pathlib #only Python 3.5+
+from scipy import stats
+from scipy.special import expit
+import statistics.get_ttest as gtt
+import utils.parallel as par
+
+
+#remap the bct function output names to something a bit more digestable for us to use in the rest of the code
+RENAME = {'charpath-lambda': 'charpath', 'avg_clustering_coef_wu:C' : 'cc','efficiency_wei-Eglob' : 'effGlob', \
+          'assortativity_wei-r' : 'assor', 'modularity_und-Q' : 'modul', 'transitivity_wu-T' : 'trans', \
+          'small_worldness:S' : 'smwor',   'Unnamed: 0' : 'ID'  }
+
+#Global efficiency makes model unpredictable, so we remove it
+FULL_TERMS = ['assor', 'charpath', 'cc', 'modul', 'trans', 'smwor']
+
+#the order the likelihood ratio tests are reported in
+TEST_ORDER = ['assor', 'charpath', 'cc', 'modul', 'smwor', 'trans']
+
+#long names used when reporting the tests
+TEST_NAMES = {'assor': 'ASSORTATIVITY', 'charpath': 'CHARACTERISTIC PATH LENGTH', \
+              'cc': 'CLUSTERING COEFFICIENT', 'modul': 'MODULARITY', \
+              'smwor': 'SMALL WORLDNESS', 'trans': 'TRANSITIVITY'}
+
+
+'''
+Parameters
+----------
+
+X : (n, p) np.ndarray,
+    the design matrix, including the column of ones for the intercept
+
+y : (n,) np.ndarray,
+    the binary response
+
+masks : (K, p) np.ndarray,
+        boolean mask of the columns of X used by each of the K models
+
+max_iter : int,
+           maximum number of Newton steps
+
+tol : float,
+      convergence tolerance on the change of the coefficients
+
+
+Returns
+-------
+
+beta : (K, p) np.ndarray,
+       the fitted coefficients of every model, zero for the columns left out
+
+se : (K, p) np.ndarray,
+     the standard errors of the coefficients
+
+loglik : (K,) np.ndarray,
+         the log-likelihood of every model
+
+Notes
+-----
+
+All K models are fitted at once. Leaving out a column is done by zeroing
+it in the design matrix and putting a one on the diagonal of its Hessian,
+so every model has a (p, p) system and one batched np.linalg.solve
+takes the Newton step of every model at the same time.
+
+'''
+
+def irls_logistic(X, y, masks, max_iter=50, tol=1e-8):
+
+    masks = np.asarray(masks, dtype=bool)
+    K, p = masks.shape
+
+    Xk = X[None, :, :] * masks[:, None, :]
+    pad = np.zeros((K, p, p))
+    pad[:, np.arange(p), np.arange(p)] = ~masks
+
+    beta = np.zeros((K, p))
+    eps = 1e-10
+
+    for it in range(max_iter):
+        mu = np.clip(expit(np.einsum('knp,kp->kn', Xk, beta)), eps, 1 - eps)
+        w = mu * (1 - mu)
+
+        H = np.einsum('knp,kn,knq->kpq', Xk, w, Xk) + pad
+        grad = np.einsum('knp,kn->kp', Xk, y[None, :] - mu)
+
+        step = np.linalg.solve(H, grad[..., None])[..., 0]
+        beta = beta + step
+
+        if np.max(np.abs(step)) < tol:
+            break
+    else:
+        print('IRLS did not converge in ' + str(max_iter) + ' iterations, '
+              'the groups might be perfectly separated')
+
+    mu = np.clip(expit(np.einsum('knp,kp->kn', Xk, beta)), eps, 1 - eps)
+    w = mu * (1 - mu)
+    H = np.einsum('knp,kn,knq->kpq', Xk, w, Xk) + pad
+    se = np.sqrt(np.diagonal(np.linalg.inv(H), axis1=1, axis2=2)) * masks
+
+    loglik = np.sum(y * np.log(mu) + (1 - y) * np.log(1 - mu), axis=1)
+
+    return (beta, se, loglik)
+
+
+'''
+Parameters
+----------
+
+df : pandas DataFrame,
+     the estimates of a single threshold and season, with the renamed
+     columns and 'Group' remapped to 1 for Case and 0 for Healthy Control
+
+terms : list,
+        the terms of the full model
+
+n : int,
+    the number of tests used for the Bonferroni correction
+
+
+Returns
+-------
+
+res : pandas DataFrame,
+      one row per term, with the likelihood ratio statistic of the full
+      model against the model without the term, the p-value and the
+      Bonferroni adjusted p-value
+
+coef : pandas DataFrame,
+       the coefficients, standard errors and Wald p-values of the full model
+
+'''
+
+def fit_lrtests(df, terms=FULL_TERMS, n=12):
+
+    df = df.dropna(subset=terms + ['Group'])
+
+    X = np.column_stack([np.ones(len(df))] + [df[t].values.astype(float) for t in terms])
+    y = df['Group'].values.astype(float)
+
+    #the full model, followed by the nested models leaving out one term each
+    p = len(terms) + 1
+    masks = np.ones((p, p), dtype=bool)
+    for k in range(1, p):
+        masks[k, k] = False
+
+    beta, se, loglik = irls_logistic(X, y, masks)
+
+    #likelihood ratio tests, as in lmtest.lrtest with one degree of freedom
+    rows = []
+    for t in TEST_ORDER:
+        if t not in terms:
+            continue
+        k = terms.index(t) + 1
+        chisq = 2 * (loglik[0] - loglik[k])
+        pval = stats.chi2.sf(chisq, 1)
+        rows.append([t, loglik[0], loglik[k], chisq, pval, min(1.0, pval * n)])
+
+    res = pd.DataFrame(rows, columns=['Term', 'LogLik_full', 'LogLik_nested', 'Chisq', 'pval', 'pval_bonferroni'])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = beta[0] / se[0]
+    coef = pd.DataFrame({'Estimate': beta[0], 'StdError': se[0], 'z': z,
+                         'pval': 2 * stats.norm.sf(np.abs(z))},
+                        index=['(Intercept)'] + list(terms))
+
+    return (res, coef)
+
+
+'''
+Parameters
+----------
+
+path : string,
+       a single estimate file, e.g. auto_results/estimate.10.csv
+
+s : string,
+    the season to perform the logistic regression upon, 'S' or 'W'
+
+n : int,
+    the number of tests used for the Bonferroni correction, 12 for the
+    six metrics in both seasons
+
+dest : string,
+       where the 'tests' folder with the resulting CSV file is written
+
+
+Returns
+-------
+
+res : pandas DataFrame,
+      the likelihood ratio tests, see fit_lrtests()
+
+'''
+
+def glm(path, s='S', n=12, dest=None):
 
     if s == 'S':
         season = 1
@@ -36,72 +210,16 @@ def glm(path, s='S'):
 
     df = pd.read_csv(path)
 
-
     #remap the the group labels into numerical values
     df['Group'] = df['Group'].map({'Case': 1, 'Healthy Control': 0})
     df['Season'] = df['Season'].map({'S': 1, 'W': 0})
 
-    #remap the bct function output names to something a bit more digestable for us to use in the rest of the code
-    df.rename(index=str, columns={'charpath-lambda': 'charpath', 'avg_clustering_coef_wu:C' : 'cc','efficiency_wei-Eglob' : 'effGlob', \
-                                   'assortativity_wei-r' : 'assor', 'modularity_und-Q' : 'modul', 'transitivity_wu-T' : 'trans', \
-                                   'small_worldness:S' : 'smwor',   'Unnamed: 0' : 'ID'  }, inplace=True)
-
-
+    df = df.rename(index=str, columns=RENAME)
 
     #get only data from one season (should this be a random effect?)
-    groups = df.groupby(['Season'])
-    #change to 0 for summer, 1 for winter
-    df = groups.get_group(season)
-
-
-    #Global efficiency makes model unpredictable, so we remove it
-    full = 'Group ~ assor + charpath + cc + modul + trans + smwor'
-    a = stats.glm(full, family = 'binomial', data = df)
-    print(R.summary(a))
-
-
-    #testing for trans
-    print('TRANSITIVITY')
-    null1 = 'Group ~ assor + charpath + cc + modul + smwor'
-    b = stats.glm(null1, family = 'binomial', data = df)
-    lr_t = lmtest.lrtest(a, b)
-    print(lr_t)
-
-
-    #testing for smwor
-    print('SMALL WORLDNESS')
-    null2 = 'Group ~ assor + charpath + cc + modul + trans'
-    c = stats.glm(null2, family = 'binomial', data = df)
-    lr_s = lmtest.lrtest(a, c)
-    print(lr_s)
-
-    #testing for modul
-    print('MODULARITY')
-    null3 = 'Group ~ assor + charpath + cc + trans + smwor'
-    d = stats.glm(null3, family = 'binomial', data = df)
-    lr_m = lmtest.lrtest(a, d)
-    print(lr_m)
-
-    #testing for clustering coefficient
-    print('CLUSTERING COEFFICIENT')
-    null4 = 'Group ~ assor + charpath + modul + trans + smwor'
-    e = stats.glm(null4, family = 'binomial', data = df)
-    lr_cc = lmtest.lrtest(a, e)
-    print(lr_cc)
-
-    #testing for charpath
-    print('CHARACTERISTIC PATH LENGTH')
-    null5 = 'Group ~ assor + cc + modul + trans + smwor'
-    f = stats.glm(null5, family = 'binomial', data = df)
-    lr_cpl = lmtest.lrtest(a, f)
-    print(lr_cpl)
-
-    #testing for assor
-    print('ASSORTATIVITY')
-    null6 = 'Group ~ charpath + cc + modul + trans + smwor'
-    g = stats.glm(null6, family = 'binomial', data = df)
-    lr_a = lmtest.lrtest(a, g)
-    print(lr_a)
+    df = df[df['Season'] == season]
+
+    res, coef = fit_lrtests(df, n=n)
 
     sum_win = 'DUMMY'
 
@@ -110,28 +228,117 @@ def glm(path, s='S'):
     else:
         sum_win = 'summer'
 
+    print(coef)
     print(' ')
     print('GLM performed with season: ' + str(sum_win))
-
-    
-    n = 12
-    
-    lst = [lr_a[4][1],lr_cpl[4][1],lr_cc[4][1],lr_m[4][1],lr_s[4][1],lr_t[4][1]]
-    flist = [float(i) for i in lst]
-    flist = [round(i,4) for i in flist]
-    
-    print(' ')
-    print('Unadjusted p-values for our GLM')
-    print(flist)
     print(' ')
-    print('Adjusted p-values after Bonferroni correction for multiple comparison testing with '\
+    print('Likelihood ratio tests, adjusted p-values after Bonferroni correction for multiple comparison testing with '\
            + str(n) + ' tests')
-    print(stats.p_adjust(FloatVector(flist), method='bonferroni', n=n))
+    print(res.replace({'Term': TEST_NAMES}).round(4))
+
+    if dest != None:
+        dest = dest + '/tests'
+        pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+        res.to_csv(dest + '/' + ('S' if season == 1 else 'W') + '_glm.csv', index=False)
+
+    return res
+
+
+'''
+Parameters
+----------
+
+args : tuple,
+       (threshold, season, df), packed in a tuple so the fit
+       can be sent to a worker process
+
+Returns
+-------
+
+res : pandas DataFrame,
+      the likelihood ratio tests of this threshold and season
+
+'''
+
+def _fit_stratum(args):
 
+    thr, s, df = args
 
+    res = fit_lrtests(df, n=1)[0]
+    res.insert(0, 'Season', s)
+    res.insert(0, 'Threshold', thr)
 
+    return res
 
 
+'''
+Parameters
+----------
 
+path : string,
+       the path to the directory with the estimate.??.csv files
 
+seasons : list,
+          the seasons to perform the logistic regressions upon
 
+jobs : int,
+       the number of worker processes the fits are spread over
+
+dest : string,
+       where the 'tests' folder with the resulting CSV file is written
+
+
+Returns
+-------
+
+res : pandas DataFrame,
+      the likelihood ratio tests of every threshold, season and term,
+      with the p-values adjusted for all the tests in the table, both by
+      Bonferroni and by Holm's step-down procedure
+
+Notes
+-----
+
+The estimate files are loaded once, and the full and nested models of
+every threshold and season combination are fitted in parallel.
+
+'''
+
+def glm_batch(path, seasons=('S', 'W'), jobs=1, dest=None):
+
+    df = gtt.load_results(path)
+
+    df['Group'] = df['Group'].map({'Case': 1, 'Healthy Control': 0})
+    df = df.rename(index=str, columns=RENAME)
+
+    tasks = []
+    for (thr, s), sub in df.groupby(['Threshold', 'Season']):
+        if s in seasons:
+            tasks.append((thr, s, sub))
+
+    res = pd.concat(par.parallel_map(_fit_stratum, tasks, jobs=jobs), ignore_index=True)
+    res = res.drop(columns=['pval_bonferroni'])
+
+    #family-wise corrections over every fit in the table
+    m = len(res)
+    res['pval_bonferroni'] = np.minimum(1.0, res['pval'] * m)
+
+    order = np.argsort(res['pval'].values)
+    holm = np.maximum.accumulate(res['pval'].values[order] * (m - np.arange(m)))
+    res.loc[res.index[order], 'pval_holm'] = np.minimum(1.0, holm)
+
+    print('Fitted ' + str(len(tasks)) + ' threshold and season combinations, ' + str(m) + ' tests in total')
+    sig = res[res['pval_holm'] < 0.05]
+    if len(sig) == 0:
+        print('No significant likelihood ratio tests after correction')
+    for i in sig.index:
+        print('Likelihood ratio test significant for: ' + TEST_NAMES[sig['Term'][i]] + ' in season '
+              + str(sig['Season'][i]) + ' at threshold ' + str(sig['Threshold'][i]) + '%'
+              + ' with adjusted p-value: ' + str(round(sig['pval_holm'][i], 6)))
+
+    if dest != None:
+        dest = dest + '/tests'
+        pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+        res.to_csv(dest + '/glm_batch.csv', index=False)
+
+    return res
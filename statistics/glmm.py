@@ -0,0 +1,307 @@
+#https://stats.idre.ucla.edu/other/mult-pkg/introduction-to-generalized-linear-mixed-models/
+#Breslow & Clayton 1993, Approximate inference in generalized linear mixed models
+
+import numpy as np
+import pandas as pd
+import pathlib #only Python 3.5+
+import scipy.sparse as sp
+from scipy import stats
+from scipy.sparse.linalg import splu
+from scipy.special import expit
+import statistics.get_ttest as gtt
+import statistics.glm as glm
+import utils.parallel as par
+
+
+'''
+Parameters
+----------
+
+labels : (n,) array like,
+         the level of the grouping factor for every row
+
+
+Returns
+-------
+
+Z : (n, q) scipy.sparse.csr_matrix,
+    the one-hot encoding of the levels, one column per level
+
+'''
+
+def indicator_matrix(labels):
+
+    levels, codes = np.unique(np.asarray(labels), return_inverse=True)
+    n = len(codes)
+
+    return sp.csr_matrix((np.ones(n), (np.arange(n), codes)), shape=(n, len(levels)))
+
+
+'''
+Parameters
+----------
+
+C : (p + Q, p + Q) scipy.sparse matrix,
+    the coefficient matrix of the mixed model equations, the columns of
+    the fixed effects first and then those of every grouping factor
+
+p : int,
+    the number of fixed effects
+
+bounds : (K + 1,) np.ndarray,
+         the first column of every grouping factor, followed by p + Q,
+         factor k has the columns bounds[k] to bounds[k + 1]
+
+
+Returns
+-------
+
+cdiag : (p + Q,) np.ndarray,
+        the diagonal of the inverse of C
+
+Sinv : (p', p') np.ndarray,
+       the inverse of the Schur complement, the block of the inverse of C for
+       the fixed effects and all grouping factors but the largest, in that order
+
+Notes
+-----
+
+Every row belongs to a single level of a grouping factor, so the block of
+a factor with itself is diagonal. The largest factor, e.g. the subject, is
+kept as that diagonal block D, while the fixed effects and the smaller
+factors, e.g. the season, form the dense p' x p' Schur complement
+S = C_FF - C_FR D^-1 C_RF. The inverse of C then has the block S^-1 for
+those, and the diagonal 1/d + rowsum((B S^-1) * B), with B = D^-1 C_RF, for
+the levels of the largest factor. Only S is ever inverted, so the cost is
+O(Q p'^2) rather than a solve for every level.
+
+'''
+
+def _inverse_diagonals(C, p, bounds):
+
+    C = sp.csc_matrix(C)
+    #the columns of the largest grouping factor
+    big = np.argmax(np.diff(bounds))
+    R = np.arange(bounds[big], bounds[big + 1])
+    F = np.setdiff1d(np.arange(C.shape[0]), R)
+
+    d = C.diagonal()[R]
+    C_RF = C[R][:, F].toarray()
+    B = C_RF / d[:, None]
+
+    S = C[F][:, F].toarray() - C_RF.T @ B
+    Sinv = np.linalg.inv(S)
+
+    cdiag = np.empty(C.shape[0])
+    cdiag[F] = np.diagonal(Sinv)
+    cdiag[R] = 1.0 / d + np.sum((B @ Sinv) * B, axis=1)
+
+    return (cdiag, Sinv)
+
+
+'''
+Parameters
+----------
+
+X : (n, p) np.ndarray,
+    the design matrix of the fixed effects, including the intercept
+
+y : (n,) np.ndarray,
+    the binary response
+
+Z_blocks : list of scipy.sparse matrices,
+           the (n, q_k) indicator matrix of every random intercept
+
+max_iter : int,
+           maximum number of PQL iterations
+
+tol : float,
+      convergence tolerance on the coefficients and variance components
+
+
+Returns
+-------
+
+beta : (p,) np.ndarray,
+       the fixed effects
+
+se : (p,) np.ndarray,
+     the standard errors of the fixed effects
+
+u : list of np.ndarray,
+    the predicted random intercepts of every grouping factor
+
+sig2 : (K,) np.ndarray,
+       the variance of every random intercept
+
+Notes
+-----
+
+Penalized quasi-likelihood. Every iteration linearizes the logistic model
+into a weighted linear mixed model on the working response, and solves
+Henderson's mixed model equations for the fixed and random effects at once.
+The equations are kept sparse and factorized with a sparse LU, so the cost
+grows with the number of rows and levels rather than their square.
+The variance components are updated with the EM step
+sig2_k = (u_k'u_k + tr(C^-1_kk)) / q_k, with the diagonal of the inverse
+found without forming it, see _inverse_diagonals.
+
+'''
+
+def pql_logistic(X, y, Z_blocks, max_iter=100, tol=1e-6):
+
+    n, p = X.shape
+    q = [Zk.shape[1] for Zk in Z_blocks]
+    Q = sum(q)
+    bounds = np.cumsum([p] + q)
+
+    A = sp.hstack([sp.csr_matrix(X)] + list(Z_blocks)).tocsr()
+
+    theta = np.zeros(p + Q)
+    sig2 = np.ones(len(q))
+    eps = 1e-10
+
+    for it in range(max_iter):
+        eta = A @ theta
+        mu = np.clip(expit(eta), eps, 1 - eps)
+        w = mu * (1 - mu)
+
+        #working response of the linearized model
+        z = eta + (y - mu) / w
+
+        #the random effects are penalized by the inverse of their variance
+        ginv = np.concatenate([np.zeros(p)] + [np.full(qk, 1.0 / s) for qk, s in zip(q, sig2)])
+        C = (A.T @ sp.diags(w) @ A + sp.diags(ginv)).tocsc()
+        lu = splu(C)
+
+        theta_new = lu.solve(A.T @ (w * z))
+
+        #diagonal of the inverse for the random effects block, needed for the variance update
+        cdiag, Sinv = _inverse_diagonals(C, p, bounds)
+
+        sig2_new = np.empty(len(q))
+        for k in range(len(q)):
+            uk = theta_new[bounds[k]:bounds[k + 1]]
+            tk = cdiag[bounds[k]:bounds[k + 1]]
+            sig2_new[k] = max((uk @ uk + tk.sum()) / q[k], 1e-8)
+
+        change = max(np.max(np.abs(theta_new - theta)), np.max(np.abs(sig2_new - sig2) / sig2))
+        theta = theta_new
+        sig2 = sig2_new
+
+        if change < tol:
+            break
+    else:
+        print('PQL did not converge in ' + str(max_iter) + ' iterations')
+
+    #covariance of the fixed effects from the fixed effects block of the inverse
+    se = np.sqrt(np.diagonal(Sinv)[:p])
+
+    u = [theta[bounds[k]:bounds[k + 1]] for k in range(len(q))]
+
+    return (theta[:p], se, u, sig2)
+
+
+'''
+Parameters
+----------
+
+args : tuple,
+       (threshold, df, random, terms), packed in a tuple so the fit
+       can be sent to a worker process
+
+
+Returns
+-------
+
+res : pandas DataFrame,
+      the fixed effects with Wald tests, followed by the variance of
+      every random intercept
+
+'''
+
+def _fit_threshold(args):
+
+    thr, df, random, terms = args
+
+    df = df.dropna(subset=terms + ['Group'])
+
+    X = np.column_stack([np.ones(len(df))] + [df[t].values.astype(float) for t in terms])
+    y = df['Group'].values.astype(float)
+    Z_blocks = [indicator_matrix(df[r].values) for r in random]
+
+    beta, se, u, sig2 = pql_logistic(X, y, Z_blocks)
+
+    z = beta / se
+    rows = []
+    for name, b, s, zz in zip(['(Intercept)'] + list(terms), beta, se, z):
+        rows.append([thr, name, b, s, zz, 2 * stats.norm.sf(abs(zz))])
+    for r, s2 in zip(random, sig2):
+        rows.append([thr, 'var(' + r + ')', s2, np.nan, np.nan, np.nan])
+
+    return pd.DataFrame(rows, columns=['Threshold', 'Term', 'Estimate', 'StdError', 'z', 'pval'])
+
+
+'''
+Parameters
+----------
+
+path : string,
+       the path to the directory with the estimate.??.csv files
+
+groupIDcsv : csv file,
+             the ID file used for the estimation, only needed when
+             a random intercept for the subject is wanted
+
+subject : string,
+          the column in groupIDcsv identifying the subject across sessions,
+          None for only a random intercept for the season
+
+jobs : int,
+       the number of worker processes the thresholds are spread over
+
+dest : string,
+       where the 'tests' folder with the resulting CSV file is written
+
+
+Returns
+-------
+
+res : pandas DataFrame,
+      the fixed effects and variance components of every threshold
+
+Notes
+-----
+
+Rather than splitting the data by season, as glm.glm does, all subjects
+are fitted together with season as a random intercept. One model is fitted
+per threshold, with the same fixed effects as the full model in glm.py.
+
+'''
+
+def glmm_main(path, groupIDcsv=None, subject=None, jobs=1, dest=None):
+
+    df = gtt.load_results(path)
+
+    df['Group'] = df['Group'].map({'Case': 1, 'Healthy Control': 0})
+
+    random = ['Season']
+    if subject != None:
+        #the subject index of the estimates is the row in the ID file
+        iddf = pd.read_csv(groupIDcsv)
+        df['Subject'] = iddf[subject].values[df['Unnamed: 0'].values]
+        random.append('Subject')
+
+    df = df.rename(index=str, columns=glm.RENAME)
+
+    tasks = [(thr, sub, random, glm.FULL_TERMS) for thr, sub in df.groupby('Threshold')]
+    res = pd.concat(par.parallel_map(_fit_threshold, tasks, jobs=jobs), ignore_index=True)
+
+    print(res.round(4).to_string(index=False))
+
+    if dest != None:
+        dest = dest + '/tests'
+        pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+        res.to_csv(dest + '/glmm.csv', index=False)
+
+    return res
@@ -0,0 +1,367 @@
+import numpy as np
+import pandas as pd
+import pathlib #only Python 3.5+
+from collections import OrderedDict
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+import utils.parallel as par
+
+
+'''
+Parameters
+----------
+
+x : (n1, E) np.ndarray,
+    the edge weights of the first group, one row per subject
+
+y : (n2, E) np.ndarray,
+    the edge weights of the second group, one row per subject
+
+
+Returns
+-------
+
+t : (E,) np.ndarray,
+    the Welch t-statistic for every edge
+
+Notes
+-----
+
+Same test as stats.ttest_ind(x, y, equal_var=False) in get_ttest.py,
+just computed for all edges at once instead of one column at a time.
+
+'''
+
+def edge_ttest(x, y):
+
+    n1 = x.shape[0]
+    n2 = y.shape[0]
+
+    v1 = x.var(axis=0, ddof=1)
+    v2 = y.var(axis=0, ddof=1)
+
+    se = np.sqrt(v1 / n1 + v2 / n2)
+
+    #edges with no variance in either group gets a t-value of zero,
+    #rather than a division by zero
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (x.mean(axis=0) - y.mean(axis=0)) / se
+    t[~np.isfinite(t)] = 0.0
+
+    return t
+
+
+'''
+Parameters
+----------
+
+t : (E,) np.ndarray,
+    the t-statistic for every edge in the upper triangle
+
+n : int,
+    the number of nodes in the network
+
+t_thresh : float,
+           the primary threshold applied to the t-statistics
+
+tail : string,
+       'right' for Case > Healthy Control, 'left' for Case < Healthy Control
+       and 'both' for testing the absolute t-value
+
+
+Returns
+-------
+
+labels : (N,) np.ndarray,
+         the component label of every node
+
+supra : (E,) np.ndarray,
+        boolean mask of the edges that survived the primary threshold
+
+sizes : np.ndarray,
+        the number of supra-threshold edges in each component
+        (indexed by the component label)
+
+'''
+
+def supra_components(t, n, t_thresh, tail='both'):
+
+    if tail == 'right':
+        supra = t > t_thresh
+    elif tail == 'left':
+        supra = t < -t_thresh
+    else:
+        supra = np.abs(t) > t_thresh
+
+    iu = np.triu_indices(n, 1)
+    rows = iu[0][supra]
+    cols = iu[1][supra]
+
+    #only the existence of the edge matters for the components
+    adj = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    ncomp, labels = connected_components(adj, directed=False)
+
+    #the size of a component is its number of edges (the NBS 'extent')
+    sizes = np.bincount(labels[rows], minlength=ncomp)
+
+    return (labels, supra, sizes)
+
+
+'''
+Parameters
+----------
+
+args : tuple,
+       (X, n_case, n_perm, seed, t_thresh, tail, n, block),
+       packed in a tuple so the chunk can be sent to a worker process
+
+Returns
+-------
+
+null : (n_perm,) np.ndarray,
+       the maximum component size of every permutation in this chunk
+
+Notes
+-----
+
+The group sums for a whole block of permutations are obtained with a single
+matrix product between a (block, S) label matrix and the (S, E) edge matrix,
+so the t-statistics are vectorized over both edges and permutations.
+The data is expected to be centered per edge beforehand, which keeps the
+sum of squares numerically stable.
+
+'''
+
+def _permutation_chunk(args):
+
+    X, n_case, n_perm, seed, t_thresh, tail, n, block = args
+
+    rng = np.random.default_rng(seed)
+
+    S = X.shape[0]
+    n_hc = S - n_case
+
+    #the group totals are the same for every permutation
+    X_sq = X * X
+    tot = X.sum(axis=0)
+    tot_sq = X_sq.sum(axis=0)
+
+    null = np.zeros(n_perm)
+    done = 0
+
+    while done < n_perm:
+        b = min(block, n_perm - done)
+
+        #random relabelling of the subjects, first n_case are the cases
+        perm = np.argsort(rng.random((b, S)), axis=1)[:, :n_case]
+        L = np.zeros((b, S))
+        L[np.arange(b)[:, None], perm] = 1.0
+
+        s1 = L @ X
+        q1 = L @ X_sq
+        s2 = tot - s1
+        q2 = tot_sq - q1
+
+        m1 = s1 / n_case
+        m2 = s2 / n_hc
+        v1 = (q1 - n_case * m1 * m1) / (n_case - 1)
+        v2 = (q2 - n_hc * m2 * m2) / (n_hc - 1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (m1 - m2) / np.sqrt(v1 / n_case + v2 / n_hc)
+        t[~np.isfinite(t)] = 0.0
+
+        for k in range(b):
+            sizes = supra_components(t[k], n, t_thresh, tail)[2]
+            null[done + k] = sizes.max() if len(sizes) else 0
+
+        done += b
+
+    return null
+
+
+'''
+Parameters
+----------
+
+cm_list : list of NxN np.ndarray,
+          the connectivity matrices, as returned from loadmatrix.conn_interface
+
+case : (S,) np.ndarray,
+       boolean mask of which matrices that belong to the Case group,
+       the remaining matrices are treated as the Healthy Control group
+
+t_thresh : float,
+           the primary threshold for the edge-wise t-statistics
+
+n_perm : int,
+         the number of permutations used for the null distribution
+
+tail : string,
+       'right', 'left' or 'both', see supra_components()
+
+jobs : int,
+       the number of worker processes the permutations are spread over
+
+seed : int,
+       seed for the random number generator, for reproducible p-values
+
+block : int,
+        the number of permutations computed in a single matrix product
+
+
+Returns
+-------
+
+res : OrderedDict,
+      'tvals' is the NxN matrix of edge-wise t-statistics,
+      'components' is a list of dicts for every observed component with
+      its edges, size and FWE corrected p-value, and 'null' holds the
+      maximum component sizes of the permutations
+
+Notes
+-----
+
+Network-Based Statistic (Zalesky et al. 2010). The test is performed
+on the Fisher transformed correlations, since the matrices coming from
+prepare_conn_matrix are Pearson coefficients.
+
+'''
+
+def nbs(cm_list, case, t_thresh=3.0, n_perm=5000, tail='both', jobs=1, seed=None, block=64):
+
+    n = len(cm_list[0])
+    iu = np.triu_indices(n, 1)
+
+    #stack the upper triangles into a (S, E) array, undo the tanh in
+    #prepare_conn_matrix to get back to Fisher Z values
+    X = np.array([cm[iu] for cm in cm_list])
+    X = np.arctanh(np.clip(X, -0.999999, 0.999999))
+
+    case = np.asarray(case, dtype=bool)
+    n_case = int(case.sum())
+    if n_case < 2 or len(case) - n_case < 2:
+        raise ValueError('Need at least two subjects in each group for the NBS')
+
+    #observed statistics and components
+    t = edge_ttest(X[case], X[~case])
+    labels, supra, sizes = supra_components(t, n, t_thresh, tail)
+
+    #the permutations are only affected by relabelling, so center each edge once
+    Xc = X - X.mean(axis=0)
+
+    #split the permutations into one chunk per worker, each with its own seed
+    jobs = max(1, jobs)
+    chunks = np.array_split(np.arange(n_perm), jobs)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    tasks = [(Xc, n_case, len(c), s, t_thresh, tail, n, block) for c, s in zip(chunks, seeds) if len(c)]
+
+    null = np.concatenate(par.parallel_map(_permutation_chunk, tasks, jobs=jobs))
+
+    #report every component which has at least one supra-threshold edge
+    components = []
+    edge_comp = labels[iu[0]]
+    for c in np.argsort(sizes)[::-1]:
+        if sizes[c] == 0:
+            break
+        mask = supra & (edge_comp == c)
+        comp = OrderedDict()
+        comp['size'] = int(sizes[c])
+        comp['pval'] = (np.sum(null >= sizes[c]) + 1) / (n_perm + 1)
+        comp['edges'] = list(zip(iu[0][mask], iu[1][mask]))
+        components.append(comp)
+
+    tvals = np.zeros((n, n))
+    tvals[iu] = t
+    tvals = tvals + tvals.T
+
+    res = OrderedDict()
+    res['tvals'] = tvals
+    res['components'] = components
+    res['null'] = null
+
+    return res
+
+
+'''
+Parameters
+----------
+
+cm_list : list of NxN np.ndarray,
+          the connectivity matrices, as returned from loadmatrix.conn_interface
+
+groupIDcsv : csv file
+             The accompying csv file to generate the ID tags for each
+             subject in the matrix file.
+
+s : string,
+    the season to test ('S' or 'W'), None uses both seasons
+
+dest : string,
+       the path where the 'nbs' folder with the resulting CSV files are written
+
+
+Returns
+-------
+
+res : OrderedDict,
+      the results from nbs()
+
+Notes
+-----
+
+Writes two CSV files to dest/nbs: S_nbs_components.csv with the size and
+p-value of every component, and S_nbs_edges.csv with the (zero-based)
+nodes, t-statistic and component of every supra-threshold edge.
+
+'''
+
+def nbs_main(cm_list, groupIDcsv, s=None, t_thresh=3.0, n_perm=5000, tail='both',
+             jobs=1, seed=None, dest=None):
+
+    iddf = pd.read_csv(groupIDcsv)
+
+    #every matrix must have its own row in the ID file, or the labels are shifted
+    if len(iddf) != len(cm_list):
+        print(' ')
+        print('**The ID file ' + str(groupIDcsv) + ' has ' + str(len(iddf)) + ' subjects, but there are '
+              + str(len(cm_list)) + ' matrices**')
+        exit()
+
+    #keep only the matrices of the Case and Healthy Control groups
+    keep = iddf['group'].isin(['Case', 'Healthy Control'])
+    if s != None:
+        keep = keep & (iddf['season'] == s)
+    keep = keep.values
+
+    mats = [cm for cm, k in zip(cm_list, keep) if k]
+    case = (iddf['group'].values[keep] == 'Case')
+
+    print('Running NBS on ' + str(len(mats)) + ' subjects with ' + str(n_perm) + ' permutations..')
+    res = nbs(mats, case, t_thresh=t_thresh, n_perm=n_perm, tail=tail, jobs=jobs, seed=seed)
+
+    for k, comp in enumerate(res['components']):
+        print('Component ' + str(k) + ' with ' + str(comp['size']) + ' edges, p-value: '
+              + str(round(comp['pval'], 6)))
+    if len(res['components']) == 0:
+        print('No edges survived the primary threshold of t = ' + str(t_thresh))
+
+    if dest != None:
+        dest = dest + '/nbs'
+        pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+
+        prefix = (s if s != None else 'all') + '_'
+
+        comp_rows = []
+        edge_rows = []
+        for k, comp in enumerate(res['components']):
+            comp_rows.append([k, comp['size'], comp['pval']])
+            for i, j in comp['edges']:
+                edge_rows.append([i, j, res['tvals'][i, j], k])
+
+        pd.DataFrame(comp_rows, columns=['Component', 'Size', 'pval']).to_csv(
+            dest + '/' + prefix + 'nbs_components.csv', index=False)
+        pd.DataFrame(edge_rows, columns=['Node1', 'Node2', 'T', 'Component']).to_csv(
+            dest + '/' + prefix + 'nbs_edges.csv', index=False)
+
+    return res
@@ -0,0 +1,323 @@
+import os
+import sys
+import json
+import socket
+import tempfile
+import traceback
+import socketserver
+from collections import OrderedDict
+
+#only the standard library is imported here, such that the client
+#in entry.py can forward a command without importing the pipeline
+
+
+#the number of prepared matrix sets the daemon keeps loaded, least recently used dropped first
+CACHE_SIZE = 4
+
+#the prepared matrices of the daemon, None when not running as a daemon
+_cache = None
+
+
+'''
+Parameters
+----------
+
+argv : list
+       the command line arguments, without the program name
+
+
+Returns
+-------
+
+path : string
+       the UNIX socket of the daemon: the value of -socket if given, otherwise
+       the FMRIPIPE_SOCKET environment variable, otherwise fmripipe.sock in
+       $XDG_RUNTIME_DIR, otherwise fmripipe.sock in a fmripipe-<uid> directory
+       of the temporary directory
+
+Notes
+-----
+
+$XDG_RUNTIME_DIR is only accessible to the user. The directory in the
+temporary directory is made by serve, with the same permissions.
+
+'''
+
+def socket_path(argv):
+
+    if '-socket' in argv and argv.index('-socket') + 1 < len(argv):
+        return argv[argv.index('-socket') + 1]
+
+    if os.environ.get('FMRIPIPE_SOCKET'):
+        return os.environ['FMRIPIPE_SOCKET']
+
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'fmripipe.sock')
+
+    return os.path.join(_temp_dir(), 'fmripipe.sock')
+
+
+#the directory of the socket when there is no $XDG_RUNTIME_DIR
+def _temp_dir():
+
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(tempfile.gettempdir(), 'fmripipe-' + str(uid))
+
+
+#makes the directory of the socket, only accessible to the user. The shared
+#temporary directory lets anyone make fmripipe-<uid> in advance, so that one
+#is refused if it belongs to someone else or others can write to it.
+def _private_dir(path):
+
+    d = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(d):
+        os.makedirs(d, mode=0o700)
+
+    st = os.stat(d)
+    if d == _temp_dir() and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        print('The directory of the socket is not private to this user: ' + d)
+        return False
+
+    return True
+
+
+#connects to the daemon, None if no daemon is listening on the socket
+def _connect(path):
+
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    return sock
+
+
+def _send(sock, msg):
+    sock.sendall((json.dumps(msg) + '\n').encode())
+
+
+'''
+Parameters
+----------
+
+argv : list
+       the command line arguments, without the program name
+
+
+Returns
+-------
+
+code : int
+       the exit code of the command run by the daemon, or None if the
+       command should run in this process instead: when no daemon is
+       running, when starting the daemon itself, or with -local
+
+Notes
+-----
+
+The output of the command is streamed back as the daemon prints it,
+including the progress bars. Relative paths are resolved by the daemon
+from the working directory of the client.
+
+'''
+
+def forward(argv):
+
+    if len(argv) == 0 or '-local' in argv:
+        return None
+
+    #starting the daemon runs here, stopping it is a request to the daemon
+    stop = argv[0] == 'serve' and '-stop' in argv
+    if argv[0] == 'serve' and not stop:
+        return None
+
+    sock = _connect(socket_path(argv))
+    if sock == None:
+        if stop:
+            print('No daemon is running on ' + socket_path(argv))
+            return 1
+        return None
+
+    with sock:
+        if stop:
+            _send(sock, {'stop': True})
+        else:
+            _send(sock, {'argv': argv, 'cwd': os.getcwd()})
+
+        for line in sock.makefile('r', encoding='utf-8'):
+            msg = json.loads(line)
+            if 'out' in msg:
+                sys.stdout.write(msg['out'])
+                sys.stdout.flush()
+            elif 'exit' in msg:
+                return msg['exit']
+
+    #the daemon went away before the command finished
+    print('The connection to the daemon was lost')
+    return 1
+
+
+'''
+Parameters
+----------
+
+files : list
+        the files the matrices are prepared from
+
+options : tuple
+          every other setting the matrices depend on, e.g. the cuts
+
+load : callable
+       prepares the matrices, called without arguments
+
+
+Returns
+-------
+
+prepared : the return value of load, from the cache of the daemon if the
+           files have not changed since they were loaded. Outside of the
+           daemon, load is simply called.
+
+'''
+
+def cached(files, options, load):
+
+    if _cache is None:
+        return load()
+
+    key = (tuple((f, os.path.getmtime(f)) for f in files), options)
+    if key in _cache:
+        print('Using the matrices already loaded by the daemon')
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    _cache[key] = load()
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+    return _cache[key]
+
+
+#sends everything written to it over the socket, in place of stdout and stderr
+class _SocketWriter:
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, s):
+        if s:
+            _send(self.sock, {'out': s})
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+
+        line = self.rfile.readline()
+        #a client checking whether the daemon is running
+        if not line:
+            return
+        msg = json.loads(line)
+
+        if msg.get('stop'):
+            _send(self.request, {'out': 'Stopping the daemon\n'})
+            _send(self.request, {'exit': 0})
+            self.server.stopping = True
+            return
+
+        writer = _SocketWriter(self.request)
+        sys.stdout, sys.stderr = writer, writer
+        code = 0
+        try:
+            os.chdir(msg['cwd'])
+            self.server.run(self.server.parser.parse_args(msg['argv']))
+        #exit() on bad input, and argparse on bad arguments
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+            os.chdir(self.server.home)
+
+        _send(self.request, {'exit': code})
+
+
+'''
+Parameters
+----------
+
+run : callable
+      runs a single command, given the parsed arguments
+
+parser : argparse.ArgumentParser
+         the parser of entry.py, for the arguments of every command
+
+path : string
+       the UNIX socket to listen on, see socket_path
+
+Notes
+-----
+
+The commands are run one at a time, in the order they arrive, in this
+process, so the libraries are only imported once and the prepared
+matrices are kept between the commands, see cached. A command that fails
+or calls exit() only ends that command, not the daemon.
+
+'''
+
+def serve(run, parser, path):
+
+    global _cache
+
+    if not hasattr(socket, 'AF_UNIX'):
+        print('The daemon needs UNIX sockets, which this platform does not have')
+        return
+
+    #a socket left behind by a daemon that did not shut down
+    if os.path.exists(path):
+        sock = _connect(path)
+        if sock != None:
+            sock.close()
+            print('A daemon is already running on ' + path)
+            return
+        os.remove(path)
+
+    if not _private_dir(path):
+        return
+
+    _cache = OrderedDict()
+
+    #the socket is created by bind, so it is only accessible to the user from
+    #the start, rather than after a chmod that leaves a window open
+    mask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(path, _Handler)
+    finally:
+        os.umask(mask)
+    server.run = run
+    server.parser = parser
+    server.home = os.getcwd()
+    server.stopping = False
+
+    print('Serving on ' + path + ', stop with: entry.py serve -stop')
+    try:
+        while not server.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+    print('Daemon stopped')
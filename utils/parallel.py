@@ -0,0 +1,61 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import utils.resources as res
+
+
+'''
+Parameters
+----------
+
+func : callable,
+       a function defined at module level (so it can be pickled),
+       taking a single argument
+
+items : iterable,
+        the arguments that func will be applied to, one at a time
+
+jobs : int,
+       the number of worker processes to use. With jobs <= 1 the items
+       are processed one after another in the current process.
+
+threads : int,
+          the number of BLAS threads of every worker process. None to split
+          the cores evenly between the workers, such that they do not
+          oversubscribe the cores.
+
+
+Returns
+-------
+
+results : list,
+          the return values of func, in the same order as items
+
+Notes
+-----
+
+Small wrapper around concurrent.futures, such that every stage of the
+pipeline can be made parallel by just passing along a 'jobs' argument,
+while still being easy to debug when running serially.
+The BLAS threads of every worker are pinned as it starts, see
+resources.limit_blas_threads.
+
+'''
+
+def parallel_map(func, items, jobs=1, threads=None):
+
+    items = list(items)
+
+    #run serially if only a single job is asked for,
+    #no need to pay for starting up worker processes
+    if jobs is None or jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    workers = min(jobs, len(items))
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=res.limit_blas_threads, initargs=(threads,)) as executor:
+        results = list(executor.map(func, items))
+
+    return results
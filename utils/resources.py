@@ -0,0 +1,232 @@
+import os
+from collections import OrderedDict
+
+#threadpoolctl is optional, it is only needed to pin the BLAS
+#threads of a library that has already been loaded
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+
+#the environment variables read by the common BLAS and OpenMP libraries
+BLAS_THREAD_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                    'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+#the number of NxN float64 matrices alive at once while estimating a single
+#subject, see task_memory for how they were found
+BASE_MATRICES = 16
+NODAL_MATRICES = 2
+RICHCLUB_MATRICES = 2
+RESTART_MATRICES = 4
+
+#the matrices per subject the main process keeps while the workers run: the
+#loaded matrix, the packed thresholded graph (half a matrix) and the dense
+#stack of the spectral measures
+STACK_MATRICES = 2.5
+
+#the encoding of a subject for -keep, the packed weights, the int32 order of
+#the removals and the kept flags, about 0.8 of a matrix
+ENCODING_MATRICES = 1
+
+#the trace of thresholding a single subject, a Python tuple per attempted
+#removal, about 7.4 matrices at a 10% threshold
+TRACE_MATRICES = 8
+
+#the batched eigendecomposition holds the Laplacians, the eigenvectors and
+#the LAPACK workspace for every subject of a chunk
+SPECTRAL_MATRICES = 4
+
+
+'''
+Parameters
+----------
+
+threads : int
+          the number of BLAS threads allowed in this process
+
+Notes
+-----
+
+Used as the initializer of the worker processes, see parallel.parallel_map,
+such that a worker does not start as many BLAS threads as there are cores.
+A BLAS library that is already loaded, e.g. by a worker forked from a
+process that imported NumPy, reads the environment variables only once, so
+it can only be pinned through threadpoolctl. Without threadpoolctl, the
+variables still hold for any BLAS loaded later on.
+
+'''
+
+def limit_blas_threads(threads=1):
+
+    threads = max(1, int(threads))
+
+    for var in BLAS_THREAD_VARS:
+        os.environ[var] = str(threads)
+
+    if threadpoolctl is not None:
+        threadpoolctl.threadpool_limits(limits=threads)
+
+
+'''
+Parameters
+----------
+
+size : string or int
+       a memory size, either in bytes or with the suffix K, M, G or T,
+       e.g. '512M' or '8G'
+
+
+Returns
+-------
+
+nbytes : int
+         the size in bytes
+
+'''
+
+def parse_memory(size):
+
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+
+    return int(float(size))
+
+
+#the memory available to the pipeline, the physical memory if it cannot be read
+def available_memory():
+
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+'''
+Parameters
+----------
+
+n : int
+    the number of nodes
+
+nodal, restarts, richclub :
+    the measures selected, as passed on to graph_estimates
+
+
+Returns
+-------
+
+nbytes : int
+         the estimated peak memory of estimating a single subject
+
+Notes
+-----
+
+The matrix counts are the peak of tracemalloc, in units of N*N*8 bytes,
+around graph_estimates(None, 0.3, backend, P=threshold_graph(A, 0.3)) of
+random symmetric A, rounded up. At N = 150 and N = 300, with either backend,
+the peak was about 13 matrices, 2 more with nodal, 1 more with 5 restarts
+and none more with richclub. The rounding leaves room for the LAPACK
+workspace, which tracemalloc does not see, and for more restarts.
+
+'''
+
+def task_memory(n, nodal=False, restarts=0, richclub=False):
+
+    matrices = BASE_MATRICES
+    if nodal:
+        matrices += NODAL_MATRICES
+    if richclub:
+        matrices += RICHCLUB_MATRICES
+    if restarts > 0:
+        matrices += RESTART_MATRICES
+
+    return matrices * n * n * 8
+
+
+'''
+Parameters
+----------
+
+n : int
+    the number of nodes
+
+subjects : int
+           the number of subjects
+
+jobs : int
+       the number of worker processes asked for
+
+budget : string or int
+         the memory ceiling, see parse_memory. None for the available memory.
+
+nodal, restarts, richclub :
+    the measures selected, as passed on to graph_estimates
+
+keep : bool
+       if True, the encodings of every subject for -keep are kept as well
+
+
+Returns
+-------
+
+plan : OrderedDict
+       'jobs'    : the number of worker processes that fit in the budget
+       'chunk'   : the number of subjects per batched eigendecomposition
+       'threads' : the number of BLAS threads per worker process
+       'budget'  : the memory ceiling in bytes
+
+Notes
+-----
+
+The matrices of all subjects, their packed graphs and the encodings for
+-keep stay in the main process for the whole run, the dense stack and the
+trace of the subject being thresholded for part of it. All of them are
+counted, as STACK_MATRICES, ENCODING_MATRICES and TRACE_MATRICES. What is left of the budget is shared by the
+workers, each estimating a subject at a time, and by the batches of the
+spectral measures. The cores are split evenly between the workers, such
+that jobs times the BLAS threads never exceeds the number of cores.
+
+'''
+
+def plan_resources(n, subjects, jobs=1, budget=None, nodal=False, restarts=0, richclub=False, keep=False):
+
+    if budget == None:
+        budget = available_memory()
+    else:
+        budget = parse_memory(budget)
+
+    #what the main process holds, see the notes
+    per_subject = STACK_MATRICES + (ENCODING_MATRICES if keep else 0)
+    stack = int((subjects * per_subject + TRACE_MATRICES) * n * n * 8)
+    task = task_memory(n, nodal, restarts, richclub)
+    free = budget - stack
+
+    jobs = max(1, jobs if jobs != None else 1)
+    if free < task:
+        print('The memory budget of ' + str(budget // 2 ** 20) + 'MB is too small for '
+              + str(subjects) + ' subjects of ' + str(n) + ' nodes, running with a single job')
+        jobs = 1
+    elif free // task < jobs:
+        print('Running ' + str(free // task) + ' of the ' + str(jobs)
+              + ' jobs to stay within the memory budget')
+        jobs = int(free // task)
+
+    chunk = int(max(1, min(subjects, free // (SPECTRAL_MATRICES * n * n * 8))))
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+
+    plan = OrderedDict()
+    plan['jobs'] = jobs
+    plan['chunk'] = chunk
+    plan['threads'] = threads
+    plan['budget'] = budget
+
+    return plan
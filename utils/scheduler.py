@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import pathlib #only Python 3.5+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.optimize import nnls
+import utils.progressbar as pb #progressbar courtesy of stackoverflow
+import utils.resources as res
+
+
+#the run history is kept next to the estimate files
+HISTORY_FILE = 'run_history.json'
+
+#the newest timings kept for every setting
+HISTORY_LIMIT = 500
+
+#the fewest timings needed before the cost model is fitted to them
+MIN_HISTORY = 8
+
+#seconds per feature, fitted on graph_estimates of 30 to 100 nodes at
+#densities from 20% to 50%, used until there is enough history
+DEFAULT_COEFFS = np.array([1.2e-4, 2e-7, 7.7e-8, 0.0])
+
+
+'''
+Parameters
+----------
+
+n : int
+    the number of nodes
+
+links : int
+        the number of links left after thresholding
+
+reinserted : int
+             the number of links threshold_connected had to reinsert to
+             keep the graph connected
+
+
+Returns
+-------
+
+f : (4,) np.ndarray
+    the features of the cost model: N^2 (modularity, clustering), N times
+    the links (the shortest paths and the rewiring of the random network),
+    N^3 (the dense distance matrices) and N times the reinserted links
+
+'''
+
+def task_features(n, links, reinserted=0):
+    return np.array([n * n, n * links, n ** 3, n * reinserted], dtype=float)
+
+
+#the run history of path/auto_results, an empty history if there is none yet
+def load_history(path):
+
+    try:
+        with open(path + '/auto_results/' + HISTORY_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+'''
+Parameters
+----------
+
+path : string
+       the output path, the history is written to path/auto_results/run_history.json
+
+key : string
+      the settings the timings were recorded with, e.g. the backend and the
+      measures selected, as the costs of different settings are not comparable
+
+features : (T, 4) array like
+           the features of every task, see task_features
+
+seconds : (T,) array like
+          the measured run time of every task
+
+'''
+
+def save_history(path, key, features, seconds):
+
+    history = load_history(path)
+
+    records = history.get(key, [])
+    records += [list(f) + [s] for f, s in zip(np.asarray(features).tolist(), seconds)]
+    history[key] = records[-HISTORY_LIMIT:]
+
+    dest = path + '/auto_results'
+    pathlib.Path(dest).mkdir(parents=True, exist_ok=True)
+    with open(dest + '/' + HISTORY_FILE, 'w') as f:
+        json.dump(history, f)
+
+
+'''
+Parameters
+----------
+
+records : list
+          the history of a single setting, every record is the features
+          followed by the measured seconds
+
+
+Returns
+-------
+
+coeffs : (4,) np.ndarray
+         the seconds per feature, non-negative least squares on the history,
+         or DEFAULT_COEFFS if there are fewer than MIN_HISTORY records
+
+'''
+
+def fit_cost_model(records):
+
+    if len(records) < MIN_HISTORY:
+        return DEFAULT_COEFFS
+
+    R = np.asarray(records, dtype=float)
+    F, t = R[:, :-1], R[:, -1]
+
+    #scale the features, as N^3 is orders of magnitude above the others
+    scale = np.abs(F).max(axis=0)
+    scale[scale == 0] = 1.0
+    coeffs = nnls(F / scale, t)[0] / scale
+
+    if not np.any(coeffs > 0):
+        return DEFAULT_COEFFS
+
+    return coeffs
+
+
+#seconds as e.g. '1h02m', '3m20s' or '45s'
+def format_eta(seconds):
+
+    if seconds == None or not np.isfinite(seconds):
+        return '--'
+
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return str(seconds // 3600) + 'h' + str(seconds % 3600 // 60).zfill(2) + 'm'
+    if seconds >= 60:
+        return str(seconds // 60) + 'm' + str(seconds % 60).zfill(2) + 's'
+    return str(seconds) + 's'
+
+
+#runs a task in a worker, timed there such that the time spent waiting in the queue is left out.
+#np.random is seeded for the task itself, as bctpy draws from it, e.g. for the random
+#networks of the small-worldness, and restored afterwards for a task run in the main process
+def _timed_task(args):
+
+    func, item, seed = args
+
+    state = np.random.get_state()
+    np.random.seed(seed)
+
+    start = time.perf_counter()
+    try:
+        out = func(item)
+    finally:
+        np.random.set_state(state)
+
+    return (out, time.perf_counter() - start)
+
+
+#the seed of the item with index k, from the seed of the whole run
+def task_seed(seed, k):
+    return int(np.random.SeedSequence([seed, k]).generate_state(1)[0])
+
+
+'''
+Parameters
+----------
+
+func : callable,
+       a function defined at module level (so it can be pickled),
+       taking a single argument
+
+items : list,
+        the arguments that func will be applied to, one at a time
+
+costs : (len(items),) array like
+        the predicted seconds of every item, e.g. from task_features and fit_cost_model
+
+jobs : int,
+       the number of worker processes to use. With jobs <= 1 the items
+       are processed one after another in the current process.
+
+threads : int,
+          the number of BLAS threads of every worker process, None to split
+          the cores evenly between the workers
+
+seed : int,
+       the seed of the run. Every item gets its own seed from it and its
+       index, see task_seed, so the results do not depend on which worker
+       runs an item or in which order.
+
+
+Returns
+-------
+
+results : list,
+          the return values of func, in the same order as items
+
+seconds : list,
+          the measured run time of every item, in the same order as items
+
+Notes
+-----
+
+The items are dispatched longest-first, such that the most expensive
+items do not end up last with all the other workers idle. The progress
+bar counts the predicted cost of the finished items, from all workers,
+rather than their number. The ETA is the remaining predicted cost times
+the wall time spent per unit of cost so far, so it corrects itself when
+the cost model is off by a constant factor.
+
+'''
+
+def schedule(func, items, costs, jobs=1, threads=None, seed=0):
+
+    items = list(items)
+    if len(items) == 0:
+        return ([], [])
+
+    costs = np.maximum(np.asarray(costs, dtype=float), 1e-12)
+    total = costs.sum()
+
+    #longest-first, ties in the given order
+    order = np.argsort(-costs, kind='stable')
+
+    results = [None] * len(items)
+    seconds = [0.0] * len(items)
+
+    serial = jobs is None or jobs <= 1 or len(items) <= 1
+    workers = 1 if serial else min(jobs, len(items))
+
+    start = time.perf_counter()
+    done = 0.0
+    finished = 0
+    #the costs are in seconds, so before any item is done the ETA is the model's own
+    suffix = ('Complete, ETA ' + format_eta(total / workers)).ljust(20)
+    pb.printProgressBar(0, 1000, prefix = 'Progress:', suffix = suffix, length = 50)
+
+    def progress(k):
+        nonlocal done, finished
+        done += costs[k]
+        finished += 1
+        eta = (total - done) * (time.perf_counter() - start) / done
+        #the suffix is padded, as a shorter ETA would leave characters behind
+        suffix = ('Complete, ETA ' + format_eta(eta)).ljust(20)
+        #on a whole number scale, as floats can end the bar a step short,
+        #and the last item gives exactly the total, which ends the bar
+        step = 1000 if finished == len(items) else int(1000 * done / total)
+        pb.printProgressBar(step, 1000, prefix = 'Progress:', suffix = suffix, length = 50)
+
+    #run serially if only a single job is asked for,
+    #no need to pay for starting up worker processes
+    if serial:
+        for k in order:
+            results[k], seconds[k] = _timed_task((func, items[k], task_seed(seed, k)))
+            progress(k)
+        return (results, seconds)
+
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=res.limit_blas_threads, initargs=(threads,)) as executor:
+        #the queue is served in the order the items are submitted
+        futures = {executor.submit(_timed_task, (func, items[k], task_seed(seed, k))): k for k in order}
+        for fut in as_completed(futures):
+            k = futures[fut]
+            results[k], seconds[k] = fut.result()
+            progress(k)
+
+    return (results, seconds)